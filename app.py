@@ -1,11 +1,33 @@
 # app.py
-from flask import Flask, render_template, jsonify, session, redirect, url_for, request # type: ignore
+"""
+Web application. Importing this module has no side effect on the DB or the
+MQTT broker: create_app() (or `python app.py`) starts them in a background
+greenlet on the server's eventlet hub, so the HTTP server listens right away.
+"""
+import time
+_import_start = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, jsonify, session, redirect, url_for, request, stream_with_context # type: ignore
 from flask_socketio import SocketIO # type: ignore
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
-from mqtt_client import init_mqtt, dashboard_data, last_messages
+from mqtt_client import init_mqtt, last_messages, restore_state, reload_rules, MQTT_ROLE
 import eventlet
+from eventlet import tpool
+import logging
+import threading
 import database
+import serialization
+import export
+import itertools
+import math
+from governor import governor, QueryUnavailable
+from eventlog import event_log
+from liveseries import live_series
+from outbox import outboxes
+from staleness import stale_detector
+from rules import rule_engine, validate_filter, OPERATORS, parse_number
+from profiler import ProfileSession, ProfilerBusy, PROFILE_DEFAULT_INTERVAL, request_timer
 import os
 
 app = Flask(__name__)
@@ -14,14 +36,58 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*")
 
+# Fast JSON (native datetime handling) + gzip/brotli for /api/* responses
+serialization.init_app(app)
+
 # Admin password
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'jesuisdavid')
 
-# Initialize DB
-database.init_db()
+# Set by start_services()
+mqtt_client = None
+_start_lock = threading.Lock()
+startup = {"role": MQTT_ROLE, "ready": False, "started": False}
+
+def _prepare_state():
+    """Blocking DB part of the startup: schema migrations, then the in-memory state."""
+    start = time.perf_counter()
+    try:
+        database.init_db()
+    except Exception as e:
+        logging.error(f"Erreur migration du schéma: {e}")
+    startup["schema_ms"] = round((time.perf_counter() - start) * 1000)
+    restore_state()
+    startup["state_ms"] = round((time.perf_counter() - start) * 1000) - startup["schema_ms"]
+
+def start_services():
+    """Migrate the schema, restore the in-memory state, connect MQTT (once).
+
+    Runs as a greenlet on the server's hub (create_app): the DB work goes to
+    eventlet's native thread pool, so the HTTP server keeps answering while
+    the DB is slow or down, and the MQTT green loop (MQTT_LOOP_MODE=eventlet)
+    and the Socket.IO dispatcher are spawned on the hub that serves requests.
+    """
+    global mqtt_client
+    with _start_lock:
+        if startup["started"]:
+            return
+        startup["started"] = True
+    tpool.execute(_prepare_state)
+    # Pushed events go through bounded per-client queues (slow-consumer protection)
+    outboxes.start(socketio)
+    mqtt_client = init_mqtt(socketio)
+    startup["ready_ms"] = round((time.perf_counter() - _import_start) * 1000)
+    startup["ready"] = True
+    logging.info("Démarrage terminé (rôle %s) en %d ms", MQTT_ROLE, startup["ready_ms"])
+
+def create_app(start=True):
+    """App factory: returns the app, with the DB and MQTT started in the background.
 
-# Initialize MQTT with SocketIO instance
-mqtt_client = init_mqtt(socketio)
+    Call it from the thread that runs the server: the startup greenlet runs
+    once that thread's hub does.
+    """
+    if start:
+        socketio.start_background_task(start_services)
+    return app
 
 from datetime import datetime, timezone
 
@@ -59,45 +125,107 @@ def delay_humain(timestamp_iso):
 
 @app.route("/")
 def dashboard():
-    return render_template("dashboard.html", dashboard=dashboard_data, delay=delay_humain, messages=last_messages)
+    # Read the sequence first: events racing with the render are replayed, never missed
+    seq = event_log.seq
+    return render_template("dashboard.html", dashboard=live_series.snapshot(), delay=delay_humain, messages=last_messages, seq=seq,
+                           stale=stale_detector.stale_keys())
+
+def governed(key, fn, *args):
+    """Run an analysis query through the governor; returns a JSON response.
+
+    A stale (last good) result is flagged with the X-Analysis-Stale header.
+    """
+    try:
+        result, stale = governor.run(key, fn, *args)
+    except QueryUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    response = jsonify(result)
+    response.headers['X-Analysis-Stale'] = 'true' if stale else 'false'
+    return response
 
 @app.route("/analysis")
 def analysis():
-    global_stats = database.get_mqtt_analysis_global()
-    projects = database.get_mqtt_analysis_projects()
-    return render_template("analysis.html", global_stats=global_stats, projects=projects)
+    try:
+        global_stats, stale_global = governor.run("global", database.get_mqtt_analysis_global)
+        projects, stale_projects = governor.run("projects", database.get_mqtt_analysis_projects)
+    except QueryUnavailable:
+        return "Analyse temporairement indisponible, réessayez dans quelques secondes.", 503
+    return render_template("analysis.html", global_stats=global_stats, projects=projects,
+                           stale=stale_global or stale_projects)
 
 @app.route("/api/mqtt/global")
 def api_mqtt_global():
     """API endpoint for global MQTT stats"""
-    return jsonify(database.get_mqtt_analysis_global())
+    return governed("global", database.get_mqtt_analysis_global)
 
 @app.route("/api/mqtt/projects")
 def api_mqtt_projects():
     """API endpoint for all projects analysis"""
-    return jsonify(database.get_mqtt_analysis_projects())
+    return governed("projects", database.get_mqtt_analysis_projects)
 
 @app.route("/api/mqtt/project/<project_name>")
 def api_mqtt_project_detail(project_name):
     """API endpoint for specific project details"""
-    details = database.get_mqtt_project_details(project_name)
-    # Convert datetime objects to strings
-    if details['stats']:
-        if details['stats']['first_seen']:
-            details['stats']['first_seen'] = details['stats']['first_seen'].isoformat()
-        if details['stats']['last_seen']:
-            details['stats']['last_seen'] = details['stats']['last_seen'].isoformat()
-    for topic in details['top_topics']:
-        if topic['last_seen']:
-            topic['last_seen'] = topic['last_seen'].isoformat()
-            
-    # Convert recent messages timestamps
-    if 'recent_messages' in details:
-        for msg in details['recent_messages']:
-            if msg['timestamp']:
-                msg['timestamp'] = msg['timestamp'].isoformat()
-                
-    return jsonify(details)
+    return governed(f"project:{project_name}", database.get_mqtt_project_details, project_name)
+
+# Page size bounds for the message browser
+BROWSE_DEFAULT_LIMIT = 50
+BROWSE_MAX_LIMIT = 200
+
+@app.route("/api/mqtt/messages")
+def api_mqtt_messages():
+    """Keyset-paginated browse of mqtt_messages.
+
+    Filters: ?project=, ?topic_prefix=, ?category=, ?compliant=0|1
+    Paging:  ?limit=N and ?cursor=<next_cursor of the previous page>
+    """
+    compliant = request.args.get('compliant')
+    if compliant not in (None, '', '0', '1'):
+        return jsonify({"error": "compliant must be 0 or 1"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', BROWSE_DEFAULT_LIMIT)), BROWSE_MAX_LIMIT))
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            database.decode_cursor(cursor)
+    except ValueError:
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    try:
+        messages, next_cursor = governor.execute(
+            "browse", database.browse_mqtt_messages,
+            request.args.get('project') or None,
+            request.args.get('topic_prefix') or None,
+            request.args.get('category') or None,
+            None if compliant in (None, '') else compliant == '1',
+            cursor, limit)
+    except QueryUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"messages": messages, "next_cursor": next_cursor})
+
+@app.route("/api/stats/governor")
+def get_governor_stats():
+    """Counters of the analysis query governor (rejected, timed out, stale...)"""
+    return jsonify(governor.stats())
+
+@app.route("/api/stats/socketio")
+def get_socketio_stats():
+    """Per-client Socket.IO outbound queues (depth, drops, resync collapses)"""
+    return jsonify(outboxes.stats())
+
+@app.route("/api/stats/rules")
+def get_rules_stats():
+    """Alert rule engine counters (rules loaded, messages evaluated, alerts fired / in cooldown)"""
+    return jsonify(rule_engine.stats())
+
+@app.route("/api/stats/stale")
+def get_stale_stats():
+    """Silent sensors detected by the timing wheel (counts, per module, longest silences)"""
+    return jsonify(stale_detector.stats())
+
+@app.route("/api/stats/startup")
+def get_startup_stats():
+    """Cold-start timings (import, schema, state restore) and readiness"""
+    return jsonify(startup)
 
 @app.route("/socketio-test")
 def socketio_test():
@@ -108,10 +236,49 @@ def socketio_test():
 def get_dashboard_data():
     """Get current dashboard data for polling"""
     return jsonify({
-        "dashboard": dashboard_data,
+        "dashboard": live_series.snapshot(),
         "timestamp": datetime.now().isoformat()
     })
 
+def resync_payload(since):
+    """Events missed since `since`, or a full snapshot if the replay log does not reach back."""
+    seq, events = event_log.since(since)
+    if events is not None:
+        return {"seq": seq, "events": events}
+    return {
+        "seq": seq,
+        "snapshot": {
+            "dashboard": live_series.snapshot(),
+            "messages": list(last_messages)[:10],
+            "stale": [list(key) for key in stale_detector.stale_keys()],
+        },
+    }
+
+@app.route("/api/dashboard/events")
+def get_dashboard_events():
+    """Resync for clients whose socket is down: ?since=<last seq seen>"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"error": "Missing since"}), 400
+    return jsonify(resync_payload(since))
+
+@socketio.on('connect')
+def on_connect():
+    outboxes.connect(request.sid)
+
+@socketio.on('disconnect')
+def on_disconnect(reason=None):
+    outboxes.disconnect(request.sid)
+
+@socketio.on('resync')
+def on_resync(data):
+    """Socket.IO resync after a reconnect or a sequence gap (returned as the ack)."""
+    try:
+        since = int((data or {}).get('since', 0))
+    except (TypeError, ValueError):
+        since = 0
+    return resync_payload(since)
+
 @app.route("/api/dashboard/messages")
 def get_dashboard_messages():
     """Get recent MQTT messages for polling"""
@@ -126,6 +293,82 @@ def get_history(module, variable):
     data = database.get_history(module, variable)
     return jsonify(data)
 
+# Upper bounds for the batch history endpoint
+HISTORY_BATCH_MAX_SERIES = 500
+HISTORY_BATCH_MAX_LIMIT = 100
+
+@app.route("/api/history/batch", methods=["GET", "POST"])
+def get_history_batch():
+    """History of many series in one request (dashboard sparklines).
+
+    GET  ?module=<module>[&limit=N]  or  ?series=<module>:<variable> (repeated)
+    POST {"series": [{"module": ..., "variable": ...}, ...], "module": ..., "limit": N}
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        series = [(s.get('module'), s.get('variable')) for s in data.get('series', []) if isinstance(s, dict)]
+        module = data.get('module')
+        limit = data.get('limit', HISTORY_BATCH_MAX_LIMIT)
+    else:
+        series = [tuple(s.split(':', 1)) for s in request.args.getlist('series') if ':' in s]
+        module = request.args.get('module')
+        limit = request.args.get('limit', HISTORY_BATCH_MAX_LIMIT)
+
+    series = [(m, v) for m, v in series if m and v]
+    if not series and not module:
+        return jsonify({"error": "Missing series or module"}), 400
+    if len(series) > HISTORY_BATCH_MAX_SERIES:
+        return jsonify({"error": f"Too many series (max {HISTORY_BATCH_MAX_SERIES})"}), 400
+    try:
+        limit = max(1, min(int(limit), HISTORY_BATCH_MAX_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid limit"}), 400
+
+    return jsonify(database.get_history_batch(series=series, module=module, limit=limit))
+
+def export_response(rows, name, fmt):
+    """Stream `rows` (header first) as a chunked CSV/NDJSON download."""
+    # Pull the header now so connection errors surface before streaming starts
+    rows = itertools.chain([next(rows)], rows)
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(stream_with_context(export.encode(rows, fmt)),
+                    mimetype=export.FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def export_params():
+    """(start, end, format) from the query string, or raise ValueError."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        raise ValueError(f"Unknown format (expected: {', '.join(export.FORMATS)})")
+    start, end = export.parse_range(request.args.get('start'), request.args.get('end'))
+    return start, end, fmt
+
+@app.route("/api/export/measurements")
+def export_measurements():
+    """Stream measurements of ?module= [&variable=] [&start=&end=] as ?format=csv|ndjson"""
+    module = request.args.get('module')
+    if not module:
+        return jsonify({"error": "Missing module"}), 400
+    try:
+        start, end, fmt = export_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = database.iter_measurements(module, start, end, request.args.get('variable'))
+    return export_response(rows, f"measurements_{module}", fmt)
+
+@app.route("/api/export/mqtt_messages")
+def export_mqtt_messages():
+    """Stream mqtt_messages of ?project= [&start=&end=] as ?format=csv|ndjson"""
+    project = request.args.get('project')
+    if not project:
+        return jsonify({"error": "Missing project"}), 400
+    try:
+        start, end, fmt = export_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = database.iter_mqtt_messages(project, start, end)
+    return export_response(rows, f"mqtt_messages_{project}", fmt)
+
 @app.route("/api/stats/messages")
 def get_message_stats():
     data = database.get_message_stats()
@@ -140,22 +383,10 @@ def get_publication_stats():
 @app.route("/api/stats/rate-limit")
 def get_rate_limit_status():
     """Get current rate limit status for each module"""
-    from mqtt_client import last_save_time, RATE_LIMIT_SECONDS
-    from datetime import datetime
+    from mqtt_client import RATE_LIMIT_SECONDS
+    import time
     
-    status = []
-    for key, last_time in last_save_time.items():
-        module, variable = key.split(':', 1)
-        time_since = (datetime.now() - last_time).total_seconds()
-        is_limited = time_since < RATE_LIMIT_SECONDS
-        
-        status.append({
-            "module": module,
-            "variable": variable,
-            "last_save": last_time.isoformat(),
-            "seconds_since": round(time_since, 1),
-            "is_limited": is_limited
-        })
+    status = live_series.save_status(RATE_LIMIT_SECONDS, time.time())
     
     # Group by module
     grouped = {}
@@ -167,6 +398,35 @@ def get_rate_limit_status():
     
     return jsonify(grouped)
 
+@app.route("/api/stats/live-series")
+def get_live_series_stats():
+    """Size, memory and evictions of the live dashboard series registry"""
+    return jsonify(live_series.stats())
+
+@app.route("/api/stats/hot-tier")
+def get_hot_tier_stats():
+    """Memory accounting of the in-memory measurements hot tier"""
+    from hottier import hot_tier
+    return jsonify(hot_tier.stats())
+
+@app.route("/api/stats/logging")
+def get_logging_stats():
+    """Async logging queue: dropped records and sampled-out per-message logs"""
+    import logconfig
+    return jsonify(logconfig.stats())
+
+@app.route("/api/stats/spool")
+def get_spool_stats():
+    """DB circuit breaker state and on-disk spool of writes made during outages"""
+    from spool import spool, breaker
+    return jsonify(dict(spool.stats(), circuit=breaker.state, circuit_opened=breaker.opened_count))
+
+@app.route("/api/stats/throttle")
+def get_throttle_status():
+    """Projects/topics whose traffic exceeded the ingest token buckets"""
+    from throttle import throttle
+    return jsonify(throttle.snapshot())
+
 # --- Test Page Routes (for students) ---
 @app.route("/test")
 def test_page():
@@ -186,6 +446,8 @@ def test_publish():
     
     # Publish to MQTT with correct topic format: bzh/mecatro/dashboard/<project>/<variable>
     topic = f"bzh/mecatro/dashboard/{project}/{variable}"
+    if mqtt_client is None:
+        return jsonify({"error": "Client MQTT pas encore démarré"}), 503
     try:
         mqtt_client.publish(topic, value)
         return jsonify({"success": True, "topic": topic, "value": value})
@@ -197,9 +459,7 @@ def test_subscribe(project):
     """Subscribe to project topics (for testing)"""
     # This would require WebSocket or SSE for real-time updates
     # For now, return current data for the project
-    if project in dashboard_data:
-        return jsonify(dashboard_data[project])
-    return jsonify({})
+    return jsonify(live_series.module(project) or {})
 
 # --- Admin Routes ---
 @app.route("/login", methods=["GET", "POST"])
@@ -256,5 +516,118 @@ def delete_module():
     result = database.delete_module_permanently(module)
     return jsonify({"success": True, "deleted": result})
 
+@app.route("/api/admin/rules", methods=["GET", "POST"])
+def admin_rules():
+    """Alert rules: GET the list, POST {"topic_filter", "operator", "threshold", "name", "cooldown"}"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.method == "GET":
+        return jsonify(database.list_alert_rules())
+
+    data = request.get_json(silent=True) or {}
+    topic_filter = (data.get('topic_filter') or '').strip()
+    operator = data.get('operator')
+    threshold = data.get('threshold')
+    error = validate_filter(topic_filter)
+    if error:
+        return jsonify({"error": error}), 400
+    if operator not in OPERATORS:
+        return jsonify({"error": f"Opérateur inconnu (attendu: {', '.join(OPERATORS)})"}), 400
+    if operator in ('>', '>=', '<', '<=', '==', '!=') and threshold in (None, ''):
+        return jsonify({"error": "Missing threshold"}), 400
+    # Ordering operators only compare numbers: a text (or NaN) threshold would never fire
+    number = parse_number(threshold)
+    if operator in ('>', '>=', '<', '<=') and (number is None or not math.isfinite(number)):
+        return jsonify({"error": "Invalid threshold (number expected)"}), 400
+    try:
+        cooldown = int(data.get('cooldown', 60))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid cooldown"}), 400
+    rule_id = database.add_alert_rule(data.get('name'), topic_filter, operator,
+                                      None if threshold is None else str(threshold), cooldown)
+    reload_rules()
+    return jsonify({"success": True, "id": rule_id})
+
+@app.route("/api/admin/rules/<int:rule_id>", methods=["DELETE"])
+def admin_delete_rule(rule_id):
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Unauthorized"}), 401
+    deleted = database.delete_alert_rule(rule_id)
+    reload_rules()
+    return jsonify({"success": True, "deleted": deleted})
+
+@app.route("/api/admin/rules/reload", methods=["POST"])
+def admin_reload_rules():
+    """Reload the rules after editing alert_rules directly in the DB"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Unauthorized"}), 401
+    reload_rules()
+    return jsonify(rule_engine.stats())
+
+def _positive(value):
+    return value is not None and math.isfinite(value) and value > 0
+
+@app.route("/api/admin/profile")
+def admin_profile():
+    """Sample every thread/greenlet stack for ?seconds= (collapsed stacks, or ?format=json)"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    seconds = request.args.get('seconds', 10, type=float)
+    interval = request.args.get('interval', PROFILE_DEFAULT_INTERVAL, type=float)
+    if not _positive(seconds) or not _positive(interval):
+        return jsonify({"error": "Invalid seconds or interval"}), 400
+    try:
+        run = ProfileSession(seconds, interval).start()
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    # The sampler runs in its own OS thread: keep the hub free while it works
+    while not run.done():
+        eventlet.sleep(0.1)
+
+    sampler = run.sampler
+    if request.args.get('format') == 'json':
+        return jsonify({
+            "samples": sampler.samples,
+            "seconds": round(sampler.elapsed, 2),
+            "interval": sampler.interval,
+            "top": sampler.top(),
+        })
+    filename = datetime.now().strftime('profile-%Y%m%d-%H%M%S.folded')
+    return Response(sampler.collapsed(), mimetype='text/plain',
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route("/api/admin/profile/requests", methods=["GET", "POST"])
+def admin_profile_requests():
+    """Per-request timing: POST {"routes": ["/api/mqtt/"], "seconds": 300}, GET the report"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        routes = [r for r in data.get('routes', []) if isinstance(r, str) and r]
+        if not routes:
+            return jsonify({"error": "Missing routes"}), 400
+        seconds = parse_number(data.get('seconds', 300))
+        if not _positive(seconds):
+            return jsonify({"error": "Invalid seconds"}), 400
+        request_timer.enable(routes, seconds)
+    return jsonify(request_timer.report())
+
+@app.before_request
+def start_request_timer():
+    if request_timer.active(request.path):
+        g.profile_start = time.perf_counter()
+
+@app.after_request
+def stop_request_timer(response):
+    start = g.pop('profile_start', None)
+    if start is not None:
+        request_timer.record(request.path, (time.perf_counter() - start) * 1000)
+    return response
+
+startup["import_ms"] = round((time.perf_counter() - _import_start) * 1000)
+
 if __name__ == "__main__":
-    socketio.run(app, debug=True, host="0.0.0.0")
\ No newline at end of file
+    # No reloader: it serves from a secondary thread whose hub would never run
+    # the greenlets spawned here (startup, MQTT green loop, Socket.IO dispatcher)
+    socketio.run(create_app(), debug=True, use_reloader=False, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,210 @@
+# archive.py
+"""
+Cold archive of old measurements: one compressed columnar file per module and day.
+
+    ARCHIVE_DIR/<module>/<YYYY-MM-DD>.json.gz
+    ARCHIVE_DIR/<module>/index.json     {day: {variable: row count}}
+
+Each file holds parallel columns (id, variable index, seconds since midnight,
+value) plus the variable dictionary, gzip-compressed. Files are rewritten
+atomically and merged by row id, so re-archiving the same rows (e.g. after a
+crash between the file write and the DB delete) is harmless.
+
+The per-module index lets history reads skip the days that do not hold the
+requested variable. It is updated after each day file; a missing index
+(archive written by an older version) is rebuilt on first read.
+
+Filled by database.archive_old_measurements (see archive_measurements.py);
+read back by the history and export functions for ranges older than the
+measurements table.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from urllib.parse import quote
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_ROWS = int(os.environ.get('ARCHIVE_BATCH_ROWS', 10000))
+SUFFIX = '.json.gz'
+INDEX_NAME = 'index.json'
+
+_index_cache = {}   # module -> (index file mtime_ns, index)
+
+
+def _module_dir(module):
+    # Module names come from MQTT topic levels: keep them from escaping ARCHIVE_DIR
+    return os.path.join(ARCHIVE_DIR, quote(module, safe='').replace('.', '%2E'))
+
+
+def _path(module, day):
+    return os.path.join(_module_dir(module), day.isoformat() + SUFFIX)
+
+
+def days(module):
+    """Archived days of a module, oldest first."""
+    try:
+        names = os.listdir(_module_dir(module))
+    except OSError:
+        return []
+    return sorted(date.fromisoformat(n[:-len(SUFFIX)]) for n in names if n.endswith(SUFFIX))
+
+
+def _index_path(module):
+    return os.path.join(_module_dir(module), INDEX_NAME)
+
+
+def _save_index(module, index):
+    path = _index_path(module)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _rebuild_index(module):
+    index = {}
+    for day in days(module):
+        counts = {}
+        for _, var, _, _ in read_day(module, day):
+            counts[var] = counts.get(var, 0) + 1
+        index[day.isoformat()] = counts
+    if index:
+        _save_index(module, index)
+    return index
+
+
+def load_index(module):
+    """{day ISO string: {variable: archived row count}} of a module (cached until rewritten)."""
+    try:
+        mtime = os.stat(_index_path(module)).st_mtime_ns
+    except FileNotFoundError:
+        return _rebuild_index(module)
+    cached = _index_cache.get(module)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(_index_path(module), encoding='utf-8') as f:
+        index = json.load(f)
+    _index_cache[module] = (mtime, index)
+    return index
+
+
+def variable_days(module, variable):
+    """[(day, archived row count)] of one variable, oldest first."""
+    return sorted((date.fromisoformat(day), counts[variable])
+                  for day, counts in load_index(module).items() if variable in counts)
+
+
+def read_day(module, day):
+    """[(id, variable, value, timestamp)] of one archived day, in timestamp order."""
+    try:
+        with gzip.open(_path(module, day), 'rt', encoding='utf-8') as f:
+            cols = json.load(f)
+    except FileNotFoundError:
+        return []
+    midnight = datetime.combine(day, time.min)
+    names = cols["variables"]
+    return [(row_id, names[v], value, midnight + timedelta(seconds=t))
+            for row_id, v, t, value in zip(cols["id"], cols["var"], cols["t"], cols["value"])]
+
+
+def _write_day(module, day, rows):
+    rows = sorted(rows, key=lambda r: (r[3], r[0]))
+    if not rows:
+        try:
+            os.remove(_path(module, day))
+        except OSError:
+            pass
+        _update_index(module, day, None)
+        return
+    names = sorted({r[1] for r in rows})
+    index = {name: i for i, name in enumerate(names)}
+    midnight = datetime.combine(day, time.min)
+    cols = {
+        "module": module,
+        "day": day.isoformat(),
+        "variables": names,
+        "id": [r[0] for r in rows],
+        "var": [index[r[1]] for r in rows],
+        "t": [int((r[3] - midnight).total_seconds()) for r in rows],
+        "value": [r[2] for r in rows],
+    }
+    path = _path(module, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=9) as f:
+        json.dump(cols, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    counts = {}
+    for r in rows:
+        counts[r[1]] = counts.get(r[1], 0) + 1
+    _update_index(module, day, counts)
+
+
+def _update_index(module, day, counts):
+    index = dict(load_index(module))
+    if counts:
+        index[day.isoformat()] = counts
+    else:
+        index.pop(day.isoformat(), None)
+    if index:
+        _save_index(module, index)
+    else:
+        try:
+            os.remove(_index_path(module))
+        except OSError:
+            pass
+
+
+def append_rows(module, day, rows):
+    """Merge rows [(id, variable, value, timestamp)] into the file of (module, day)."""
+    merged = {r[0]: r for r in read_day(module, day)}
+    merged.update((r[0], r) for r in rows)
+    _write_day(module, day, merged.values())
+
+
+def iter_rows(module, start, end, variable=None):
+    """Yield archived (module, variable, value, timestamp) with start <= timestamp < end."""
+    module_days = days(module) if variable is None else [day for day, _ in variable_days(module, variable)]
+    for day in module_days:
+        if day < start.date() or day > end.date():
+            continue
+        for _, var, value, ts in read_day(module, day):
+            if start <= ts < end and (variable is None or var == variable):
+                yield module, var, value, ts
+
+
+def tail(module, variable, limit, before=None):
+    """Last `limit` archived (value, timestamp) of a series before `before`, oldest first.
+
+    Only the days holding the variable are read (see load_index).
+    """
+    found = []
+    for day, _ in reversed(variable_days(module, variable)):
+        if before is not None and day > before.date():
+            continue
+        rows = [(value, ts) for _, var, value, ts in read_day(module, day)
+                if var == variable and (before is None or ts < before)]
+        found = rows[-(limit - len(found)):] + found
+        if len(found) >= limit:
+            break
+    return found
+
+
+def delete(module, variable=None):
+    """Remove a module's archive, or one variable from every archived day."""
+    if variable is None:
+        for day in days(module):
+            os.remove(_path(module, day))
+        try:
+            os.remove(_index_path(module))
+        except OSError:
+            pass
+    else:
+        for day, _ in variable_days(module, variable):
+            _write_day(module, day, [r for r in read_day(module, day) if r[1] != variable])
+    try:
+        os.rmdir(_module_dir(module))
+    except OSError:
+        pass
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Move old measurements to the cold archive (ARCHIVE_DIR, see archive.py).
+
+Measurements of whole days older than --older-than-days are written to
+compressed per-module, per-day columnar files, then deleted from the
+measurements table in batches. History and export reads merge the archive
+back transparently. Run it daily, e.g. from cron:
+
+    python archive_measurements.py --older-than-days 90
+"""
+import argparse
+import time
+
+import archive
+import database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--older-than-days', type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch', type=int, default=archive.ARCHIVE_BATCH_ROWS)
+    args = parser.parse_args()
+
+    start = time.time()
+    count = database.archive_old_measurements(args.older_than_days, args.batch)
+    print(f"{count} mesures archivées dans {archive.ARCHIVE_DIR} en {time.time() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
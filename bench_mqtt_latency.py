@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+End-to-end MQTT -> browser latency benchmark.
+
+Publishes timestamped payloads on bzh/mecatro/dashboard/bench_latency/t and
+measures when the matching 'update_data' Socket.IO event reaches a client.
+Run it once against the app started with MQTT_LOOP_MODE=thread and once with
+MQTT_LOOP_MODE=eventlet to compare both ingest modes:
+
+    MQTT_LOOP_MODE=eventlet python app.py
+    python bench_mqtt_latency.py --label eventlet --count 500 --rate 10
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import paho.mqtt.client as mqtt  # type: ignore
+import socketio  # type: ignore
+
+TOPIC = "bzh/mecatro/dashboard/bench_latency/t"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--broker', default='global_mqtt')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=10, help="messages per second (stay under INGEST_PROJECT_RATE)")
+    parser.add_argument('--label', default='')
+    args = parser.parse_args()
+
+    latencies = []
+    done = threading.Event()
+
+    sio = socketio.Client()
+
+    @sio.on('update_data')
+    def on_update(data):
+        if data.get('module') != 'bench_latency':
+            return
+        try:
+            latencies.append(time.time() - float(data['value']))
+        except (KeyError, ValueError):
+            return
+        if len(latencies) >= args.count:
+            done.set()
+
+    sio.connect(args.url, transports=['websocket'])
+
+    publisher = mqtt.Client()
+    publisher.connect(args.broker, args.port, 60)
+    publisher.loop_start()
+
+    interval = 1.0 / args.rate
+    start = time.time()
+    for i in range(args.count):
+        # Unique payloads so the dashboard's duplicate detection does not interfere
+        publisher.publish(TOPIC, f"{time.time():.6f}")
+        time.sleep(max(0.0, start + (i + 1) * interval - time.time()))
+
+    done.wait(timeout=10)
+    publisher.loop_stop()
+    sio.disconnect()
+
+    received = len(latencies)
+    ms = [v * 1000 for v in latencies]
+    print(f"[{args.label or 'run'}] {received}/{args.count} reçus")
+    if ms:
+        print(f"  p50 {percentile(ms, 50):.1f} ms  p95 {percentile(ms, 95):.1f} ms  "
+              f"p99 {percentile(ms, 99):.1f} ms  max {max(ms):.1f} ms  "
+              f"écart-type {statistics.pstdev(ms):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
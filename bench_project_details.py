@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Latency of the project analysis view (database.get_mqtt_project_details).
+
+Fills mqtt_messages with --rows synthetic messages spread over --projects
+projects (topics 'bzh/mecatro/dashboard/bench_details<p>/...'), then times
+for one project:
+    seven_sql   the seven SQL queries the view originally issued (errors,
+                frequency, categories, top topics, timeline, overall stats,
+                recent messages; written against the topic_id layout)
+    previous    the function as it was before the aggregates scan: errors,
+                top topics, frequency and timeline from the in-memory
+                sketches, then categories, overall stats and recent
+                messages as three queries on one connection
+    current     get_mqtt_project_details (one covering-index scan and the
+                recent messages, concurrently on two pooled connections)
+and exits with status 1 if the current p95 exceeds --budget-ms.
+
+    python bench_project_details.py --rows 1000000
+    python bench_project_details.py --skip-populate --runs 200
+    python bench_project_details.py --cleanup
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import database
+import sketches
+import timeseries
+
+PROJECT_PREFIX = 'bench_details'
+TOPIC_PREFIX = 'bzh/mecatro/dashboard/'
+CATEGORIES = ['capteur', 'actionneur', 'etat', 'config']
+INSERT_BATCH = 10000
+
+_PROJECT_TOPICS = "topic_id IN (SELECT id FROM mqtt_topics WHERE project = %s)"
+
+SEVEN_SQL_QUERIES = [
+    f"""SELECT t.topic, COUNT(*) as count
+        FROM mqtt_messages m JOIN mqtt_topics t ON t.id = m.topic_id
+        WHERE m.{_PROJECT_TOPICS} AND m.is_compliant = 0
+        GROUP BY t.topic ORDER BY count DESC LIMIT 10""",
+    f"""SELECT DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:%%i') as minute, COUNT(*) as count
+        FROM mqtt_messages
+        WHERE {_PROJECT_TOPICS} AND timestamp >= NOW() - INTERVAL 1 HOUR
+        GROUP BY minute ORDER BY minute DESC""",
+    """SELECT t.category, COUNT(*) as count
+       FROM mqtt_messages m JOIN mqtt_topics t ON t.id = m.topic_id
+       WHERE t.project = %s
+       GROUP BY t.category""",
+    f"""SELECT t.topic, COUNT(*) as count, MAX(m.timestamp) as last_seen
+        FROM mqtt_messages m JOIN mqtt_topics t ON t.id = m.topic_id
+        WHERE m.{_PROJECT_TOPICS}
+        GROUP BY t.topic ORDER BY count DESC LIMIT 10""",
+    f"""SELECT DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:00') as hour, COUNT(*) as count
+        FROM mqtt_messages
+        WHERE {_PROJECT_TOPICS} AND timestamp >= NOW() - INTERVAL 24 HOUR
+        GROUP BY hour ORDER BY hour ASC""",
+    f"""SELECT COUNT(*) as total,
+              SUM(CASE WHEN is_compliant = 1 THEN 1 ELSE 0 END) as compliant,
+              MIN(timestamp) as first_seen, MAX(timestamp) as last_seen
+        FROM mqtt_messages
+        WHERE {_PROJECT_TOPICS}""",
+    """SELECT t.topic, m.payload, m.payload_encoding, m.timestamp, m.is_compliant
+       FROM mqtt_messages m JOIN mqtt_topics t ON t.id = m.topic_id
+       WHERE t.project = %s
+       ORDER BY m.timestamp DESC LIMIT 10""",
+]
+
+# The three queries left once the sketches / ring buffers served the rest
+PREVIOUS_QUERIES = [
+    """SELECT t.category, SUM(m.count) as count
+       FROM (SELECT topic_id, COUNT(*) as count FROM mqtt_messages
+             WHERE topic_id IN (SELECT id FROM mqtt_topics WHERE project = %s)
+             GROUP BY topic_id) m
+       JOIN mqtt_topics t ON t.id = m.topic_id
+       GROUP BY t.category""",
+    """SELECT COUNT(*) as total,
+              SUM(CASE WHEN is_compliant = 1 THEN 1 ELSE 0 END) as compliant,
+              MIN(timestamp) as first_seen, MAX(timestamp) as last_seen
+       FROM mqtt_messages
+       WHERE topic_id IN (SELECT id FROM mqtt_topics WHERE project = %s)""",
+    """SELECT t.topic, m.payload, m.payload_encoding, m.timestamp, m.is_compliant
+       FROM mqtt_messages m
+       JOIN mqtt_topics t ON t.id = m.topic_id
+       WHERE t.project = %s
+       ORDER BY m.timestamp DESC
+       LIMIT 10""",
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def populate(args):
+    conn = database.get_db_connection()
+    c = conn.cursor()
+    topic_ids = []
+    for p in range(args.projects):
+        project = f"{PROJECT_PREFIX}{p}"
+        for k in range(args.topics):
+            topic = f"{TOPIC_PREFIX}{project}/{CATEGORIES[k % len(CATEGORIES)]}/v{k}"
+            c.execute("""INSERT INTO mqtt_topics (topic, project, category) VALUES (%s, %s, %s)
+                         ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)""",
+                      (topic, project, CATEGORIES[k % len(CATEGORIES)]))
+            topic_ids.append(c.lastrowid)
+    conn.commit()
+
+    now = datetime.now()
+    span = timedelta(days=args.days).total_seconds()
+    inserted = 0
+    while inserted < args.rows:
+        n = min(INSERT_BATCH, args.rows - inserted)
+        rows = [(random.choice(topic_ids), b'{"v": 1}', database.PAYLOAD_RAW,
+                 now - timedelta(seconds=random.uniform(0, span)), random.random() > 0.05)
+                for _ in range(n)]
+        c.executemany("""INSERT INTO mqtt_messages (topic_id, payload, payload_encoding, timestamp, is_compliant)
+                         VALUES (%s, %s, %s, %s, %s)""", rows)
+        conn.commit()
+        inserted += n
+        print(f"\r{inserted}/{args.rows} messages insérés", end='', flush=True)
+    print()
+    c.execute("ANALYZE TABLE mqtt_messages")
+    c.fetchall()
+    conn.close()
+
+
+def cleanup():
+    conn = database.get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id FROM mqtt_topics WHERE project LIKE %s", (PROJECT_PREFIX + '%',))
+    ids = [row[0] for row in c.fetchall()]
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        c.execute(f"DELETE FROM mqtt_messages WHERE topic_id IN ({placeholders})", chunk)
+        c.execute(f"DELETE FROM mqtt_topics WHERE id IN ({placeholders})", chunk)
+        conn.commit()
+    conn.close()
+    print(f"{len(ids)} topics de benchmark supprimés")
+
+
+def _run_queries(queries, project):
+    conn = database.get_read_connection()
+    c = conn.cursor(dictionary=True)
+    results = []
+    for query in queries:
+        c.execute(query, (project,))
+        results.append(c.fetchall())
+    conn.close()
+    for msg in results[-1]:
+        msg['payload'] = database.decode_payload(msg['payload'], msg.pop('payload_encoding'))
+    return results
+
+
+def seven_sql(project):
+    _run_queries(SEVEN_SQL_QUERIES, project)
+
+
+def previous(project):
+    sketches.registry.top_errors(project, 10)
+    timeseries.registry.frequency(project)
+    sketches.registry.top_topics(project, 10)
+    timeseries.registry.timeline(project)
+    _run_queries(PREVIOUS_QUERIES, project)
+
+
+def timed(fn, project, runs):
+    fn(project)  # warm-up: pool, buffer pool
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(project)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--topics', type=int, default=40, help="topics per project")
+    parser.add_argument('--days', type=float, default=7, help="timestamps spread over this many days")
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--budget-ms', type=float, default=100)
+    parser.add_argument('--skip-populate', action='store_true')
+    parser.add_argument('--cleanup', action='store_true', help="delete the benchmark topics and messages")
+    args = parser.parse_args()
+
+    if args.cleanup:
+        cleanup()
+        return
+    if not args.skip_populate:
+        populate(args)
+
+    project = f"{PROJECT_PREFIX}0"
+    results = {
+        "seven_sql": timed(seven_sql, project, args.runs),
+        "previous": timed(previous, project, args.runs),
+        "current": timed(database.get_mqtt_project_details, project, args.runs),
+    }
+    current_p50 = percentile(results["current"], 50)
+    for label, ms in results.items():
+        print(f"{label:<11} p50 {percentile(ms, 50):7.1f}  p95 {percentile(ms, 95):7.1f}  "
+              f"max {max(ms):7.1f} ms  (p50 x{percentile(ms, 50) / current_p50:.1f} vs current)")
+
+    p95 = percentile(results["current"], 95)
+    if p95 > args.budget_ms:
+        print(f"❌ p95 {p95:.0f} ms > {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"✅ p95 {p95:.0f} ms <= {args.budget_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
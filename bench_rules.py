@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Alert rule matching cost at ingest: topic trie vs one check per rule.
+
+Generates --rules rules over --projects projects, in the mix an
+installation accumulates (exact topics, 'bzh/mecatro/dashboard/<p>/+',
+'bzh/mecatro/projets/<g>/#', a few global '#' non-compliance rules), and
+a stream of --messages topics drawn from the same projects. Checks that
+the trie returns exactly the rules of the linear scan, then reports the
+matching time per message of both and exits with status 1 if the trie
+exceeds --budget-us on average.
+
+    python bench_rules.py --rules 10000 --messages 100000
+"""
+import argparse
+import random
+import sys
+import time
+
+from rules import Rule, RuleEngine, TopicTrie, topic_matches
+
+VARIABLES = ['temperature', 'humidite', 'pression', 'lumiere', 'co2', 'niveau', 'debit', 'etat']
+
+
+def make_rules(n, projects, rng):
+    rules = []
+    for i in range(n):
+        p = rng.randrange(projects)
+        kind = rng.random()
+        if kind < 0.5:
+            topic_filter = f"bzh/mecatro/dashboard/projet{p}/{rng.choice(VARIABLES)}"
+        elif kind < 0.8:
+            topic_filter = f"bzh/mecatro/dashboard/projet{p}/+"
+        elif kind < 0.95:
+            topic_filter = f"bzh/mecatro/projets/groupe{p}/#"
+        elif kind < 0.999:
+            topic_filter = f"bzh/mecatro/+/projet{p}/{rng.choice(VARIABLES)}"
+        else:
+            topic_filter = "#"
+        operator, threshold = rng.choice([('>', '35'), ('<', '5'), ('>=', '100'), ('non_compliant', None)])
+        rules.append(Rule(i, f"règle {i}", topic_filter, operator, threshold, cooldown=0))
+    return rules
+
+
+def make_topics(n, projects, rng):
+    topics = []
+    for _ in range(n):
+        p = rng.randrange(projects)
+        if rng.random() < 0.8:
+            topics.append(f"bzh/mecatro/dashboard/projet{p}/{rng.choice(VARIABLES)}")
+        else:
+            topics.append(f"bzh/mecatro/projets/groupe{p}/{rng.choice(['capteurs', 'actionneurs'])}/{rng.choice(VARIABLES)}")
+    return topics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--linear-messages', type=int, default=2000, help="messages for the (slow) linear scan")
+    parser.add_argument('--budget-us', type=float, default=50, help="mean trie match + evaluation time per message")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules = make_rules(args.rules, args.projects, rng)
+    topics = make_topics(args.messages, args.projects, rng)
+    payloads = [f"{rng.uniform(0, 120):.1f}" for _ in range(len(topics))]
+
+    start = time.perf_counter()
+    trie = TopicTrie(rules)
+    print(f"{len(rules)} règles indexées en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # Same rules as the per-rule reference on a sample
+    for topic in topics[:args.linear_messages]:
+        expected = sorted(r.id for r in rules if topic_matches(r.topic_filter, topic))
+        assert sorted(r.id for r in trie.match(topic)) == expected, topic
+
+    sample = topics[:args.linear_messages]
+    start = time.perf_counter()
+    for topic in sample:
+        [r for r in rules if topic_matches(r.topic_filter, topic)]
+    linear_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    engine = RuleEngine()
+    engine.load(rules)
+    start = time.perf_counter()
+    for topic, payload in zip(topics, payloads):
+        engine.evaluate(topic, payload, True)
+    trie_us = (time.perf_counter() - start) / len(topics) * 1e6
+    stats = engine.stats()
+
+    print(f"scan linéaire : {linear_us:9.1f} µs/message")
+    print(f"trie          : {trie_us:9.1f} µs/message (correspondance + conditions), "
+          f"x{linear_us / trie_us:.0f}, {stats['matched'] / len(topics):.1f} règles candidates "
+          f"et {stats['fired'] / len(topics):.2f} alertes par message")
+    if trie_us > args.budget_us:
+        print(f"❌ {trie_us:.1f} µs > {args.budget_us:.0f} µs")
+        sys.exit(1)
+    print(f"✅ {trie_us:.1f} µs <= {args.budget_us:.0f} µs")
+
+
+if __name__ == '__main__':
+    main()
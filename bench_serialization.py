@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: bytes and CPU per request for the /api/mqtt/project/<name>
+payload, old path (isoformat walk + stdlib json, uncompressed) vs the
+serialization layer (orjson + gzip/brotli).
+
+Usage: python bench_serialization.py [iterations]
+"""
+import copy
+import gzip
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import serialization
+
+
+def make_project_details(project="serre"):
+    """Build a payload shaped like database.get_mqtt_project_details()."""
+    now = datetime.now()
+    topics = [f"bzh/mecatro/dashboard/{project}/var_{i}" for i in range(10)]
+    return {
+        "project": project,
+        "stats": {
+            "total": 250000,
+            "compliant": Decimal(248000),
+            "first_seen": now - timedelta(days=30),
+            "last_seen": now,
+        },
+        "errors": [{"topic": t + "/extra", "count": random.randint(1, 500)} for t in topics],
+        "frequency": {
+            "data": [{"minute": (now - timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M'),
+                      "count": random.randint(10, 100)} for i in range(60)],
+            "max": 100,
+            "avg": 55.0,
+        },
+        "categories": [{"category": "dashboard", "count": 200000}, {"category": "capteurs", "count": 50000}],
+        "top_topics": [{"topic": t, "count": random.randint(1000, 50000), "last_seen": now} for t in topics],
+        "timeline": [{"hour": (now - timedelta(hours=i)).strftime('%Y-%m-%d %H:00'),
+                      "count": random.randint(1000, 6000)} for i in range(24)],
+        "recent_messages": [{"topic": random.choice(topics), "payload": f"{random.uniform(0, 40):.2f}",
+                             "timestamp": now - timedelta(seconds=i), "is_compliant": 1} for i in range(10)],
+    }
+
+
+def old_path(details):
+    """What app.py did before: walk the dict, then stdlib json (Flask default)."""
+    if details['stats']:
+        if details['stats']['first_seen']:
+            details['stats']['first_seen'] = details['stats']['first_seen'].isoformat()
+        if details['stats']['last_seen']:
+            details['stats']['last_seen'] = details['stats']['last_seen'].isoformat()
+    for topic in details['top_topics']:
+        if topic['last_seen']:
+            topic['last_seen'] = topic['last_seen'].isoformat()
+    for msg in details['recent_messages']:
+        if msg['timestamp']:
+            msg['timestamp'] = msg['timestamp'].isoformat()
+    return json.dumps(details, default=str).encode('utf-8')
+
+
+def new_path(details, encoding):
+    data = serialization.dumps(details)
+    if encoding == 'br':
+        return serialization.brotli.compress(data, quality=min(serialization.COMPRESS_LEVEL, 11))
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=serialization.COMPRESS_LEVEL)
+    return data
+
+
+def run(label, fn, payloads):
+    start = time.process_time()
+    size = 0
+    for p in payloads:
+        size = len(fn(p))
+    elapsed = time.process_time() - start
+    print(f"{label:<28} {size:>8} octets  {elapsed / len(payloads) * 1e6:>9.1f} µs CPU/requête")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    template = make_project_details()
+    print(f"Encodeur: {'orjson' if serialization.orjson else 'json'} - {iterations} itérations\n")
+
+    run("avant (walk + json)", old_path, [copy.deepcopy(template) for _ in range(iterations)])
+    run("après (brut)", lambda p: new_path(p, None), [template] * iterations)
+    run("après (gzip)", lambda p: new_path(p, 'gzip'), [template] * iterations)
+    if serialization.brotli is not None:
+        run("après (brotli)", lambda p: new_path(p, 'br'), [template] * iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Shared-subscription ingest: N ingest workers must persist what one does,
+and process N times as many messages per second.
+
+Starts N processes in the same $share group, each running the real ingest
+path: mqtt_client.on_message in the 'ingest' role with
+MQTT_INGEST_WORKERS=N, so RATE_LIMIT_SECONDS and the throttle.py budgets are
+partitioned exactly as in ingest_worker.py. The database write functions
+are replaced by counters spending --db-ms per write. Two phases per N:
+
+- admission: a publisher sends --count messages at --rate msg/s on
+  --projects x --variables topics, fast enough to exceed the per-project
+  and per-topic budgets. The admitted (mqtt_messages rows), throttled and
+  saved (measurements rows) totals must not differ from the single-worker
+  run by more than --tolerance. Each worker saves the first value of every
+  series it receives, so up to N-1 extra saves per series are allowed.
+- throughput: --throughput-count messages published as fast as possible
+  with the throttle disabled, so every message pays its simulated writes
+  and the workers are the bottleneck. The scaling efficiency, (msg/s with
+  N workers / msg/s with 1) / N, must reach --min-efficiency.
+
+Exits with status 1 if either check fails.
+
+    python bench_shared_subscription.py --spawn-broker --workers 1 2 4
+    python bench_shared_subscription.py --spawn-broker --workers 1 4 --count 0   # throughput only
+
+--spawn-broker runs a throwaway local mosquitto (>= 1.6 for $share) on
+--port; otherwise point --broker at any broker supporting shared
+subscriptions. The efficiency check needs at least N free cores.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import paho.mqtt.client as mqtt  # type: ignore
+
+PROJECT_PREFIX = "bench_share"
+TOPIC_PREFIX = f"bzh/mecatro/dashboard/{PROJECT_PREFIX}"   # + <n>/<variable>: one project per n
+TOPIC_FILTER = "bzh/mecatro/dashboard/#"
+DB_WRITES = ('log_mqtt_message', 'log_message_receipt', 'log_module_publication',
+             'save_measurement', 'cleanup_old_mqtt_messages')
+
+
+def worker(index, workers, broker, port, group, db_ms, throttled, ready, processed, results, stop):
+    # Set before mqtt_client is imported: the role and the worker count
+    # partition RATE_LIMIT_SECONDS and the throttle budgets at import time
+    os.environ['MQTT_ROLE'] = 'ingest'
+    os.environ['MQTT_INGEST_WORKERS'] = str(workers)
+    os.environ.pop('MQTT_CAPTURE_DIR', None)
+    import database
+    import mqtt_client
+    from throttle import throttle
+    throttle.enabled = throttled
+
+    writes = dict.fromkeys(DB_WRITES, 0)
+
+    def counted(name):
+        def write(*args):
+            writes[name] += 1
+            time.sleep(db_ms / 1000)
+        return write
+
+    for name in DB_WRITES:
+        setattr(database, name, counted(name))
+
+    received = 0
+    last = None
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(f"$share/{group}/{TOPIC_FILTER}", qos=1)
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        ready.release()
+
+    def on_message(client, userdata, msg):
+        nonlocal received, last
+        if not msg.topic.startswith(TOPIC_PREFIX):
+            return  # other traffic on a shared broker
+        mqtt_client.on_message(client, userdata, msg)
+        received += 1
+        last = time.time()
+        with processed.get_lock():
+            processed.value += 1
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    client.loop_start()
+    stop.wait()
+    client.loop_stop()
+    client.disconnect()
+
+    # Sampled over-limit messages are persisted: they count as admitted, not throttled
+    throttled = sum(s["throttled"] - s["sampled"] for s in throttle.snapshot().values())
+    results.put({"index": index, "received": received, "last": last, "throttled": throttled,
+                 "admitted": writes['log_mqtt_message'], "saved": writes['save_measurement']})
+
+
+def run(args, workers, count, rate, throttled=True):
+    ctx = multiprocessing.get_context('spawn')
+    group = f"bench{int(time.time() * 1000)}"
+    ready = ctx.Semaphore(0)
+    stop = ctx.Event()
+    processed = ctx.Value('l', 0)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(i, workers, args.broker, args.port, group, args.db_ms,
+                                              throttled, ready, processed, results, stop))
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        if not ready.acquire(timeout=30):
+            stop.set()
+            raise SystemExit("un worker ne s'est pas abonné (le broker gère-t-il $share ?)")
+
+    # Same topic sequence for every N
+    rng = random.Random(args.seed)
+    topics = [f"{TOPIC_PREFIX}{p}/v{v}"
+              for p in range(args.projects) for v in range(args.variables)]
+    publisher = mqtt.Client()
+    publisher.connect(args.broker, args.port, 60)
+    publisher.loop_start()
+    start = time.time()
+    for i in range(count):
+        if rate:
+            delay = start + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        # Constant payload per topic: measurements are saved on the rate limit only
+        info = publisher.publish(rng.choice(topics), "21.5", qos=1)
+    info.wait_for_publish(timeout=args.timeout)
+    publisher.loop_stop()
+    publisher.disconnect()
+
+    deadline = time.time() + args.timeout
+    while processed.value < count and time.time() < deadline:
+        time.sleep(0.1)
+    stop.set()
+    stats = [results.get(timeout=30) for _ in procs]
+    for p in procs:
+        p.join()
+
+    end = max((s["last"] for s in stats if s["last"]), default=start)
+    totals = {key: sum(s[key] for s in stats) for key in ("received", "admitted", "throttled", "saved")}
+    totals["elapsed"] = end - start
+    totals["rate"] = totals["received"] / totals["elapsed"] if totals["elapsed"] > 0 else 0
+    totals["split"] = ", ".join(str(s["received"]) for s in sorted(stats, key=lambda s: s["index"]))
+    return totals
+
+
+def check(args, workers, totals, baseline):
+    """Differences with the single-worker run beyond the tolerance."""
+    series = args.projects * args.variables
+    errors = []
+    for key, slack in (("admitted", 0), ("saved", (workers - 1) * series)):
+        expected = baseline[key]
+        allowed = args.tolerance * expected + slack
+        if abs(totals[key] - expected) > allowed:
+            errors.append(f"{workers} workers : {key} {totals[key]} au lieu de {expected} "
+                          f"(écart {abs(totals[key] - expected)} > {allowed:.0f})")
+    return errors
+
+
+def check_scaling(args, workers, totals, baseline):
+    """Scaling efficiency below --min-efficiency, as an error list."""
+    efficiency = totals["rate"] / baseline["rate"] / workers if baseline["rate"] else 0
+    if efficiency < args.min_efficiency:
+        return [f"{workers} workers : efficacité {efficiency:.0%} < {args.min_efficiency:.0%} "
+                f"({totals['rate']:.0f} msg/s contre {baseline['rate']:.0f} avec 1 worker)"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=18830)
+    parser.add_argument('--spawn-broker', action='store_true', help="start a local mosquitto for the run")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--count', type=int, default=30000, help="admission phase messages (0 = skip)")
+    parser.add_argument('--rate', type=float, default=500, help="published msg/s (0 = as fast as possible)")
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--variables', type=int, default=10, help="topics per project")
+    parser.add_argument('--db-ms', type=float, default=0.5, help="simulated time per DB write")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed relative difference with 1 worker")
+    parser.add_argument('--throughput-count', type=int, default=20000, help="throughput phase messages (0 = skip)")
+    parser.add_argument('--min-efficiency', type=float, default=0.7,
+                        help="required (msg/s with N / msg/s with 1) / N")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    workers_list = sorted(set(args.workers) | {1})
+
+    broker = None
+    if args.spawn_broker:
+        binary = shutil.which('mosquitto')
+        if not binary:
+            raise SystemExit("mosquitto introuvable : installer mosquitto ou utiliser --broker")
+        broker = subprocess.Popen([binary, '-p', str(args.port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        args.broker = 'localhost'
+        time.sleep(0.5)
+
+    errors = []
+    try:
+        baseline = scaling_baseline = None
+        for n in workers_list:
+            if args.count:
+                totals = run(args, n, args.count, args.rate)
+                print(f"{n} worker(s): {totals['received']}/{args.count} reçus en {totals['elapsed']:.2f}s "
+                      f"({totals['rate']:.0f} msg/s), répartition [{totals['split']}] ; admis {totals['admitted']}, "
+                      f"bridés {totals['throttled']}, mesures enregistrées {totals['saved']}")
+                if totals["received"] < args.count:
+                    errors.append(f"{n} workers : {args.count - totals['received']} messages non reçus")
+                if baseline is None:
+                    baseline = totals
+                elif args.rate:
+                    errors.extend(check(args, n, totals, baseline))
+            if args.throughput_count:
+                totals = run(args, n, args.throughput_count, 0, throttled=False)
+                print(f"{n} worker(s), débit sans bridage : {totals['rate']:.0f} msg/s "
+                      f"({totals['received']}/{args.throughput_count} en {totals['elapsed']:.2f}s)")
+                if totals["received"] < args.throughput_count:
+                    errors.append(f"{n} workers : {args.throughput_count - totals['received']} messages non reçus")
+                if scaling_baseline is None:
+                    scaling_baseline = totals
+                else:
+                    errors.extend(check_scaling(args, n, totals, scaling_baseline))
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+
+    if args.count and not args.rate:
+        print("(--rate 0 : les totaux admis dépendent de la vitesse de traitement et ne sont pas comparés)")
+    for e in errors:
+        print(f"❌ {e}")
+    if errors:
+        sys.exit(1)
+    print(f"✅ Admission et enregistrements identiques à un seul worker, efficacité >= {args.min_efficiency:.0%}")
+
+
+if __name__ == '__main__':
+    main()
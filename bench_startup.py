@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Cold-start time of the web and ingest roles, against time budgets.
+
+For each role it measures, as a fresh process would see it:
+    import   `import app` / `import ingest_worker` (must not touch the DB
+             or the broker, so it is fast even when they are down)
+    listen   web only: until the HTTP server answers /api/stats/startup
+    ready    until the schema is checked, the in-memory state restored and
+             MQTT started ('Démarrage terminé' log line)
+and exits with status 1 if a budget is exceeded.
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --roles web --budget-ready-ms 5000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+READY_LINE = "Démarrage terminé"
+ROLES = {
+    'web': ('app', ['app.py'], {}),
+    'ingest': ('ingest_worker', ['ingest_worker.py'], {'MQTT_ROLE': 'ingest'}),
+}
+
+
+def time_import(module, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def _wait_log_line(proc, found):
+    for line in proc.stderr:
+        if READY_LINE in line:
+            found.set()
+
+
+def time_start(role, args, env):
+    """(listen ms, ready ms) of one process start; None where the timeout passed."""
+    _, command, _ = ROLES[role]
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable] + command, env=env, text=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    ready = threading.Event()
+    threading.Thread(target=_wait_log_line, args=(proc, ready), daemon=True).start()
+    listen_ms = ready_ms = None
+    deadline = start + args.timeout
+    try:
+        while time.perf_counter() < deadline and ready_ms is None:
+            if role == 'web' and listen_ms is None:
+                try:
+                    with urllib.request.urlopen(args.url + '/api/stats/startup', timeout=1) as resp:
+                        json.load(resp)
+                    listen_ms = (time.perf_counter() - start) * 1000
+                except (urllib.error.URLError, OSError, ValueError):
+                    pass
+            if ready.wait(0.02):
+                ready_ms = (time.perf_counter() - start) * 1000
+            if proc.poll() is not None:
+                break
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return listen_ms, ready_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roles', nargs='+', choices=list(ROLES), default=list(ROLES))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for one start")
+    parser.add_argument('--budget-import-ms', type=float, default=2000)
+    parser.add_argument('--budget-listen-ms', type=float, default=3000)
+    parser.add_argument('--budget-ready-ms', type=float, default=15000)
+    args = parser.parse_args()
+
+    exceeded = []
+    for role in args.roles:
+        module, _, extra_env = ROLES[role]
+        env = dict(os.environ, **extra_env)
+        imports = [time_import(module, env) for _ in range(args.runs)]
+        starts = [time_start(role, args, env) for _ in range(args.runs)]
+
+        measures = {"import": imports}
+        if role == 'web':
+            measures["listen"] = [s[0] if s[0] is not None else float('inf') for s in starts]
+        measures["ready"] = [s[1] if s[1] is not None else float('inf') for s in starts]
+        budgets = {"import": args.budget_import_ms, "listen": args.budget_listen_ms,
+                   "ready": args.budget_ready_ms}
+
+        print(f"=== {role} ===")
+        for name, values in measures.items():
+            median = statistics.median(values)
+            print(f"  {name:<7} médiane {median:8.0f} ms  max {max(values):8.0f} ms  (budget {budgets[name]:.0f} ms)")
+            if median > budgets[name]:
+                exceeded.append(f"{role} {name} {median:.0f} ms > {budgets[name]:.0f} ms")
+
+    for e in exceeded:
+        print(f"❌ {e}")
+    if exceeded:
+        sys.exit(1)
+    print("✅ Tous les budgets de démarrage sont respectés")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# capture.py
+"""
+Optional capture of raw MQTT traffic (topic, payload, receive time) to
+rotating NDJSON files, and the reader used by replay_mqtt.py.
+
+Enabled by setting MQTT_CAPTURE_DIR. One JSON object per line:
+    {"t": <unix receive time>, "topic": "...", "p": "<payload>"}
+Payloads that are not valid UTF-8 are stored base64-encoded under "b" instead of "p".
+"""
+import atexit
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+MQTT_CAPTURE_DIR = os.environ.get('MQTT_CAPTURE_DIR')
+MQTT_CAPTURE_MAX_BYTES = int(os.environ.get('MQTT_CAPTURE_MAX_BYTES', 50_000_000))
+MQTT_CAPTURE_BACKUPS = int(os.environ.get('MQTT_CAPTURE_BACKUPS', 20))
+# The write buffer is flushed at least this often (at most this much traffic lost on a crash)
+MQTT_CAPTURE_FLUSH_SECONDS = float(os.environ.get('MQTT_CAPTURE_FLUSH_SECONDS', 1))
+
+
+class CaptureWriter:
+    """Append-only NDJSON writer rotating files by size, keeping the last `backups` files."""
+
+    def __init__(self, directory, max_bytes=MQTT_CAPTURE_MAX_BYTES, backups=MQTT_CAPTURE_BACKUPS,
+                 flush_seconds=MQTT_CAPTURE_FLUSH_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._flushed_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        name = datetime.now().strftime('capture-%Y%m%d-%H%M%S-%f.ndjson')
+        self._file = open(os.path.join(self.directory, name), 'ab', buffering=64 * 1024)
+        self._size = 0
+        files = sorted(glob.glob(os.path.join(self.directory, 'capture-*.ndjson*')))
+        for old in files[:-self.backups]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def write(self, topic, payload, received=None):
+        record = {"t": round(received or time.time(), 6), "topic": topic}
+        try:
+            record["p"] = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            record["b"] = base64.b64encode(payload).decode('ascii')
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._file is None or self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+            now = time.monotonic()
+            if now - self._flushed_at >= self.flush_seconds:
+                self._file.flush()
+                self._flushed_at = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_writer = None
+
+
+def record(topic, payload):
+    """Capture one raw message if MQTT_CAPTURE_DIR is set (never raises)."""
+    global _writer
+    if not MQTT_CAPTURE_DIR:
+        return
+    try:
+        if _writer is None:
+            _writer = CaptureWriter(MQTT_CAPTURE_DIR)
+            # ingest_worker.py turns SIGTERM into a normal exit, so this also runs on stop
+            atexit.register(_writer.close)
+        _writer.write(topic, payload)
+    except Exception as e:
+        logging.error("Erreur capture MQTT : %s", e)
+
+
+def read_capture(paths):
+    """Yield (receive_time, topic, payload_bytes) from capture files, in file order.
+
+    Accepts .ndjson and gzip-compressed .ndjson.gz files.
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # truncated last line of a file being written
+                payload = base64.b64decode(rec['b']) if 'b' in rec else rec.get('p', '').encode('utf-8')
+                yield rec['t'], rec['topic'], payload
+
+
+class ReplayMessage:
+    """Stand-in for paho's MQTTMessage carrying the original receive time."""
+
+    __slots__ = ('topic', 'payload', 'received_at')
+
+    def __init__(self, topic, payload, received_at=None):
+        self.topic = topic
+        self.payload = payload
+        self.received_at = received_at
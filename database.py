@@ -1,8 +1,17 @@
 import mysql.connector
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 import os
 import time
 import logging
+import zlib
+import archive
+import sketches
+import timeseries
+from throttle import throttle
+from hottier import hot_tier
+from spool import breaker
 
 # Configuration Database
 DB_HOST = os.environ.get('DB_HOST', 'db_bzh')
@@ -10,8 +19,30 @@ DB_USER = os.environ.get('DB_USER', 'prof_bzh')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'prof_bzh@root')
 DB_NAME = os.environ.get('DB_NAME', 'icambzh')
 
-def get_db_connection():
-    retries = 5
+# mqtt_messages payloads at least this long are stored zlib-compressed (0 = never)
+PAYLOAD_COMPRESS_MIN_SIZE = int(os.environ.get('PAYLOAD_COMPRESS_MIN_SIZE', 512))
+PAYLOAD_RAW = 0
+PAYLOAD_ZLIB = 1
+
+# Projects above this rate (msg/min over the last 5 min) are reported with a 'High' volume
+VOLUME_HIGH_RATE = float(os.environ.get('VOLUME_HIGH_RATE', 60))
+
+# In-process cache of the mqtt_topics dictionary: topic -> id
+TOPIC_CACHE_MAX = 100_000
+_topic_ids = {}
+
+class DatabaseUnavailable(Exception):
+    """The database cannot be reached (or the circuit breaker is open)."""
+
+# Errors meaning "the DB is down" rather than "this statement is wrong":
+# ingest writes re-raise them so mqtt_client can spool the record (see spool.py)
+DB_DOWN_ERRORS = (DatabaseUnavailable, mysql.connector.errors.InterfaceError,
+                  mysql.connector.errors.OperationalError)
+
+def get_db_connection(retries=5):
+    # Fail fast while the circuit is open instead of sleeping through retries
+    if not breaker.allow():
+        raise DatabaseUnavailable("Base de données indisponible (circuit ouvert)")
     while retries > 0:
         try:
             conn = mysql.connector.connect(
@@ -20,126 +51,440 @@ def get_db_connection():
                 password=DB_PASSWORD,
                 database=DB_NAME
             )
+            breaker.record_success()
             return conn
         except mysql.connector.Error as err:
             logging.error(f"Erreur de connexion DB: {err}")
+            breaker.record_failure()
             retries -= 1
+            if retries == 0 or breaker.is_open():
+                break
             time.sleep(2)
-    raise Exception("Impossible de se connecter à la base de données")
+    raise DatabaseUnavailable("Impossible de se connecter à la base de données")
 
-def init_db():
-    conn = get_db_connection()
+# Analysis (read) queries use their own small pool and a per-statement time limit
+ANALYSIS_MAX_CONCURRENT = int(os.environ.get('ANALYSIS_MAX_CONCURRENT', 2))
+# get_mqtt_project_details runs its SQL parts side by side on this many connections
+PROJECT_DETAILS_FANOUT = 2
+ANALYSIS_POOL_SIZE = ANALYSIS_MAX_CONCURRENT * PROJECT_DETAILS_FANOUT
+ANALYSIS_STATEMENT_TIMEOUT = float(os.environ.get('ANALYSIS_STATEMENT_TIMEOUT', 10))
+_read_pool = None
+
+def get_read_connection():
+    """Pooled connection for heavy read queries, separate from the ingest writes."""
+    global _read_pool
+    if _read_pool is None:
+        from mysql.connector import pooling
+        _read_pool = pooling.MySQLConnectionPool(
+            pool_name="analysis",
+            pool_size=ANALYSIS_POOL_SIZE,
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME
+        )
+    conn = _read_pool.get_connection()
     c = conn.cursor()
-    
-    # Table for sensor measurements
-    c.execute('''CREATE TABLE IF NOT EXISTS measurements
-                 (id INT AUTO_INCREMENT PRIMARY KEY,
-                  module VARCHAR(255),
-                  variable VARCHAR(255),
-                  value TEXT,
-                  timestamp DATETIME)''')
-    
-    # Table for message statistics (e.g., count per minute)
-    c.execute('''CREATE TABLE IF NOT EXISTS message_stats
-                 (id INT AUTO_INCREMENT PRIMARY KEY,
-                  timestamp DATETIME)''')
-    
-    # Table for module publication tracking (hourly)
-    c.execute('''CREATE TABLE IF NOT EXISTS module_publications
-                 (id INT AUTO_INCREMENT PRIMARY KEY,
-                  module VARCHAR(255),
-                  timestamp DATETIME)''')
-
-    # NEW: Table for detailed MQTT message analysis (Last 1M messages)
-    # We will periodically clean this table or use a capped collection approach if needed.
-    # For now, standard table.
-    c.execute('''CREATE TABLE IF NOT EXISTS mqtt_messages
-                 (id INT AUTO_INCREMENT PRIMARY KEY,
-                  topic VARCHAR(512),
-                  payload TEXT,
-                  timestamp DATETIME,
-                  project VARCHAR(255),
-                  category VARCHAR(50),
-                  is_compliant BOOLEAN,
-                  INDEX idx_timestamp (timestamp),
-                  INDEX idx_project (project))''')
+    # MariaDB: abort SELECTs running longer than the limit (error 1969)
+    c.execute("SET SESSION max_statement_time = %s", (ANALYSIS_STATEMENT_TIMEOUT,))
+    c.close()
+    return conn
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Bring the schema up to date (versioned migrations, see migrations.py)."""
+    import migrations
+    return migrations.migrate()
 
-def save_measurement(module, variable, value):
+def save_measurement(module, variable, value, timestamp=None):
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(retries=1)
         c = conn.cursor()
+        # DATETIME has second precision: keep the hot tier identical to the DB
+        now = (timestamp or datetime.now()).replace(microsecond=0)
         c.execute("INSERT INTO measurements (module, variable, value, timestamp) VALUES (%s, %s, %s, %s)",
-                  (module, variable, value, datetime.now()))
+                  (module, variable, value, now))
         conn.commit()
         conn.close()
+        hot_tier.append(module, variable, value, now)
+    except DB_DOWN_ERRORS:
+        raise
     except Exception as e:
         logging.error(f"Erreur save_measurement: {e}")
 
-def log_message_receipt():
+def log_message_receipt(timestamp=None):
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(retries=1)
         c = conn.cursor()
-        c.execute("INSERT INTO message_stats (timestamp) VALUES (%s)", (datetime.now(),))
+        c.execute("INSERT INTO message_stats (timestamp) VALUES (%s)", (timestamp or datetime.now(),))
         conn.commit()
         conn.close()
+    except DB_DOWN_ERRORS:
+        raise
     except Exception as e:
         logging.error(f"Erreur log_message_receipt: {e}")
 
-def log_mqtt_message(topic, payload, project, category, is_compliant):
+def encode_payload(payload):
+    """Return (stored_bytes, payload_encoding) for an mqtt_messages payload."""
+    data = payload.encode('utf-8')
+    if PAYLOAD_COMPRESS_MIN_SIZE and len(data) >= PAYLOAD_COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return compressed, PAYLOAD_ZLIB
+    return data, PAYLOAD_RAW
+
+def decode_payload(data, encoding):
+    """Inverse of encode_payload()."""
+    if data is None:
+        return None
+    data = bytes(data)
+    if encoding == PAYLOAD_ZLIB:
+        data = zlib.decompress(data)
+    return data.decode('utf-8', errors='replace')
+
+def get_topic_id(cursor, topic, project, category, inserted):
+    """Id of `topic` in mqtt_topics, inserting it on first sight (cached in process).
+
+    Ids looked up in the database are added to `inserted` rather than to the
+    cache: pass it to remember_topic_ids() once the transaction is committed,
+    so a rollback never leaves an id that does not exist in the cache.
+    """
+    topic_id = _topic_ids.get(topic)
+    if topic_id is None:
+        topic_id = inserted.get(topic)
+    if topic_id is not None:
+        return topic_id
+    # LAST_INSERT_ID(id) makes lastrowid return the existing id on duplicates
+    cursor.execute("""INSERT INTO mqtt_topics (topic, project, category) VALUES (%s, %s, %s)
+                      ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)""",
+                   (topic, project, category))
+    inserted[topic] = cursor.lastrowid
+    return inserted[topic]
+
+def remember_topic_ids(inserted):
+    """Cache the topic ids of a committed transaction (see get_topic_id)."""
+    if len(_topic_ids) + len(inserted) > TOPIC_CACHE_MAX:
+        _topic_ids.clear()
+    _topic_ids.update(inserted)
+
+def log_mqtt_message(topic, payload, project, category, is_compliant, timestamp=None):
     """Log detailed MQTT message for analysis."""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(retries=1)
         c = conn.cursor()
-        # Optional: Maintain only last 1M messages. 
-        # This is expensive to do on every insert. Better to do it periodically or via a job.
-        # For this implementation, we'll just insert.
-        
+        inserted = {}
+        topic_id = get_topic_id(c, topic, project, category, inserted)
+        data, encoding = encode_payload(payload)
         c.execute("""INSERT INTO mqtt_messages 
-                     (topic, payload, timestamp, project, category, is_compliant) 
-                     VALUES (%s, %s, %s, %s, %s, %s)""",
-                  (topic, payload, datetime.now(), project, category, is_compliant))
+                     (topic_id, payload, payload_encoding, timestamp, is_compliant) 
+                     VALUES (%s, %s, %s, %s, %s)""",
+                  (topic_id, data, encoding, timestamp or datetime.now(), is_compliant))
         conn.commit()
+        remember_topic_ids(inserted)
         conn.close()
+    except DB_DOWN_ERRORS:
+        raise
     except Exception as e:
         logging.error(f"Erreur log_mqtt_message: {e}")
 
 def get_history(module, variable, limit=100):
+    # Recent points are served from the in-memory hot tier when it covers them
+    data = hot_tier.history(module, variable, limit)
+    if data is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT value, timestamp FROM measurements WHERE module=%s AND variable=%s ORDER BY timestamp DESC LIMIT %s",
+                  (module, variable, limit))
+        data = c.fetchall()
+        conn.close()
+        # Return reversed to show oldest to newest in chart
+        data = data[::-1]
+    return _with_archived(module, variable, data, limit)
+
+def _with_archived(module, variable, data, limit):
+    """Complete a short history (oldest first) with points moved to the cold archive."""
+    if len(data) >= limit:
+        return data
+    before = data[0][1] if data else None
+    return archive.tail(module, variable, limit - len(data), before) + data
+
+def get_history_batch(series=None, module=None, limit=100):
+    """History of several series in one query.
+
+    `series` is a list of (module, variable) pairs; alternatively `module` selects
+    every variable of that module. Returns {module: {variable: [(value, timestamp), ...]}}
+    with the last `limit` points of each series, oldest first (same rows as get_history).
+    """
+    result = {}
+    if series:
+        # Series covered by the hot tier are answered from memory
+        missing = []
+        for mod, var in series:
+            data = hot_tier.history(mod, var, limit)
+            if data is None:
+                missing.append((mod, var))
+            else:
+                result.setdefault(mod, {})[var] = data
+        if not missing:
+            return _fill_from_archive(result, series, limit)
+        requested = series
+        series = missing
+        placeholders = ", ".join(["(%s, %s)"] * len(series))
+        where = f"(module, variable) IN ({placeholders})"
+        params = [item for pair in series for item in pair]
+    elif module:
+        requested = None
+        where = "module = %s"
+        params = [module]
+    else:
+        return {}
+
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT value, timestamp FROM measurements WHERE module=%s AND variable=%s ORDER BY timestamp DESC LIMIT %s",
-              (module, variable, limit))
-    data = c.fetchall()
+    # ROW_NUMBER() keeps the last `limit` rows per series in a single pass
+    c.execute(f"""
+        SELECT module, variable, value, timestamp FROM (
+            SELECT module, variable, value, timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY module, variable ORDER BY timestamp DESC) AS rn
+            FROM measurements
+            WHERE {where}
+        ) ranked
+        WHERE rn <= %s
+        ORDER BY module, variable, timestamp ASC
+    """, (*params, limit))
+    rows = c.fetchall()
     conn.close()
-    # Return reversed to show oldest to newest in chart
-    return data[::-1]
 
-def get_message_stats(limit=60):
-    """Returns message count per minute for the last 'limit' minutes."""
-    conn = get_db_connection()
-    c = conn.cursor()
-    # MySQL syntax for date formatting
-    c.execute('''SELECT DATE_FORMAT(timestamp, '%Y-%m-%d %H:%i') as minute, COUNT(*) 
-                 FROM message_stats 
-                 GROUP BY minute 
-                 ORDER BY minute DESC LIMIT %s''', (limit,))
-    data = c.fetchall()
+    for mod, var, value, ts in rows:
+        result.setdefault(mod, {}).setdefault(var, []).append((value, ts))
+    return _fill_from_archive(result, requested, limit)
+
+def _fill_from_archive(result, series, limit):
+    """Top up short series of a get_history_batch result from the cold archive."""
+    if series is None:
+        series = [(mod, var) for mod, variables in result.items() for var in variables]
+    for mod, var in series:
+        data = _with_archived(mod, var, result.get(mod, {}).get(var, []), limit)
+        if data:
+            result.setdefault(mod, {})[var] = data
+    return result
+
+# Above this many matching topics, browse_mqtt_messages scans idx_timestamp instead of
+# merging one index range per topic
+BROWSE_MAX_TOPIC_RANGES = 200
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor for browse_mqtt_messages()."""
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def decode_cursor(cursor):
+    timestamp, row_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def browse_mqtt_messages(project=None, topic_prefix=None, category=None, compliant=None,
+                         cursor=None, limit=50):
+    """One page of mqtt_messages, newest first, with keyset pagination on (timestamp, id).
+
+    Returns (messages, next_cursor). Each page is an index range scan starting at
+    the cursor, so deep pages cost the same as the first one.
+    """
+    conn = get_read_connection()
+    c = conn.cursor(dictionary=True)
+
+    # 1. Resolve the topic filters against the (small) topic dictionary
+    topics = None
+    if project or topic_prefix or category:
+        where, params = [], []
+        if project:
+            where.append("project = %s")
+            params.append(project)
+        if topic_prefix:
+            escaped = topic_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("topic LIKE %s")
+            params.append(escaped + '%')
+        if category:
+            where.append("category = %s")
+            params.append(category)
+        c.execute(f"SELECT id, topic, category FROM mqtt_topics WHERE {' AND '.join(where)}", params)
+        topics = {row['id']: row for row in c.fetchall()}
+        if not topics:
+            conn.close()
+            return [], None
+
+    # 2. Keyset condition shared by every range
+    conditions, params = [], []
+    if compliant is not None:
+        conditions.append("is_compliant = %s")
+        params.append(1 if compliant else 0)
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        conditions.append("(timestamp < %s OR (timestamp = %s AND id < %s))")
+        params += [ts, ts, row_id]
+
+    columns = "id, topic_id, payload, payload_encoding, timestamp, is_compliant"
+    order = "ORDER BY timestamp DESC, id DESC LIMIT %s"
+    if topics is not None and len(topics) <= BROWSE_MAX_TOPIC_RANGES:
+        # One bounded index range per topic, merged by the outer ORDER BY
+        where = " AND ".join(["topic_id = %s"] + conditions)
+        parts, all_params = [], []
+        for topic_id in topics:
+            parts.append(f"(SELECT {columns} FROM mqtt_messages WHERE {where} {order})")
+            all_params += [topic_id] + params + [limit]
+        query = " UNION ALL ".join(parts) + f" {order}"
+        all_params.append(limit)
+    else:
+        if topics is not None:
+            conditions.insert(0, f"topic_id IN ({', '.join(['%s'] * len(topics))})")
+            params = list(topics) + params
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT {columns} FROM mqtt_messages {where} {order}"
+        all_params = params + [limit]
+
+    c.execute(query, all_params)
+    rows = c.fetchall()
+
+    # 3. Topic strings for rows outside the resolved dictionary (unfiltered browsing)
+    missing = {row['topic_id'] for row in rows} - set(topics or ())
+    if missing:
+        c.execute(f"SELECT id, topic, category FROM mqtt_topics WHERE id IN ({', '.join(['%s'] * len(missing))})",
+                  list(missing))
+        topics = dict(topics or {})
+        topics.update({row['id']: row for row in c.fetchall()})
     conn.close()
-    return data[::-1]
 
-def log_module_publication(module):
+    messages = []
+    for row in rows:
+        topic = (topics or {}).get(row['topic_id'], {})
+        messages.append({
+            "id": row['id'],
+            "topic": topic.get('topic'),
+            "category": topic.get('category'),
+            "payload": decode_payload(row['payload'], row['payload_encoding']),
+            "timestamp": row['timestamp'],
+            "is_compliant": bool(row['is_compliant']),
+        })
+    next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if len(rows) == limit else None
+    return messages, next_cursor
+
+# Rows fetched per round-trip by the streaming exports
+EXPORT_FETCH_SIZE = 5000
+
+def _iter_query(query, params):
+    """Yield the column names, then every row of `query`, in constant memory.
+
+    The cursor is unbuffered, so rows are streamed from the server in
+    EXPORT_FETCH_SIZE batches instead of being loaded all at once.
+    """
+    conn = get_db_connection()
+    c = conn.cursor(buffered=False)
+    try:
+        c.execute(query, params)
+        yield [col[0] for col in c.description]
+        while True:
+            rows = c.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            # Client went away mid-export: the unread result set is dropped with the connection
+            pass
+
+def iter_measurements(module, start, end, variable=None):
+    """Stream measurements of a module (optionally one variable) between start and end."""
+    query = """SELECT module, variable, value, timestamp FROM measurements
+               WHERE module = %s AND timestamp >= %s AND timestamp < %s"""
+    params = [module, start, end]
+    if variable:
+        query += " AND variable = %s"
+        params.append(variable)
+    query += " ORDER BY timestamp"
+    return _with_archive_rows(_iter_query(query, params), archive.iter_rows(module, start, end, variable))
+
+def _with_archive_rows(rows, archived):
+    """Header of `rows`, then the (older) archived rows, then the DB rows."""
+    yield next(rows)
+    yield from archived
+    yield from rows
+
+def iter_mqtt_messages(project, start, end):
+    """Stream the mqtt_messages of a project between start and end (payloads decoded)."""
+    rows = _iter_query("""
+        SELECT m.id, m.timestamp, t.topic, t.project, t.category, m.is_compliant, m.payload, m.payload_encoding
+        FROM mqtt_messages m
+        JOIN mqtt_topics t ON t.id = m.topic_id
+        WHERE t.project = %s AND m.timestamp >= %s AND m.timestamp < %s
+        ORDER BY m.timestamp, m.id
+    """, (project, start, end))
+    header = next(rows)
+    yield header[:-1]
+    for row in rows:
+        yield row[:6] + (decode_payload(row[6], row[7]),)
+
+def get_message_stats(limit=60):
+    """Returns message count per minute for the last 'limit' minutes (from memory)."""
+    return timeseries.registry.message_stats(limit)
+
+def log_module_publication(module, timestamp=None):
     """Log a publication for a specific module."""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(retries=1)
         c = conn.cursor()
-        c.execute("INSERT INTO module_publications (module, timestamp) VALUES (%s, %s)", (module, datetime.now()))
+        c.execute("INSERT INTO module_publications (module, timestamp) VALUES (%s, %s)", (module, timestamp or datetime.now()))
         conn.commit()
         conn.close()
+    except DB_DOWN_ERRORS:
+        raise
     except Exception as e:
         logging.error(f"Erreur log_module_publication: {e}")
 
+def apply_spooled_batch(records):
+    """Write a batch of spooled ingest writes [(function_name, args)] in one transaction.
+
+    Raises on any error so that the spool keeps its read position.
+    """
+    measurements, receipts, publications, messages = [], [], [], []
+    for name, args in records:
+        if name == 'save_measurement':
+            module, variable, value, ts = args
+            measurements.append((module, variable, value, ts.replace(microsecond=0)))
+        elif name == 'log_message_receipt':
+            receipts.append((args[0],))
+        elif name == 'log_module_publication':
+            publications.append(tuple(args))
+        elif name == 'log_mqtt_message':
+            messages.append(args)
+        else:
+            logging.error("Enregistrement de spool inconnu ignoré: %s", name)
+
+    conn = get_db_connection(retries=1)
+    try:
+        c = conn.cursor()
+        if measurements:
+            c.executemany("INSERT INTO measurements (module, variable, value, timestamp) VALUES (%s, %s, %s, %s)",
+                          measurements)
+        if receipts:
+            c.executemany("INSERT INTO message_stats (timestamp) VALUES (%s)", receipts)
+        if publications:
+            c.executemany("INSERT INTO module_publications (module, timestamp) VALUES (%s, %s)", publications)
+        inserted = {}
+        if messages:
+            rows = []
+            for topic, payload, project, category, is_compliant, ts in messages:
+                data, encoding = encode_payload(payload)
+                rows.append((get_topic_id(c, topic, project, category, inserted), data, encoding, ts, is_compliant))
+            c.executemany("""INSERT INTO mqtt_messages
+                             (topic_id, payload, payload_encoding, timestamp, is_compliant)
+                             VALUES (%s, %s, %s, %s, %s)""", rows)
+        conn.commit()
+        remember_topic_ids(inserted)
+    finally:
+        conn.close()
+    # Older points than what the hot tier holds make it drop the series (DB serves it)
+    for module, variable, value, ts in measurements:
+        hot_tier.append(module, variable, value, ts)
+
 def get_module_publication_trends(hours=24):
     """Returns publication count per hour per module for the last 'hours' hours."""
     conn = get_db_connection()
@@ -181,6 +526,8 @@ def delete_variable_permanently(module, variable):
     deleted_count = c.rowcount
     conn.commit()
     conn.close()
+    hot_tier.discard(module, variable)
+    archive.delete(module, variable)
     return deleted_count
 
 def delete_module_permanently(module):
@@ -198,6 +545,8 @@ def delete_module_permanently(module):
     
     conn.commit()
     conn.close()
+    hot_tier.discard(module)
+    archive.delete(module)
     
     return {
         'measurements': measurements_deleted,
@@ -208,7 +557,7 @@ def delete_module_permanently(module):
 
 def get_mqtt_analysis_global():
     """Get global analysis of MQTT messages."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     c = conn.cursor(dictionary=True)
     
     # Total messages
@@ -224,21 +573,28 @@ def get_mqtt_analysis_global():
     non_compliant = total - compliant
     
     # Active projects (last 24h)
-    c.execute("SELECT COUNT(DISTINCT project) as active_projects FROM mqtt_messages WHERE timestamp >= NOW() - INTERVAL 24 HOUR AND project IS NOT NULL AND project != ''")
+    c.execute("""
+        SELECT COUNT(DISTINCT t.project) as active_projects
+        FROM (SELECT DISTINCT topic_id FROM mqtt_messages WHERE timestamp >= NOW() - INTERVAL 24 HOUR) m
+        JOIN mqtt_topics t ON t.id = m.topic_id
+        WHERE t.project IS NOT NULL AND t.project != ''
+    """)
     active_projects = c.fetchone()['active_projects']
     
-    # Category breakdown
+    # Message count per topic id (integer GROUP BY), then mapped to categories/projects
     c.execute("""
-        SELECT category, COUNT(*) as count 
-        FROM mqtt_messages 
-        GROUP BY category
-        ORDER BY count DESC
+        SELECT t.category, t.project, m.count
+        FROM (SELECT topic_id, COUNT(*) as count FROM mqtt_messages GROUP BY topic_id) m
+        JOIN mqtt_topics t ON t.id = m.topic_id
     """)
-    categories = {row['category']: row['count'] for row in c.fetchall()}
-    
-    # Unknown traffic (no project identified)
-    c.execute("SELECT COUNT(*) as unknown FROM mqtt_messages WHERE project IS NULL OR project = ''")
-    unknown_traffic = c.fetchone()['unknown']
+    categories = {}
+    unknown_traffic = 0
+    for row in c.fetchall():
+        categories[row['category']] = categories.get(row['category'], 0) + row['count']
+        # Unknown traffic (no project identified)
+        if not row['project']:
+            unknown_traffic += row['count']
+    categories = dict(sorted(categories.items(), key=lambda kv: kv[1], reverse=True))
     
     conn.close()
     return {
@@ -248,25 +604,33 @@ def get_mqtt_analysis_global():
         "compliance_rate": round(compliance_rate, 1),
         "active_projects": active_projects,
         "categories": categories,
-        "unknown_traffic": unknown_traffic
+        "unknown_traffic": unknown_traffic,
+        "unique_topics": sketches.registry.distinct_topics()
     }
 
 def get_mqtt_analysis_projects():
     """Get detailed analysis per project."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     c = conn.cursor(dictionary=True)
     
     # Get stats per project
     c.execute("""
         SELECT 
-            project,
-            COUNT(*) as total_msgs,
-            SUM(CASE WHEN is_compliant = 1 THEN 1 ELSE 0 END) as compliant_msgs,
-            MAX(timestamp) as last_seen,
-            COUNT(DISTINCT topic) as unique_topics
-        FROM mqtt_messages 
-        WHERE project IS NOT NULL AND project != ''
-        GROUP BY project
+            t.project,
+            SUM(m.total_msgs) as total_msgs,
+            SUM(m.compliant_msgs) as compliant_msgs,
+            MAX(m.last_seen) as last_seen
+        FROM (
+            SELECT topic_id,
+                   COUNT(*) as total_msgs,
+                   SUM(CASE WHEN is_compliant = 1 THEN 1 ELSE 0 END) as compliant_msgs,
+                   MAX(timestamp) as last_seen
+            FROM mqtt_messages
+            GROUP BY topic_id
+        ) m
+        JOIN mqtt_topics t ON t.id = m.topic_id
+        WHERE t.project IS NOT NULL AND t.project != ''
+        GROUP BY t.project
         ORDER BY total_msgs DESC
     """)
     projects = c.fetchall()
@@ -281,9 +645,12 @@ def get_mqtt_analysis_projects():
         compliance_ratio = p['compliant_msgs'] / p['total_msgs'] if p['total_msgs'] > 0 else 0
         score = 100 * compliance_ratio
         
-        # Simple volume check (just for display)
+        # Volume from the real publication rate (ring buffers) and ingest throttling
+        rate = timeseries.registry.rate(p['project'])
         volume_status = "Normal"
-        if p['total_msgs'] > 10000: # Arbitrary threshold
+        if throttle.is_throttled(p['project']):
+            volume_status = "Throttled"
+        elif rate > VOLUME_HIGH_RATE:
             volume_status = "High"
         
         results.append({
@@ -293,100 +660,76 @@ def get_mqtt_analysis_projects():
             "compliance_rate": round(compliance_ratio * 100, 1),
             "last_seen": p['last_seen'].isoformat() if p['last_seen'] else "N/A",
             "score": round(score, 0),
-            "volume": volume_status
+            "volume": volume_status,
+            "rate": round(rate, 1),
+            "unique_topics": sketches.registry.distinct_topics(p['project'])
         })
         
     conn.close()
     return results
 
+def _project_aggregates(project_name):
+    """Categories and overall stats of a project from one covering-index scan.
+
+    Groups by (topic_id, is_compliant) on idx_topic_compliant_timestamp, so
+    COUNT, MIN and MAX never read the table rows; the per-topic groups are
+    then rolled up by category and in total here.
+    """
+    conn = get_read_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, category FROM mqtt_topics WHERE project = %s", (project_name,))
+    topic_categories = dict(c.fetchall())
+    groups = []
+    if topic_categories:
+        c.execute(f"""
+            SELECT topic_id, is_compliant, COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM mqtt_messages
+            WHERE topic_id IN ({', '.join(['%s'] * len(topic_categories))})
+            GROUP BY topic_id, is_compliant
+        """, list(topic_categories))
+        groups = c.fetchall()
+    conn.close()
+
+    categories = defaultdict(int)
+    stats = {"total": 0, "compliant": 0, "first_seen": None, "last_seen": None}
+    for topic_id, is_compliant, count, first_seen, last_seen in groups:
+        categories[topic_categories[topic_id]] += count
+        stats["total"] += count
+        if is_compliant:
+            stats["compliant"] += count
+        if stats["first_seen"] is None or first_seen < stats["first_seen"]:
+            stats["first_seen"] = first_seen
+        if stats["last_seen"] is None or last_seen > stats["last_seen"]:
+            stats["last_seen"] = last_seen
+    categories = [{"category": cat, "count": n}
+                  for cat, n in sorted(categories.items(), key=lambda item: -item[1])]
+    return categories, stats
+
+_details_executor = None
+
 def get_mqtt_project_details(project_name):
-    """Get detailed analysis for a specific project."""
-    conn = get_db_connection()
-    c = conn.cursor(dictionary=True)
-    
-    # 1. Error analysis - non-compliant messages
-    c.execute("""
-        SELECT topic, COUNT(*) as count
-        FROM mqtt_messages
-        WHERE project = %s AND is_compliant = 0
-        GROUP BY topic
-        ORDER BY count DESC
-        LIMIT 10
-    """, (project_name,))
-    errors = c.fetchall()
-    
-    # 2. Publication frequency - messages per minute over last hour
-    c.execute("""
-        SELECT 
-            DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:%%i') as minute,
-            COUNT(*) as count
-        FROM mqtt_messages
-        WHERE project = %s AND timestamp >= NOW() - INTERVAL 1 HOUR
-        GROUP BY minute
-        ORDER BY minute DESC
-    """, (project_name,))
-    frequency = c.fetchall()
-    
-    # Calculate stats
+    """Get detailed analysis for a specific project.
+
+    Errors, top topics, frequency and timeline come from the in-memory ingest
+    sketches and ring buffers; the aggregates scan and the recent messages
+    query run concurrently on separate read connections.
+    """
+    global _details_executor
+    if _details_executor is None:
+        _details_executor = ThreadPoolExecutor(max_workers=ANALYSIS_MAX_CONCURRENT,
+                                               thread_name_prefix='project-details')
+    recent = _details_executor.submit(browse_mqtt_messages, project=project_name, limit=10)
+
+    errors = sketches.registry.top_errors(project_name, 10)
+    top_topics = sketches.registry.top_topics(project_name, 10)
+    frequency = timeseries.registry.frequency(project_name)
+    timeline = timeseries.registry.timeline(project_name)
     max_freq = max([f['count'] for f in frequency], default=0)
     avg_freq = sum([f['count'] for f in frequency]) / len(frequency) if frequency else 0
-    
-    # 3. Topic breakdown by category
-    c.execute("""
-        SELECT category, COUNT(*) as count
-        FROM mqtt_messages
-        WHERE project = %s
-        GROUP BY category
-    """, (project_name,))
-    categories = c.fetchall()
-    
-    # 4. Most active topics
-    c.execute("""
-        SELECT topic, COUNT(*) as count, MAX(timestamp) as last_seen
-        FROM mqtt_messages
-        WHERE project = %s
-        GROUP BY topic
-        ORDER BY count DESC
-        LIMIT 10
-    """, (project_name,))
-    top_topics = c.fetchall()
-    
-    # 5. Activity timeline - messages per hour last 24h
-    c.execute("""
-        SELECT 
-            DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:00') as hour,
-            COUNT(*) as count
-        FROM mqtt_messages
-        WHERE project = %s AND timestamp >= NOW() - INTERVAL 24 HOUR
-        GROUP BY hour
-        ORDER BY hour ASC
-    """, (project_name,))
-    timeline = c.fetchall()
-    
-    # 6. Overall stats
-    c.execute("""
-        SELECT 
-            COUNT(*) as total,
-            SUM(CASE WHEN is_compliant = 1 THEN 1 ELSE 0 END) as compliant,
-            MIN(timestamp) as first_seen,
-            MAX(timestamp) as last_seen
-        FROM mqtt_messages
-        WHERE project = %s
-    """, (project_name,))
-    stats = c.fetchone()
-    
-    # 7. Recent messages (last 50)
-    c.execute("""
-        SELECT topic, payload, timestamp, is_compliant
-        FROM mqtt_messages
-        WHERE project = %s
-        ORDER BY timestamp DESC
-        LIMIT 10
-    """, (project_name,))
-    recent_messages = c.fetchall()
-    
-    conn.close()
-    
+
+    categories, stats = _project_aggregates(project_name)
+    recent_messages, _ = recent.result()
+
     return {
         "project": project_name,
         "stats": stats,
@@ -402,6 +745,164 @@ def get_mqtt_project_details(project_name):
         "recent_messages": recent_messages
     }
 
+def load_alert_rules():
+    """Enabled alert rules as rules.Rule objects."""
+    from rules import Rule
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("""SELECT id, name, topic_filter, operator, threshold, cooldown_seconds
+                 FROM alert_rules WHERE enabled = 1""")
+    rules = [Rule(*row) for row in c.fetchall()]
+    conn.close()
+    return rules
+
+def list_alert_rules():
+    conn = get_db_connection()
+    c = conn.cursor(dictionary=True)
+    c.execute("""SELECT id, name, topic_filter, operator, threshold, cooldown_seconds, enabled, created_at
+                 FROM alert_rules ORDER BY id""")
+    rules = c.fetchall()
+    conn.close()
+    return rules
+
+def add_alert_rule(name, topic_filter, operator, threshold, cooldown_seconds):
+    """Insert an alert rule; returns its id."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("""INSERT INTO alert_rules (name, topic_filter, operator, threshold, cooldown_seconds, enabled, created_at)
+                 VALUES (%s, %s, %s, %s, %s, 1, %s)""",
+              (name, topic_filter, operator, threshold, cooldown_seconds, datetime.now()))
+    rule_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return rule_id
+
+def delete_alert_rule(rule_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM alert_rules WHERE id = %s", (rule_id,))
+    deleted = c.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+def _save_states(table, states, evicted=()):
+    """Upsert [(scope, serialized_state)] into a checkpoint table and delete the `evicted` scopes."""
+    if not states and not evicted:
+        return
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = datetime.now()
+    if evicted:
+        c.executemany(f"DELETE FROM {table} WHERE scope = %s", [(scope,) for scope in evicted])
+    if states:
+        c.executemany(f"""INSERT INTO {table} (scope, state, updated_at) VALUES (%s, %s, %s)
+                          ON DUPLICATE KEY UPDATE state = VALUES(state), updated_at = VALUES(updated_at)""",
+                      [(scope, state, now) for scope, state in states])
+    conn.commit()
+    conn.close()
+
+def save_sketch_states(states, evicted=()):
+    """Persist [(scope, serialized_state)] from sketches.SketchRegistry.dump_dirty(), deleting the evicted scopes."""
+    try:
+        _save_states('mqtt_sketches', states, evicted)
+    except Exception as e:
+        logging.error(f"Erreur save_sketch_states: {e}")
+
+def save_timeseries_states(states):
+    """Persist [(scope, serialized_state)] from timeseries.TimeSeriesRegistry.dump_dirty()."""
+    try:
+        _save_states('mqtt_timeseries', states)
+    except Exception as e:
+        logging.error(f"Erreur save_timeseries_states: {e}")
+
+def load_sketch_states():
+    """Load persisted sketches into sketches.registry.
+
+    If nothing was persisted yet (first start), the sketches are rebuilt once
+    from mqtt_messages so the analysis panels are not empty.
+    """
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT scope, state FROM mqtt_sketches ORDER BY updated_at")
+        states = c.fetchall()
+        if states:
+            sketches.registry.load(states)
+        else:
+            c.execute("""
+                SELECT t.topic, t.project, m.is_compliant, m.count, m.last_seen
+                FROM (SELECT topic_id, is_compliant, COUNT(*) as count, MAX(timestamp) as last_seen
+                      FROM mqtt_messages GROUP BY topic_id, is_compliant) m
+                JOIN mqtt_topics t ON t.id = m.topic_id
+            """)
+            for topic, project, is_compliant, count, last_seen in c.fetchall():
+                sketches.registry.observe(topic, project, is_compliant, last_seen, count)
+            logging.info("Sketches reconstruits depuis mqtt_messages")
+        conn.close()
+    except Exception as e:
+        logging.error(f"Erreur load_sketch_states: {e}")
+
+def load_timeseries_states():
+    """Load the ring-buffer checkpoints into timeseries.registry.
+
+    Without checkpoints (first start), the rings are warmed up from the last
+    24 h of mqtt_messages and the last hour of message_stats.
+    """
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT scope, state FROM mqtt_timeseries")
+        states = c.fetchall()
+        if states:
+            timeseries.registry.load(states)
+        else:
+            c.execute("""
+                SELECT t.project, UNIX_TIMESTAMP(m.minute), m.count
+                FROM (SELECT topic_id, DATE_FORMAT(timestamp, '%Y-%m-%d %H:%i:00') as minute, COUNT(*) as count
+                      FROM mqtt_messages
+                      WHERE timestamp >= NOW() - INTERVAL 24 HOUR
+                      GROUP BY topic_id, minute) m
+                JOIN mqtt_topics t ON t.id = m.topic_id
+                WHERE t.project IS NOT NULL AND t.project != ''
+            """)
+            for project, ts, count in c.fetchall():
+                timeseries.registry.record_project(project, float(ts), count)
+            c.execute("""
+                SELECT UNIX_TIMESTAMP(DATE_FORMAT(timestamp, '%Y-%m-%d %H:%i:00')) as minute, COUNT(*)
+                FROM message_stats
+                WHERE timestamp >= NOW() - INTERVAL 1 HOUR
+                GROUP BY minute
+            """)
+            for ts, count in c.fetchall():
+                timeseries.registry.record_global(float(ts), count)
+            logging.info("Séries temporelles reconstruites depuis la base")
+        conn.close()
+    except Exception as e:
+        logging.error(f"Erreur load_timeseries_states: {e}")
+
+def load_hot_tier():
+    """Warm the measurements hot tier: last HOT_TIER_HOURS hours of every series,
+    and at least HOT_TIER_MIN_POINTS points per series whatever their age."""
+    import hottier
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("""
+            SELECT module, variable, value, timestamp FROM (
+                SELECT module, variable, value, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY module, variable ORDER BY timestamp DESC) AS rn
+                FROM measurements
+            ) ranked
+            WHERE rn <= %s OR timestamp >= NOW() - INTERVAL %s HOUR
+            ORDER BY timestamp ASC
+        """, (hottier.HOT_TIER_MIN_POINTS, hottier.HOT_TIER_HOURS))
+        hot_tier.load(c.fetchall())
+        conn.close()
+        logging.info("Hot tier chargé: %s octets", hot_tier.stats()["total_bytes"])
+    except Exception as e:
+        logging.error(f"Erreur load_hot_tier: {e}")
+
 def cleanup_old_mqtt_messages():
     """Keep only the last 1 million MQTT messages to prevent database bloat."""
     try:
@@ -432,3 +933,58 @@ def cleanup_old_mqtt_messages():
     except Exception as e:
         print(f"[MQTT Cleanup] Error: {e}")
 
+
+# Pending archive rows are flushed to disk once this many are buffered
+ARCHIVE_MAX_PENDING = 200_000
+
+def archive_old_measurements(days=archive.ARCHIVE_AFTER_DAYS, batch_rows=archive.ARCHIVE_BATCH_ROWS):
+    """Move measurements of whole days older than `days` to the cold archive.
+
+    Rows are read in id order (roughly chronological), buffered per
+    (module, day) and written to the archive once their day is complete, then
+    deleted from the table in batches. Returns the number of rows archived.
+    """
+    cutoff = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+    conn = get_db_connection()
+    c = conn.cursor()
+    pending = defaultdict(list)   # (module, day) -> [(id, variable, value, timestamp)]
+    archived = 0
+
+    def flush(keys):
+        nonlocal archived
+        ids = []
+        for key in keys:
+            rows = pending.pop(key)
+            archive.append_rows(key[0], key[1], rows)
+            ids.extend(r[0] for r in rows)
+        # Only delete once the rows are safely on disk
+        for i in range(0, len(ids), batch_rows):
+            chunk = ids[i:i + batch_rows]
+            c.execute(f"DELETE FROM measurements WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+            conn.commit()
+        archived += len(ids)
+
+    try:
+        last_id = 0
+        while True:
+            c.execute("""SELECT id, module, variable, value, timestamp FROM measurements
+                         WHERE id > %s AND timestamp < %s ORDER BY id LIMIT %s""",
+                      (last_id, cutoff, batch_rows))
+            rows = c.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            oldest_day = min(r[4] for r in rows).date()
+            for row_id, module, variable, value, ts in rows:
+                pending[(module, ts.date())].append((row_id, variable, value, ts))
+            # Days before this batch's oldest row will (almost surely) get no more rows
+            done = [key for key in pending if key[1] < oldest_day]
+            if sum(len(v) for v in pending.values()) >= ARCHIVE_MAX_PENDING:
+                done = list(pending)
+            if done:
+                flush(done)
+                logging.info("Archivage: %s mesures déplacées", archived)
+        flush(list(pending))
+    finally:
+        conn.close()
+    return archived
@@ -0,0 +1,53 @@
+# eventlog.py
+"""
+Sequence-numbered log of the events pushed to dashboard clients.
+
+Every emitted event (update_data, new_message, delete_data) carries a global,
+increasing `seq`, and the last EVENT_LOG_SIZE events are kept in memory. A
+client that reconnects (or notices a gap in the sequence) asks for
+`since=<last seq seen>` and gets exactly the missed events, or a full
+snapshot when it fell further behind than the log reaches.
+
+Once outbox.outboxes is started, events go through the per-client bounded
+outboxes rather than a direct broadcast.
+"""
+import os
+import threading
+from collections import deque
+
+from outbox import outboxes
+
+EVENT_LOG_SIZE = int(os.environ.get('EVENT_LOG_SIZE', 5000))
+
+
+class EventLog:
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=size)   # (seq, event, data)
+        self.seq = 0
+
+    def publish(self, socketio, event, data):
+        """Number `data`, keep it for resync and emit it to every client."""
+        with self._lock:
+            self.seq += 1
+            data = dict(data, seq=self.seq)
+            self._events.append((self.seq, event, data))
+        if outboxes.active:
+            outboxes.broadcast(event, data)
+        elif socketio is not None:
+            socketio.emit(event, data, namespace='/')
+        return data
+
+    def since(self, seq):
+        """(current seq, [{"event", "data"}]) after `seq`, or (current seq, None) if not covered."""
+        with self._lock:
+            current = self.seq
+            if seq == current:
+                return current, []
+            # seq > current: the server restarted since the client's last event
+            if seq > current or not self._events or self._events[0][0] > seq + 1:
+                return current, None
+            return current, [{"event": e, "data": d} for s, e, d in self._events if s > seq]
+
+
+event_log = EventLog()
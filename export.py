@@ -0,0 +1,69 @@
+# export.py
+"""Chunked CSV / NDJSON encoders for the streaming export endpoints."""
+import csv
+import io
+from datetime import datetime
+
+import serialization
+
+# Rows encoded per chunk sent to the client
+EXPORT_CHUNK_ROWS = 1000
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _parse_local(text):
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        # Stored timestamps are naive local time: an offset ('Z', '+02:00') is converted to it
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def parse_range(start, end):
+    """Parse ISO 8601 start/end query parameters (defaults: everything up to now)."""
+    start = _parse_local(start) if start else datetime.min
+    end = _parse_local(end) if end else datetime.now()
+    return start, end
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def to_csv(rows):
+    """rows: iterator yielding the header, then tuples. Yields CSV text chunks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(rows))
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_value(v) for v in row])
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(rows):
+    """rows: iterator yielding the header, then tuples. Yields NDJSON byte chunks."""
+    header = next(rows)
+    chunk = []
+    for row in rows:
+        chunk.append(serialization.dumps(dict(zip(header, row))))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = []
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def encode(rows, fmt):
+    return to_ndjson(rows) if fmt == 'ndjson' else to_csv(rows)
@@ -0,0 +1,143 @@
+# governor.py
+"""
+Admission layer for heavy read (analysis) queries.
+
+- at most ANALYSIS_MAX_CONCURRENT queries run at once (separate from the
+  ingest write path); beyond that a query is rejected at once rather than
+  waiting (a blocked wait would stall the eventlet hub)
+- each query runs with a statement timeout (see database.get_read_connection)
+- results are cached per key: fresh for ANALYSIS_FRESH_SECONDS, then served
+  as stale (stale-while-revalidate) while one background refresh runs, or
+  when the query is rejected / times out; the ANALYSIS_CACHE_MAX most
+  recently used keys are kept (keys include project names from the URL)
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ANALYSIS_MAX_CONCURRENT = int(os.environ.get('ANALYSIS_MAX_CONCURRENT', 2))
+ANALYSIS_FRESH_SECONDS = float(os.environ.get('ANALYSIS_FRESH_SECONDS', 15))
+ANALYSIS_STALE_MAX_SECONDS = float(os.environ.get('ANALYSIS_STALE_MAX_SECONDS', 3600))
+ANALYSIS_CACHE_MAX = int(os.environ.get('ANALYSIS_CACHE_MAX', 256))
+
+# MariaDB ER_STATEMENT_TIMEOUT, MySQL ER_QUERY_TIMEOUT
+STATEMENT_TIMEOUT_ERRNOS = (1969, 3024)
+
+
+class QueryUnavailable(Exception):
+    """No result could be computed and no cached result is available."""
+
+
+class QueryGovernor:
+    def __init__(self, max_concurrent=ANALYSIS_MAX_CONCURRENT, fresh_seconds=ANALYSIS_FRESH_SECONDS,
+                 stale_max_seconds=ANALYSIS_STALE_MAX_SECONDS, cache_max=ANALYSIS_CACHE_MAX):
+        self.fresh_seconds = fresh_seconds
+        self.stale_max_seconds = stale_max_seconds
+        self.cache_max = cache_max
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # key -> (monotonic time, result), least recently used first
+        self._refreshing = set()
+        self.counters = {
+            "executed": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "errors": 0,
+            "served_fresh": 0,
+            "served_stale": 0,
+            "background_refreshes": 0,
+            "evicted": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _execute(self, key, fn, args, cache=True):
+        """Run fn under the concurrency limit; returns the result or raises."""
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise QueryUnavailable(f"Trop de requêtes d'analyse en cours ({key})")
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._count("timed_out" if getattr(e, 'errno', None) in STATEMENT_TIMEOUT_ERRNOS else "errors")
+            raise
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.counters["executed"] += 1
+            if cache:
+                self._store(key, result)
+        return result
+
+    def _store(self, key, result):
+        # Called with self._lock held
+        now = time.monotonic()
+        self._cache[key] = (now, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_max:
+            self._cache.popitem(last=False)
+            self.counters["evicted"] += 1
+        # Entries too old to be served even as stale are useless
+        for old_key in [k for k, (t, _) in self._cache.items() if now - t >= self.stale_max_seconds]:
+            del self._cache[old_key]
+            self.counters["evicted"] += 1
+
+    def execute(self, key, fn, *args):
+        """Run fn(*args) under the concurrency limit, without caching (paginated reads)."""
+        try:
+            return self._execute(key, fn, args, cache=False)
+        except QueryUnavailable:
+            raise
+        except Exception as e:
+            raise QueryUnavailable(str(e)) from e
+
+    def _refresh(self, key, fn, args):
+        try:
+            self._execute(key, fn, args)
+        except Exception as e:
+            logging.warning("Rafraîchissement en arrière-plan échoué (%s): %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def run(self, key, fn, *args):
+        """Return (result, stale) for fn(*args), cached under `key`."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            age = now - cached[0]
+            if age < self.fresh_seconds:
+                self._count("served_fresh")
+                return cached[1], False
+            if age < self.stale_max_seconds:
+                # Serve the last good result immediately, refresh once in the background
+                with self._lock:
+                    start_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if start_refresh:
+                    self._count("background_refreshes")
+                    threading.Thread(target=self._refresh, args=(key, fn, args), daemon=True).start()
+                self._count("served_stale")
+                return cached[1], True
+
+        try:
+            return self._execute(key, fn, args), False
+        except Exception as e:
+            if cached is not None:
+                self._count("served_stale")
+                return cached[1], True
+            raise QueryUnavailable(str(e)) from e
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, cached_keys=len(self._cache), refreshing=len(self._refreshing))
+
+
+governor = QueryGovernor()
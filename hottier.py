@@ -0,0 +1,193 @@
+# hottier.py
+"""
+In-process hot tier of recent measurements.
+
+Each (module, variable) series keeps its recent points in compact arrays:
+timestamps and numeric values as array('d'), a per-point kind as array('b'),
+and a side dict for the (rare) values that are not plain numbers. It is fed
+by database.save_measurement, warmed from the DB at startup, and lets
+database.get_history answer from memory when the requested rows are covered.
+"""
+import math
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+HOT_TIER_HOURS = float(os.environ.get('HOT_TIER_HOURS', 6))
+HOT_TIER_MIN_POINTS = int(os.environ.get('HOT_TIER_MIN_POINTS', 100))   # kept regardless of age
+HOT_TIER_MAX_BYTES = int(os.environ.get('HOT_TIER_MAX_BYTES', 64 * 1024 * 1024))
+
+KIND_FLOAT = 0
+KIND_INT = 1
+KIND_TEXT = 2
+
+# Trim old points at most once every this many appends per series
+_TRIM_EVERY = 64
+
+
+def _classify(value):
+    """(kind, number) such that the original string can be rebuilt exactly."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return KIND_TEXT, math.nan
+    if math.isfinite(number):
+        if repr(number) == value:
+            return KIND_FLOAT, number
+        if number.is_integer() and str(int(number)) == value:
+            return KIND_INT, number
+    return KIND_TEXT, math.nan
+
+
+class Series:
+    __slots__ = ('timestamps', 'values', 'kinds', 'texts', 'offset', 'complete', 'appends')
+
+    def __init__(self, complete=True):
+        self.timestamps = array('d')
+        self.values = array('d')
+        self.kinds = array('b')
+        self.texts = {}      # absolute point index -> original string
+        self.offset = 0      # absolute index of timestamps[0]
+        # True when every row of the series in the DB is also in memory
+        self.complete = complete
+        self.appends = 0
+
+    def append(self, value, ts):
+        kind, number = _classify(value)
+        if kind == KIND_TEXT:
+            self.texts[self.offset + len(self.timestamps)] = value
+        self.timestamps.append(ts)
+        self.values.append(number)
+        self.kinds.append(kind)
+
+    def trim(self, horizon):
+        """Drop points older than horizon, keeping at least HOT_TIER_MIN_POINTS."""
+        n = len(self.timestamps)
+        drop = 0
+        while drop < n - HOT_TIER_MIN_POINTS and self.timestamps[drop] < horizon:
+            drop += 1
+        if drop:
+            del self.timestamps[:drop]
+            del self.values[:drop]
+            del self.kinds[:drop]
+            self.offset += drop
+            self.texts = {i: t for i, t in self.texts.items() if i >= self.offset}
+            self.complete = False
+
+    def value_at(self, i):
+        kind = self.kinds[i]
+        if kind == KIND_FLOAT:
+            return repr(self.values[i])
+        if kind == KIND_INT:
+            return str(int(self.values[i]))
+        return self.texts[self.offset + i]
+
+    def tail(self, limit):
+        """Last `limit` points as [(value, datetime)], oldest first (like get_history)."""
+        n = len(self.timestamps)
+        return [(self.value_at(i), datetime.fromtimestamp(self.timestamps[i]))
+                for i in range(max(0, n - limit), n)]
+
+    def memory_usage(self):
+        arrays = sum(a.itemsize * len(a) for a in (self.timestamps, self.values, self.kinds))
+        return arrays + sum(len(t) + 64 for t in self.texts.values())
+
+
+class HotTier:
+    def __init__(self, hours=HOT_TIER_HOURS, max_bytes=HOT_TIER_MAX_BYTES):
+        self.hours = hours
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._series = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def append(self, module, variable, value, ts):
+        """Record a measurement that was just saved to the DB (ts: datetime)."""
+        key = (module, variable)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Unknown series: it may still have older rows in the DB
+                series = self._series[key] = Series(complete=False)
+            elif series.timestamps and ts.timestamp() < series.timestamps[-1]:
+                # Out-of-order point (e.g. replayed capture): let the DB serve this series
+                del self._series[key]
+                return
+            else:
+                self._series.move_to_end(key)
+            series.append(value, ts.timestamp())
+            series.appends += 1
+            if series.appends % _TRIM_EVERY == 0:
+                series.trim(time.time() - self.hours * 3600)
+                self._enforce_budget()
+
+    def load(self, rows, min_points=HOT_TIER_MIN_POINTS):
+        """Warm up from DB rows (module, variable, value, timestamp) ordered by timestamp.
+
+        Series that came with fewer than min_points rows are complete: the DB
+        holds nothing older for them.
+        """
+        with self._lock:
+            warmed = {}
+            for module, variable, value, ts in rows:
+                key = (module, variable)
+                series = warmed.get(key)
+                if series is None:
+                    series = warmed[key] = Series()
+                series.append(value, ts.timestamp())
+            for key, series in warmed.items():
+                series.complete = len(series.timestamps) < min_points
+                self._series[key] = series
+            self._enforce_budget()
+
+    def history(self, module, variable, limit):
+        """get_history() rows from memory, or None if the range is not covered."""
+        with self._lock:
+            series = self._series.get((module, variable))
+            if series is not None and (series.complete or len(series.timestamps) >= limit):
+                self.hits += 1
+                return series.tail(limit)
+            self.misses += 1
+            return None
+
+    def discard(self, module, variable=None):
+        """Forget a series (or every series of a module) after an admin deletion."""
+        with self._lock:
+            for key in [k for k in self._series if k[0] == module and (variable is None or k[1] == variable)]:
+                del self._series[key]
+
+    def _enforce_budget(self):
+        total = sum(s.memory_usage() for s in self._series.values())
+        while total > self.max_bytes and self._series:
+            _, evicted = self._series.popitem(last=False)
+            total -= evicted.memory_usage()
+            self.evictions += 1
+
+    def stats(self):
+        """Memory accounting per series and hit/miss counters."""
+        with self._lock:
+            series = {
+                f"{m}:{v}": {
+                    "points": len(s.timestamps),
+                    "text_points": len(s.texts),
+                    "bytes": s.memory_usage(),
+                    "complete": s.complete,
+                }
+                for (m, v), s in self._series.items()
+            }
+            return {
+                "series": series,
+                "total_bytes": sum(s["bytes"] for s in series.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+hot_tier = HotTier()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Headless MQTT ingest worker for horizontally scaled ingest.
+
+Joins the $share/<MQTT_SHARE_GROUP>/bzh/mecatro/# shared subscription, so the
+broker spreads messages across all running workers, and persists them to the
+DB. Run N of them with MQTT_INGEST_WORKERS=N, and the web app with
+MQTT_ROLE=live so it keeps the live dashboard without writing a second copy:
+
+    MQTT_INGEST_WORKERS=4 python ingest_worker.py      # x4
+    MQTT_ROLE=live python app.py
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+os.environ.setdefault('MQTT_ROLE', 'ingest')
+
+import database  # noqa: E402
+import logconfig  # noqa: E402
+import mqtt_client  # noqa: E402
+
+
+def main():
+    start = time.perf_counter()
+    try:
+        database.init_db()
+    except Exception as e:
+        # Writes go to the spool until the DB is back (see spool.py)
+        logging.error(f"Erreur migration du schéma: {e}")
+    client = mqtt_client.init_mqtt(None)
+    logging.info("Démarrage terminé (rôle %s) en %d ms", mqtt_client.MQTT_ROLE,
+                 (time.perf_counter() - start) * 1000)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+
+    client.loop_stop()
+    client.disconnect()
+    logconfig.stop_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# liveseries.py
+"""
+Bounded registry of the live dashboard series (latest value per module/variable).
+
+Replaces the dashboard_data / last_save_time / last_value_cache /
+module_message_count dicts of mqtt_client, which grew with every topic ever
+seen. One __slots__ record per series, with interned module/variable names,
+holds the latest value and the DB save rate-limit state. Series idle for
+LIVE_SERIES_IDLE_SECONDS, or beyond LIVE_SERIES_MAX (least recently updated
+first), are evicted; callers emit 'delete_data' for the returned keys so
+clients drop them too.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+LIVE_SERIES_MAX = int(os.environ.get('LIVE_SERIES_MAX', 5000))
+LIVE_SERIES_IDLE_SECONDS = float(os.environ.get('LIVE_SERIES_IDLE_SECONDS', 7 * 24 * 3600))
+
+
+class SeriesRecord:
+    __slots__ = ('module', 'variable', 'value', 'updated', 'last_seen', 'last_save', 'saved_value')
+
+    def __init__(self, module, variable):
+        self.module = module
+        self.variable = variable
+        self.value = None
+        self.updated = None      # ISO timestamp shown on the dashboard ('derniere_maj')
+        self.last_seen = 0.0     # unix receive time of the latest message
+        self.last_save = 0.0     # unix receive time of the latest DB save
+        self.saved_value = None  # value of the latest DB save (duplicate detection)
+
+
+class LiveSeriesRegistry:
+    def __init__(self, max_series=LIVE_SERIES_MAX, idle_seconds=LIVE_SERIES_IDLE_SECONDS):
+        self.max_series = max_series
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._series = OrderedDict()   # (module, variable) -> SeriesRecord, least recently updated first
+        self._modules = {}             # module -> {variable: SeriesRecord}
+        self._published = {}           # module -> messages received
+        self.evictions = 0
+
+    def update(self, module, variable, value, updated, received):
+        """Store the latest value; returns the (module, variable) keys evicted to stay under the cap."""
+        with self._lock:
+            key = (module, variable)
+            record = self._series.get(key)
+            if record is None:
+                module, variable = sys.intern(module), sys.intern(variable)
+                key = (module, variable)
+                record = self._series[key] = SeriesRecord(module, variable)
+                self._modules.setdefault(module, {})[variable] = record
+            else:
+                self._series.move_to_end(key)
+            record.value = value
+            record.updated = updated
+            record.last_seen = received
+            self._published[record.module] = self._published.get(record.module, 0) + 1
+
+            evicted = []
+            while len(self._series) > self.max_series:
+                evicted.append(self._pop_oldest())
+            return evicted
+
+    def should_save(self, module, variable, value, received, rate_limit_seconds):
+        """DB save rate limit: True (and recorded) if the interval elapsed or the value changed."""
+        with self._lock:
+            record = self._series.get((module, variable))
+            if record is None:
+                return True
+            if received - record.last_save >= rate_limit_seconds or record.saved_value != value:
+                record.last_save = received
+                record.saved_value = value
+                return True
+            return False
+
+    def remove(self, module, variable):
+        """Forget a series (empty payload); True if it existed."""
+        with self._lock:
+            record = self._series.pop((module, variable), None)
+            if record is None:
+                return False
+            self._drop_from_module(record)
+            return True
+
+    def _drop_from_module(self, record):
+        variables = self._modules.get(record.module)
+        if variables is not None:
+            variables.pop(record.variable, None)
+            if not variables:
+                del self._modules[record.module]
+                self._published.pop(record.module, None)
+
+    def _pop_oldest(self):
+        key, record = self._series.popitem(last=False)
+        self._drop_from_module(record)
+        self.evictions += 1
+        return key
+
+    def evict_idle(self, now):
+        """Evict series without a message for idle_seconds; returns their keys."""
+        horizon = now - self.idle_seconds
+        evicted = []
+        with self._lock:
+            # Ordered by last update, so idle series are at the front
+            while self._series and next(iter(self._series.values())).last_seen < horizon:
+                evicted.append(self._pop_oldest())
+        return evicted
+
+    @staticmethod
+    def _as_dict(variables):
+        return {v: {"valeur": r.value, "derniere_maj": r.updated} for v, r in variables.items()}
+
+    def snapshot(self):
+        """{module: {variable: {"valeur", "derniere_maj"}}}, the former dashboard_data layout."""
+        with self._lock:
+            return {m: self._as_dict(variables) for m, variables in self._modules.items()}
+
+    def module(self, module):
+        with self._lock:
+            variables = self._modules.get(module)
+            return self._as_dict(variables) if variables is not None else None
+
+    def save_status(self, rate_limit_seconds, now):
+        """Per series DB save rate-limit state (for /api/stats/rate-limit)."""
+        with self._lock:
+            return [
+                {
+                    "module": r.module,
+                    "variable": r.variable,
+                    "last_save": datetime.fromtimestamp(r.last_save).isoformat(),
+                    "seconds_since": round(now - r.last_save, 1),
+                    "is_limited": now - r.last_save < rate_limit_seconds,
+                }
+                for r in self._series.values() if r.last_save
+            ]
+
+    def memory_usage(self):
+        """Approximate bytes held by the records, their strings and the indexes."""
+        with self._lock:
+            total = sys.getsizeof(self._series) + sys.getsizeof(self._modules) + sys.getsizeof(self._published)
+            for (module, variable), r in self._series.items():
+                total += sys.getsizeof(r) + sys.getsizeof(r.value) + sys.getsizeof(r.updated)
+            for module, variables in self._modules.items():
+                total += sys.getsizeof(variables) + sys.getsizeof(module)
+                total += sum(sys.getsizeof(v) for v in variables)
+            return total
+
+    def stats(self):
+        usage = self.memory_usage()
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "modules": len(self._modules),
+                "max_series": self.max_series,
+                "idle_seconds": self.idle_seconds,
+                "evictions": self.evictions,
+                "bytes": usage,
+                "published": dict(self._published),
+            }
+
+
+live_series = LiveSeriesRegistry()
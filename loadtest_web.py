@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Web-tier load test: N simulated dashboard browsers against one app instance.
+
+Each simulated browser loads the page, opens a Socket.IO connection and
+replays the dashboard's request mix:
+    /api/stats/rate-limit every 5 s
+    /api/stats/messages, /api/stats/publications every 60 s
+    /api/mqtt/global, /api/mqtt/projects every 30 s
+(--legacy-polling adds the former /api/dashboard/data and /messages polls
+every 2 s). A synthetic MQTT feed publishes timestamped values so the
+Socket.IO delivery lag of 'update_data' can be measured.
+
+For each step of --browsers it reports request latency percentiles per
+endpoint, delivery lag, and the server's CPU and RSS (--start-app or
+--server-pid, read from /proc), and exits with status 1 if a budget is
+exceeded.
+
+    python loadtest_web.py --start-app --broker localhost --browsers 10 50 100 200
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import paho.mqtt.client as mqtt  # type: ignore
+import socketio  # type: ignore
+
+SCHEDULE = [
+    ('/api/stats/rate-limit', 5),
+    ('/api/stats/messages', 60),
+    ('/api/stats/publications', 60),
+    ('/api/mqtt/global', 30),
+    ('/api/mqtt/projects', 30),
+]
+LEGACY_POLLING = [
+    ('/api/dashboard/data', 2),
+    ('/api/dashboard/messages', 2),
+]
+FEED_MODULE = 'loadtest'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)   # path -> [ms]
+        self.errors = defaultdict(int)
+        self.lags = []                       # ms
+        self.socket_errors = 0
+
+    def request(self, path, ms, ok):
+        with self._lock:
+            self.latencies[path].append(ms)
+            if not ok:
+                self.errors[path] += 1
+
+    def lag(self, ms):
+        with self._lock:
+            self.lags.append(ms)
+
+
+class Browser(threading.Thread):
+    def __init__(self, url, recorder, stop, schedule, series):
+        super().__init__(daemon=True)
+        self.url = url
+        self.recorder = recorder
+        self.stop = stop
+        self.schedule = schedule
+        self.series = series
+
+    def fetch(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data,
+                                     headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        start = time.perf_counter()
+        ok = True
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp.read()
+        except (urllib.error.URLError, OSError):
+            ok = False
+        self.recorder.request(path.split('?')[0], (time.perf_counter() - start) * 1000, ok)
+
+    def run(self):
+        sio = socketio.Client(reconnection=True)
+
+        @sio.on('update_data')
+        def on_update(data):
+            if data.get('module', '').startswith(FEED_MODULE):
+                try:
+                    self.recorder.lag((time.time() - float(data['value'])) * 1000)
+                except (KeyError, ValueError):
+                    pass
+
+        try:
+            sio.connect(self.url, transports=['websocket'])
+        except Exception:
+            self.recorder.socket_errors += 1
+
+        # Page load: HTML, then the batched sparklines
+        self.fetch('/')
+        self.fetch('/api/history/batch', {"series": self.series, "limit": 20})
+
+        # Browsers are opened at different times: random phase per periodic request
+        now = time.monotonic()
+        due = [now + random.uniform(0, period) for _, period in self.schedule]
+        while not self.stop.is_set():
+            i = min(range(len(due)), key=due.__getitem__)
+            if self.stop.wait(max(0.0, due[i] - time.monotonic())):
+                break
+            path, period = self.schedule[i]
+            self.fetch(path)
+            due[i] += period
+
+        try:
+            sio.disconnect()
+        except Exception:
+            pass
+
+
+class ProcessSampler:
+    """CPU % and RSS of the server process and its children (debug reloader) from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.hz = os.sysconf('SC_CLK_TCK')
+
+    @staticmethod
+    def _stat(pid):
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()
+
+    def pids(self):
+        pids = [self.pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    if int(self._stat(entry)[1]) == self.pid:   # ppid
+                        pids.append(int(entry))
+                except (OSError, IndexError):
+                    pass
+        return pids
+
+    def cpu_ticks(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                fields = self._stat(pid)
+                total += int(fields[11]) + int(fields[12])   # utime + stime
+            except OSError:
+                pass
+        return total
+
+    def rss_mb(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1])
+            except OSError:
+                pass
+        return total / 1024
+
+
+def feed(broker, port, rate, projects, variables, stop):
+    """Publish timestamped values on bzh/mecatro/dashboard/loadtest<p>/v<k>."""
+    client = mqtt.Client()
+    client.connect(broker, port, 60)
+    client.loop_start()
+    i = 0
+    start = time.monotonic()
+    while not stop.is_set():
+        topic = f"bzh/mecatro/dashboard/{FEED_MODULE}{i % projects}/v{(i // projects) % variables}"
+        client.publish(topic, f"{time.time():.6f}")
+        i += 1
+        stop.wait(max(0.0, start + i / rate - time.monotonic()))
+    client.loop_stop()
+    client.disconnect()
+
+
+def run_step(args, n, sampler):
+    recorder = Recorder()
+    stop = threading.Event()
+    schedule = SCHEDULE + (LEGACY_POLLING if args.legacy_polling else [])
+    series = [{"module": f"{FEED_MODULE}{p}", "variable": f"v{k}"}
+              for p in range(args.feed_projects) for k in range(args.feed_variables)]
+
+    feeder = threading.Thread(target=feed, args=(args.broker, args.port, args.feed_rate,
+                                                  args.feed_projects, args.feed_variables, stop), daemon=True)
+    feeder.start()
+    browsers = [Browser(args.url, recorder, stop, schedule, series) for _ in range(n)]
+    for b in browsers:
+        b.start()
+        time.sleep(args.ramp / max(1, n))
+
+    ticks0, t0 = (sampler.cpu_ticks(), time.monotonic()) if sampler else (None, None)
+    time.sleep(args.duration)
+    cpu = rss = float('nan')
+    if sampler:
+        cpu = (sampler.cpu_ticks() - ticks0) / sampler.hz / (time.monotonic() - t0) * 100
+        rss = sampler.rss_mb()
+    stop.set()
+    for b in browsers:
+        b.join(timeout=10)
+    feeder.join(timeout=5)
+    return recorder, cpu, rss
+
+
+def report(n, recorder, cpu, rss, args):
+    """Print one step and return the list of exceeded budgets."""
+    print(f"\n=== {n} navigateurs  CPU {cpu:.0f}%  RSS {rss:.0f} Mo ===")
+    all_ms, total, errors = [], 0, 0
+    for path in sorted(recorder.latencies):
+        ms = recorder.latencies[path]
+        all_ms.extend(ms)
+        total += len(ms)
+        errors += recorder.errors[path]
+        print(f"  {path:<28} n={len(ms):<6} p50 {percentile(ms, 50):7.1f}  p95 {percentile(ms, 95):7.1f}  "
+              f"p99 {percentile(ms, 99):7.1f} ms  erreurs {recorder.errors[path]}")
+    lags = recorder.lags
+    print(f"  {'Socket.IO update_data':<28} n={len(lags):<6} p50 {percentile(lags, 50):7.1f}  "
+          f"p95 {percentile(lags, 95):7.1f}  p99 {percentile(lags, 99):7.1f} ms  "
+          f"connexions échouées {recorder.socket_errors}")
+
+    exceeded = []
+    p95 = percentile(all_ms, 95)
+    if p95 > args.budget_p95_ms:
+        exceeded.append(f"p95 requêtes {p95:.0f} ms > {args.budget_p95_ms:.0f} ms")
+    error_rate = errors / total if total else 0.0
+    if error_rate > args.budget_error_rate:
+        exceeded.append(f"taux d'erreur {error_rate:.1%} > {args.budget_error_rate:.1%}")
+    lag95 = percentile(lags, 95)
+    if not lags or lag95 > args.budget_lag_p95_ms:
+        exceeded.append(f"p95 délai Socket.IO {lag95:.0f} ms > {args.budget_lag_p95_ms:.0f} ms")
+    if not math.isnan(cpu) and cpu > args.budget_cpu:
+        exceeded.append(f"CPU {cpu:.0f}% > {args.budget_cpu:.0f}%")
+    if args.budget_rss_mb and not math.isnan(rss) and rss > args.budget_rss_mb:
+        exceeded.append(f"RSS {rss:.0f} Mo > {args.budget_rss_mb:.0f} Mo")
+    for e in exceeded:
+        print(f"  ❌ {e}")
+    return exceeded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--browsers', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--duration', type=float, default=60, help="measured seconds per step")
+    parser.add_argument('--ramp', type=float, default=10, help="seconds to open all browsers of a step")
+    parser.add_argument('--legacy-polling', action='store_true', help="add the former 2 s dashboard polls")
+    parser.add_argument('--broker', default='global_mqtt')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--feed-rate', type=float, default=20, help="synthetic MQTT messages per second")
+    parser.add_argument('--feed-projects', type=int, default=4)
+    parser.add_argument('--feed-variables', type=int, default=5)
+    parser.add_argument('--start-app', action='store_true', help="start app.py locally for the run")
+    parser.add_argument('--server-pid', type=int, help="pid of an already running app, for CPU/RSS")
+    parser.add_argument('--budget-p95-ms', type=float, default=500)
+    parser.add_argument('--budget-lag-p95-ms', type=float, default=1000)
+    parser.add_argument('--budget-error-rate', type=float, default=0.01)
+    parser.add_argument('--budget-cpu', type=float, default=90)
+    parser.add_argument('--budget-rss-mb', type=float, default=0, help="0 = no RSS budget")
+    args = parser.parse_args()
+
+    app = None
+    pid = args.server_pid
+    if args.start_app:
+        env = dict(os.environ, MQTT_BROKER=args.broker, MQTT_PORT=str(args.port))
+        app = subprocess.Popen([sys.executable, 'app.py'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        pid = app.pid
+        time.sleep(5)
+    sampler = ProcessSampler(pid) if pid and os.path.exists(f'/proc/{pid}') else None
+
+    failed = []
+    try:
+        for n in args.browsers:
+            recorder, cpu, rss = run_step(args, n, sampler)
+            exceeded = report(n, recorder, cpu, rss, args)
+            if exceeded:
+                failed.append((n, exceeded))
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
+
+    if failed:
+        print(f"\nBudgets dépassés à partir de {failed[0][0]} navigateurs")
+        sys.exit(1)
+    print("\nTous les budgets sont respectés")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# logconfig.py
+"""
+Asynchronous logging for the ingest hot path.
+
+Records are put on a bounded queue by a QueueHandler and written to
+dashboard.log / stderr by a QueueListener thread, so formatting, disk I/O
+and rotation no longer run inside on_message. When the queue is full,
+INFO/DEBUG records are dropped (and counted) while WARNING and above wait
+for room, so e.g. non-compliant topic warnings are never lost.
+
+Per-message info logs go through `sampler`: a topic is logged the first
+time it is seen, then one message in LOG_SAMPLE_EVERY.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', 100))   # 1 = log every message
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Topics remembered for "first seen" sampling
+MAX_SEEN_TOPICS = 20000
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops low-severity records instead of blocking when full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """Decides whether a per-message log line is written for a topic."""
+
+    def __init__(self, every=LOG_SAMPLE_EVERY, max_topics=MAX_SEEN_TOPICS):
+        self.every = max(1, every)
+        self.max_topics = max_topics
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._count = 0
+        self.sampled_out = 0
+
+    def sample(self, topic):
+        with self._lock:
+            self._count += 1
+            if topic not in self._seen:
+                self._seen[topic] = None
+                if len(self._seen) > self.max_topics:
+                    self._seen.popitem(last=False)
+                return True
+            if self._count % self.every == 0:
+                return True
+            self.sampled_out += 1
+            return False
+
+
+sampler = LogSampler()
+_handler = None
+_listener = None
+
+
+def setup_logging(filename="dashboard.log", level=logging.INFO):
+    """Route the root logger through the queue (idempotent)."""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(filename, maxBytes=1_000_000, backupCount=5)
+    stream_handler = logging.StreamHandler()
+    for h in (file_handler, stream_handler):
+        h.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = DroppingQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+
+def stop_logging():
+    """Flush the queue and stop the writer thread (end of scripts)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    return {
+        "dropped": _handler.dropped if _handler else 0,
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "queue_size": _handler.queue.maxsize if _handler else LOG_QUEUE_SIZE,
+        "sample_every": sampler.every,
+        "sampled_out": sampler.sampled_out,
+    }
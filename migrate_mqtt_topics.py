@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Migrate mqtt_messages from the wide layout (topic / project / category strings
+on every row) to the dictionary-encoded layout (topic_id -> mqtt_topics).
+
+The conversion is schema migration 2 (see migrations.py) and runs on its own
+when the application starts; this script applies the pending migrations
+ahead of time, e.g. to watch a long conversion:
+    python migrate_mqtt_topics.py [--compress]
+
+--compress also zlib-compresses existing payloads of at least
+PAYLOAD_COMPRESS_MIN_SIZE bytes.
+"""
+import logging
+import sys
+
+import database
+import migrations
+
+BATCH_SIZE = 10000
+
+
+def migrate(compress=False):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    applied = migrations.migrate()
+    if applied:
+        print(f"Migrations appliquées : {', '.join(map(str, applied))}")
+    else:
+        print(f"Schéma déjà à jour (version {migrations.LATEST_VERSION}).")
+
+    if compress and database.PAYLOAD_COMPRESS_MIN_SIZE:
+        conn = database.get_db_connection()
+        compress_payloads(conn)
+        conn.close()
+    print("Migration terminée.")
+
+
+def compress_payloads(conn):
+    """Compress existing large payloads in batches."""
+    c = conn.cursor()
+    compressed = 0
+    last_id = 0
+    while True:
+        c.execute("""SELECT id, payload FROM mqtt_messages
+                     WHERE id > %s AND payload_encoding = %s AND LENGTH(payload) >= %s
+                     ORDER BY id LIMIT %s""",
+                  (last_id, database.PAYLOAD_RAW, database.PAYLOAD_COMPRESS_MIN_SIZE, BATCH_SIZE))
+        rows = c.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, payload in rows:
+            data, encoding = database.encode_payload(bytes(payload).decode('utf-8', errors='replace'))
+            if encoding != database.PAYLOAD_RAW:
+                updates.append((data, encoding, row_id))
+        if updates:
+            c.executemany("UPDATE mqtt_messages SET payload = %s, payload_encoding = %s WHERE id = %s", updates)
+            conn.commit()
+            compressed += len(updates)
+        last_id = rows[-1][0]
+    print(f"{compressed} payloads compressés.")
+
+
+if __name__ == "__main__":
+    migrate(compress='--compress' in sys.argv)
@@ -0,0 +1,224 @@
+# migrations.py
+"""
+Versioned schema migrations.
+
+The schema_version table records the migrations already applied. At
+startup migrate() reads the current version with one query and, only if
+it is behind MIGRATIONS, applies the missing steps in order under a
+MariaDB named lock, so several processes (web app, ingest workers) can
+start at the same time.
+
+Each step is written to be safe on a database created before versioning
+existed (CREATE TABLE IF NOT EXISTS, index and column checks): the first
+run on such a database simply records every version.
+
+To change the schema, append a (version, description, function) entry;
+never edit a step that has already shipped.
+"""
+import logging
+import time
+
+import database
+
+SCHEMA_LOCK = 'ferme_dashboard_schema'
+SCHEMA_LOCK_TIMEOUT = 60
+# mqtt_messages rows converted per transaction by the dictionary-layout migration
+CONVERT_BATCH_SIZE = 10000
+
+
+def _column_exists(c, table, column):
+    c.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column,))
+    return bool(c.fetchall())
+
+
+def _index_exists(c, table, index):
+    c.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index,))
+    return bool(c.fetchall())
+
+
+def _table_exists(c, table):
+    c.execute("SHOW TABLES LIKE %s", (table,))
+    return bool(c.fetchall())
+
+
+def _base_tables(conn, c):
+    # Table for sensor measurements
+    c.execute('''CREATE TABLE IF NOT EXISTS measurements
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  module VARCHAR(255),
+                  variable VARCHAR(255),
+                  value TEXT,
+                  timestamp DATETIME)''')
+
+    # Table for message statistics (e.g., count per minute)
+    c.execute('''CREATE TABLE IF NOT EXISTS message_stats
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  timestamp DATETIME)''')
+
+    # Table for module publication tracking (hourly)
+    c.execute('''CREATE TABLE IF NOT EXISTS module_publications
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  module VARCHAR(255),
+                  timestamp DATETIME)''')
+
+
+def _mqtt_messages_dictionary(conn, c):
+    """mqtt_topics dictionary, and mqtt_messages rows referencing it (topic_id)."""
+    # Topic dictionary: each distinct topic (with its project/category) is stored once
+    c.execute('''CREATE TABLE IF NOT EXISTS mqtt_topics
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  topic VARCHAR(512) NOT NULL,
+                  project VARCHAR(255),
+                  category VARCHAR(50),
+                  UNIQUE KEY uk_topic (topic),
+                  INDEX idx_project (project))''')
+
+    if _table_exists(c, 'mqtt_messages') and _column_exists(c, 'mqtt_messages', 'topic'):
+        _convert_wide_mqtt_messages(conn, c)
+        return
+
+    # Detailed MQTT message analysis (last 1M messages, see cleanup_old_mqtt_messages).
+    # Large payloads may be zlib-compressed (payload_encoding).
+    c.execute('''CREATE TABLE IF NOT EXISTS mqtt_messages
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  topic_id INT NOT NULL,
+                  payload BLOB,
+                  payload_encoding TINYINT NOT NULL DEFAULT 0,
+                  timestamp DATETIME,
+                  is_compliant BOOLEAN,
+                  INDEX idx_timestamp (timestamp),
+                  INDEX idx_topic_timestamp (topic_id, timestamp))''')
+
+
+def _convert_wide_mqtt_messages(conn, c):
+    """Former layout (topic / project / category strings on every row) -> topic_id."""
+    logging.info("Conversion de mqtt_messages au format dictionnaire (mqtt_topics)...")
+    c.execute("""INSERT IGNORE INTO mqtt_topics (topic, project, category)
+                 SELECT topic, MAX(project), MAX(category)
+                 FROM mqtt_messages
+                 WHERE topic IS NOT NULL
+                 GROUP BY topic""")
+    conn.commit()
+
+    if not _column_exists(c, 'mqtt_messages', 'topic_id'):
+        c.execute("""ALTER TABLE mqtt_messages
+                     ADD COLUMN topic_id INT NULL AFTER id,
+                     ADD COLUMN payload_encoding TINYINT NOT NULL DEFAULT 0 AFTER payload,
+                     MODIFY payload BLOB""")
+
+    # Fill topic_id in id-range batches to keep transactions short
+    c.execute("SELECT MIN(id), MAX(id) FROM mqtt_messages")
+    min_id, max_id = c.fetchone()
+    if min_id is not None:
+        start = time.time()
+        for low in range(min_id, max_id + 1, CONVERT_BATCH_SIZE):
+            c.execute("""UPDATE mqtt_messages m
+                         JOIN mqtt_topics t ON t.topic = m.topic
+                         SET m.topic_id = t.id
+                         WHERE m.id BETWEEN %s AND %s AND m.topic_id IS NULL""",
+                      (low, low + CONVERT_BATCH_SIZE - 1))
+            conn.commit()
+        logging.info("topic_id renseigné en %.1fs", time.time() - start)
+
+    # Rows without topic cannot be referenced: drop them
+    c.execute("DELETE FROM mqtt_messages WHERE topic_id IS NULL")
+    conn.commit()
+
+    drop_index = "DROP INDEX idx_project," if _index_exists(c, 'mqtt_messages', 'idx_project') else ""
+    c.execute(f"""ALTER TABLE mqtt_messages
+                  {drop_index}
+                  DROP COLUMN topic,
+                  DROP COLUMN project,
+                  DROP COLUMN category,
+                  MODIFY topic_id INT NOT NULL,
+                  ADD INDEX idx_topic_timestamp (topic_id, timestamp)""")
+
+
+def _topic_compliant_index(conn, c):
+    # Keyset browsing of non-compliant messages per topic (InnoDB appends id implicitly),
+    # covering index of the project details aggregates
+    if not _index_exists(c, 'mqtt_messages', 'idx_topic_compliant_timestamp'):
+        c.execute("ALTER TABLE mqtt_messages ADD INDEX idx_topic_compliant_timestamp (topic_id, is_compliant, timestamp)")
+
+
+def _ingest_state_tables(conn, c):
+    # Persisted streaming sketches (HyperLogLog / top-K) per project, see sketches.py
+    c.execute('''CREATE TABLE IF NOT EXISTS mqtt_sketches
+                 (scope VARCHAR(255) PRIMARY KEY,
+                  state MEDIUMTEXT,
+                  updated_at DATETIME)''')
+
+    # Checkpoints of the in-memory per-minute/per-hour ring buffers, see timeseries.py
+    c.execute('''CREATE TABLE IF NOT EXISTS mqtt_timeseries
+                 (scope VARCHAR(255) PRIMARY KEY,
+                  state MEDIUMTEXT,
+                  updated_at DATETIME)''')
+
+
+def _alert_rules(conn, c):
+    # Ingest-time alert rules (MQTT topic filter + condition), see rules.py
+    c.execute('''CREATE TABLE IF NOT EXISTS alert_rules
+                 (id INT AUTO_INCREMENT PRIMARY KEY,
+                  name VARCHAR(255),
+                  topic_filter VARCHAR(512) NOT NULL,
+                  operator VARCHAR(20) NOT NULL,
+                  threshold VARCHAR(255),
+                  cooldown_seconds INT NOT NULL DEFAULT 60,
+                  enabled BOOLEAN NOT NULL DEFAULT 1,
+                  created_at DATETIME)''')
+
+
+MIGRATIONS = [
+    (1, "measurements, message_stats, module_publications", _base_tables),
+    (2, "mqtt_topics dictionary and mqtt_messages.topic_id", _mqtt_messages_dictionary),
+    (3, "mqtt_messages (topic_id, is_compliant, timestamp) index", _topic_compliant_index),
+    (4, "mqtt_sketches and mqtt_timeseries checkpoints", _ingest_state_tables),
+    (5, "alert_rules", _alert_rules),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(c):
+    c.execute("SELECT MAX(version) FROM schema_version")
+    return c.fetchone()[0] or 0
+
+
+def migrate(conn=None):
+    """Apply the pending migrations; returns the versions applied (usually none)."""
+    own = conn is None
+    if own:
+        conn = database.get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                     (version INT PRIMARY KEY,
+                      description VARCHAR(255),
+                      applied_at DATETIME)''')
+        if _current_version(c) >= LATEST_VERSION:
+            return []
+
+        c.execute("SELECT GET_LOCK(%s, %s)", (SCHEMA_LOCK, SCHEMA_LOCK_TIMEOUT))
+        if c.fetchone()[0] != 1:
+            raise RuntimeError("Verrou de migration du schéma non obtenu")
+        try:
+            # Another process may have migrated while we waited for the lock
+            current = _current_version(c)
+            applied = []
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                start = time.perf_counter()
+                step(conn, c)
+                c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, NOW())",
+                          (version, description))
+                conn.commit()
+                applied.append(version)
+                logging.info("Migration %d appliquée (%s) en %.0f ms",
+                             version, description, (time.perf_counter() - start) * 1000)
+            return applied
+        finally:
+            c.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+            c.fetchall()
+    finally:
+        if own:
+            conn.close()
@@ -1,33 +1,82 @@
 import logging
 from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt  # type: ignore
-from collections import deque, defaultdict
+from collections import deque
 import time
+import os
+import threading
 import eventlet
+from eventlet import tpool
+from concurrent.futures import ThreadPoolExecutor
 
-dashboard_data = {}
 last_messages = deque(maxlen=100)  # Stocke les 100 derniers messages
 
-# Rate limiting: track last message time per module/variable
-last_save_time = defaultdict(lambda: datetime.min)
-last_value_cache = {}  # Cache to detect duplicate values
+# Latest values, DB save rate-limit state and publication counts per series
+# live in the bounded liveseries.live_series registry
 RATE_LIMIT_SECONDS = 5  # Minimum 5 seconds between database saves for same variable
 
-# Publication rate monitoring: track message count per module
-module_message_count = defaultdict(int)
-
-from logging.handlers import RotatingFileHandler
 import database
+import sketches
+import timeseries
+import capture
+import logconfig
+from spool import spool, breaker
+from eventlog import event_log
+from liveseries import live_series
+from staleness import stale_detector
+from rules import rule_engine
+from throttle import throttle
+
+# Throttled messages still refresh the live value: the latest value of each
+# throttled series is pushed as one coalesced 'update_data' per flush tick
+THROTTLED_FLUSH_SECONDS = float(os.environ.get('THROTTLED_FLUSH_SECONDS', 1))
+_throttled_updates = {}   # (module, variable) -> latest 'update_data' payload not yet pushed
+_throttled_lock = threading.Lock()
+
+# Streaming sketches and ring-buffer counters are checkpointed at most this often
+INGEST_STATE_PERSIST_SECONDS = 60
+_last_state_persist = time.monotonic()
+# Off for offline replays, whose partial state must not overwrite the live checkpoints
+_checkpoint_state = True
+
+# Network loop mode:
+#  - 'thread'  : paho's own OS thread (loop_start), DB calls inline
+#  - 'eventlet': paho driven cooperatively by a greenlet on the eventlet hub,
+#                DB writes offloaded to a sized thread pool, emits on the hub
+MQTT_LOOP_MODE = os.environ.get('MQTT_LOOP_MODE', 'thread')
+MQTT_DB_POOL_SIZE = int(os.environ.get('MQTT_DB_POOL_SIZE', 4))
+MQTT_DB_MAX_PENDING = int(os.environ.get('MQTT_DB_MAX_PENDING', 10000))
+
+# Process role, for horizontally scaled ingest:
+#  - 'all'   : single process doing everything (default)
+#  - 'ingest': headless worker (ingest_worker.py) in the MQTT_SHARE_GROUP shared
+#              subscription; the broker splits messages across the
+#              MQTT_INGEST_WORKERS workers, which only persist to the DB
+#  - 'live'  : web process next to ingest workers; still sees all traffic (plain
+#              subscription) for the live dashboard and in-memory analysis,
+#              but leaves DB writes to the workers
+MQTT_ROLE = os.environ.get('MQTT_ROLE', 'all')
+MQTT_SHARE_GROUP = os.environ.get('MQTT_SHARE_GROUP', 'ferme-ingest')
+MQTT_INGEST_WORKERS = int(os.environ.get('MQTT_INGEST_WORKERS', 1))
+MQTT_TOPIC = "bzh/mecatro/#"
+MQTT_BROKER = os.environ.get('MQTT_BROKER', 'global_mqtt')
+MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
+PERSIST = MQTT_ROLE in ('all', 'ingest')
+LIVE = MQTT_ROLE in ('all', 'live')
+
+if MQTT_ROLE == 'ingest' and MQTT_INGEST_WORKERS > 1:
+    # Each worker sees ~1/N of every topic: split the per-key budgets so the
+    # aggregate save rate and admission limits match a single process
+    RATE_LIMIT_SECONDS *= MQTT_INGEST_WORKERS
+    throttle.partition(MQTT_INGEST_WORKERS)
+
+_db_executor = None
+_db_pending = 0
+_db_pending_lock = threading.Lock()
+db_dropped = 0  # writes dropped because the pool backlog was full
 
-# Logger
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        RotatingFileHandler("dashboard.log", maxBytes=1_000_000, backupCount=5),
-        logging.StreamHandler()
-    ]
-)
+# Logger: queued, written by a background thread (see logconfig.py)
+logconfig.setup_logging()
 
 # Global socketio instance
 _socketio = None
@@ -36,8 +85,13 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         logging.info("✅ Connecté au broker MQTT: mqtt.dev.icam.school")
         # Subscribe to ALL bzh/mecatro traffic for complete monitoring
-        client.subscribe("bzh/mecatro/#")
-        logging.info("📡 Abonné au topic: bzh/mecatro/# (monitoring complet)")
+        if MQTT_ROLE == 'ingest':
+            # Shared subscription: each message goes to one worker of the group
+            topic = f"$share/{MQTT_SHARE_GROUP}/{MQTT_TOPIC}"
+        else:
+            topic = MQTT_TOPIC
+        client.subscribe(topic)
+        logging.info("📡 Abonné au topic: %s (rôle %s)", topic, MQTT_ROLE)
     else:
         logging.error("❌ Échec de connexion au broker MQTT, code: %s. Tentative de reconnexion...", rc)
         try:
@@ -57,8 +111,16 @@ def on_message(client, userdata, msg):
     global _socketio
     try:
         topic = msg.topic
+        # Replayed captures carry their original receive time (see capture.py)
+        received_at = getattr(msg, 'received_at', None)
+        if received_at is None:
+            received_at = datetime.now()
+            capture.record(topic, msg.payload)
         payload = msg.payload.decode()
-        logging.info("Message reçu sur %s: %s", topic, payload)
+        # Per-message info logs: first message of a topic, then 1 in LOG_SAMPLE_EVERY
+        verbose = logconfig.sampler.sample(topic)
+        if verbose:
+            logging.info("Message reçu sur %s: %s", topic, payload)
 
         # --- Analysis & Logging ---
         parts = topic.split('/')
@@ -111,9 +173,17 @@ def on_message(client, userdata, msg):
                     error_reason = "Structure invalide pour projets (attendu: .../projets/<GROUPE>/capteurs|actionneurs/<NOM>)"
                     logging.warning(f"Topic NON CONFORME: {topic} - {error_reason}")
         
+        # Admission control: over-limit traffic is counted and sampled, not fully persisted
+        admitted = throttle.admit(project, topic)
+        if LIVE:
+            timeseries.registry.record(project, received_at.timestamp())
+
         # Only log messages from bzh/mecatro hierarchy
         if len(parts) >= 2 and parts[0] == 'bzh' and parts[1] == 'mecatro':
-            database.log_mqtt_message(topic, payload, project, category, is_compliant)
+            if LIVE:
+                sketches.registry.observe(topic, project, is_compliant, received_at)
+            if admitted and PERSIST:
+                _db_write(_spooled, database.log_mqtt_message, topic, payload, project, category, is_compliant, received_at)
         
         # Cleanup old messages periodically (every 1000 messages)
         # This keeps the database size under control
@@ -123,13 +193,24 @@ def on_message(client, userdata, msg):
             on_message.message_count = 1
             
         if on_message.message_count % 1000 == 0:
-            database.cleanup_old_mqtt_messages()
+            if PERSIST:
+                _db_write(database.cleanup_old_mqtt_messages)
+            _emit_evictions(live_series.evict_idle(time.time()))
+
+        if LIVE:
+            persist_ingest_state()
         # --------------------------
         
         # Log message receipt for stats
-        database.log_message_receipt()
+        if admitted and PERSIST:
+            _db_write(_spooled, database.log_message_receipt, received_at)
         
-        timestamp = datetime.now().isoformat(timespec='seconds') + 'Z'
+        timestamp = received_at.isoformat(timespec='seconds') + 'Z'
+
+        # Alert rules matching this topic (topic trie, see rules.py)
+        if LIVE:
+            for rule in rule_engine.evaluate(topic, payload, is_compliant):
+                _emit_alert(rule, topic, payload, timestamp)
         
         # Ajouter le message à la liste des derniers messages
         message_data = {
@@ -139,12 +220,13 @@ def on_message(client, userdata, msg):
         }
         last_messages.appendleft(message_data)
 
-        # Emit new message event to all clients
-        if _socketio:
-            _socketio.emit('new_message', message_data, namespace='/')
+        # Emit new message event to all clients (throttled traffic is not broadcast)
+        if _socketio and admitted:
+            event_log.publish(_socketio, 'new_message', message_data)
             eventlet.sleep(0)  # Yield to eventlet to process the emit
-            logging.info("✉️ Event 'new_message' emitted to all clients for topic: %s", topic)
-        else:
+            if verbose:
+                logging.info("✉️ Event 'new_message' emitted to all clients for topic: %s", topic)
+        elif LIVE and not _socketio:
             logging.warning("⚠️ SocketIO not initialized!")
         
         # Parse topic: bzh/mecatro/dashboard/<project>/<variable>
@@ -156,71 +238,228 @@ def on_message(client, userdata, msg):
         module = parts[3]  # project name
         variable = parts[4]  # variable name
         
-        # Track publication count per module (in-memory counter)
-        module_message_count[module] += 1
-        
         # Log to database for trend tracking
-        database.log_module_publication(module)
+        if admitted and PERSIST:
+            _db_write(_spooled, database.log_module_publication, module, received_at)
         
         # Si le payload est vide, supprimer la variable
         if not payload:
-            if module in dashboard_data and variable in dashboard_data[module]:
-                del dashboard_data[module][variable]
-                # Si le module n'a plus de variables, le supprimer aussi
-                if not dashboard_data[module]:
-                    del dashboard_data[module]
+            # (le module disparaît avec sa dernière variable)
+            stale_detector.forget(module, variable)
+            with _throttled_lock:
+                _throttled_updates.pop((module, variable), None)
+            if live_series.remove(module, variable):
                 # Emit deletion event to all clients
                 if _socketio:
-                    _socketio.emit('delete_data', {'module': module, 'variable': variable}, namespace='/')
+                    event_log.publish(_socketio, 'delete_data', {'module': module, 'variable': variable})
             return
 
         # Ajouter/mettre à jour la variable avec un payload non vide
-        if module not in dashboard_data:
-            dashboard_data[module] = {}
-
-        dashboard_data[module][variable] = {
-            "valeur": payload,
-            "derniere_maj": timestamp
-        }
-        
-        # Rate limiting for database saves
-        key = f"{module}:{variable}"
-        now = datetime.now()
-        time_since_last_save = (now - last_save_time[key]).total_seconds()
-        
-        # Check if value has changed (skip duplicates)
-        value_changed = last_value_cache.get(key) != payload
+        # (the least recently updated series are evicted beyond LIVE_SERIES_MAX)
+        _emit_evictions(live_series.update(module, variable, payload, timestamp, received_at.timestamp()))
+        # Re-arm the silence timer (wall clock: replayed captures carry old receive times)
+        if LIVE and stale_detector.touch(module, variable, time.time()) and _socketio:
+            event_log.publish(_socketio, 'sensor_recovered', {'module': module, 'variable': variable})
         
         # Save to database only if:
         # 1. Enough time has passed (rate limit) OR
         # 2. Value has changed significantly
-        should_save = time_since_last_save >= RATE_LIMIT_SECONDS or value_changed
+        # (throttled messages only refresh the live value)
+        should_save = PERSIST and admitted and live_series.should_save(
+            module, variable, payload, received_at.timestamp(), RATE_LIMIT_SECONDS)
         
         if should_save:
-            database.save_measurement(module, variable, payload)
-            last_save_time[key] = now
-            last_value_cache[key] = payload
+            _db_write(_spooled, database.save_measurement, module, variable, payload, received_at)
         else:
-            logging.debug(f"Skipped DB save for {key} (rate limited or duplicate)")
+            logging.debug("Skipped DB save for %s:%s (rate limited or duplicate)", module, variable)
         
         # Emit update event to all clients (always update UI, even if not saving to DB)
-        if _socketio:
-            _socketio.emit('update_data', {
-                'module': module, 
-                'variable': variable, 
-                'value': payload,
-                'timestamp': timestamp
-            }, namespace='/')
+        update = {
+            'module': module,
+            'variable': variable,
+            'value': payload,
+            'timestamp': timestamp
+        }
+        if _socketio and admitted:
+            with _throttled_lock:
+                # A pending coalesced value is older than this one
+                _throttled_updates.pop((module, variable), None)
+                event_log.publish(_socketio, 'update_data', update)
             eventlet.sleep(0)  # Yield to eventlet to process the emit
-            logging.info("📡 Event 'update_data' emitted to all clients: %s/%s = %s", module, variable, payload)
-        else:
+            if verbose:
+                logging.info("📡 Event 'update_data' emitted to all clients: %s/%s = %s", module, variable, payload)
+        elif _socketio:
+            # Throttled: pushed with the next flush tick (latest value only)
+            with _throttled_lock:
+                _throttled_updates[(module, variable)] = update
+        elif LIVE:
             logging.warning("⚠️ SocketIO not initialized!")
     except Exception as e:
         logging.error("Erreur lors du traitement du message MQTT : %s", e)
 
+def _emit_evictions(keys):
+    """Tell clients to drop series evicted from the live registry."""
+    for module, variable in keys:
+        logging.info("Série inactive retirée du tableau de bord: %s/%s", module, variable)
+        stale_detector.forget(module, variable)
+        with _throttled_lock:
+            _throttled_updates.pop((module, variable), None)
+        if _socketio:
+            event_log.publish(_socketio, 'delete_data', {'module': module, 'variable': variable})
+
+def flush_throttled_updates(socketio):
+    """Push the latest value of each series updated only by throttled messages."""
+    with _throttled_lock:
+        updates = list(_throttled_updates.values())
+        _throttled_updates.clear()
+        # Published under the lock: an admitted message cannot overtake its older value
+        for update in updates:
+            event_log.publish(socketio, 'update_data', update)
+    return len(updates)
+
+def _throttled_flush_loop(socketio):
+    while True:
+        socketio.sleep(THROTTLED_FLUSH_SECONDS)
+        try:
+            flush_throttled_updates(socketio)
+        except Exception as e:
+            logging.error(f"Erreur envoi des valeurs bridées: {e}")
+
+def _emit_alert(rule, topic, payload, timestamp):
+    logging.warning("Alerte « %s » : %s = %s", rule.name or rule.topic_filter, topic, payload[:100])
+    if _socketio:
+        event_log.publish(_socketio, 'alert', dict(rule.as_dict(), topic=topic, payload=payload[:200],
+                                                   timestamp=timestamp))
+
+def reload_rules():
+    """(Re)load the enabled alert rules from the DB, without restart."""
+    try:
+        rule_engine.load(database.load_alert_rules())
+    except Exception as e:
+        logging.error(f"Erreur chargement des règles d'alerte: {e}")
+
+def _db_done(future):
+    global _db_pending
+    with _db_pending_lock:
+        _db_pending -= 1
+    if future.exception() is not None:
+        logging.error("Erreur écriture DB (pool) : %s", future.exception())
+
+def _spooled(fn, *args):
+    """Run an ingest write; if the DB is down, append it to the on-disk spool instead."""
+    try:
+        fn(*args)
+    except database.DB_DOWN_ERRORS as e:
+        if not isinstance(e, database.DatabaseUnavailable):
+            breaker.record_failure()  # connection lost mid-statement
+        if not spool.append(fn.__name__, list(args)):
+            logging.error("Spool plein, écriture perdue (%s)", fn.__name__)
+
+def _db_write(fn, *args):
+    """Run a DB write inline ('thread' mode) or on the DB thread pool ('eventlet' mode)."""
+    global _db_pending, db_dropped
+    if _db_executor is None:
+        return fn(*args)
+    with _db_pending_lock:
+        if _db_pending >= MQTT_DB_MAX_PENDING:
+            db_dropped += 1
+            return None
+        _db_pending += 1
+    future = _db_executor.submit(fn, *args)
+    future.add_done_callback(_db_done)
+    return future
+
+def persist_ingest_state(force=False):
+    """Checkpoint the sketches and ring buffers changed since the last call."""
+    global _last_state_persist
+    if not _checkpoint_state:
+        return
+    now = time.monotonic()
+    if not force and now - _last_state_persist < INGEST_STATE_PERSIST_SECONDS:
+        return
+    _last_state_persist = now
+    _db_write(database.save_sketch_states, sketches.registry.dump_dirty(), sketches.registry.pop_evicted())
+    _db_write(database.save_timeseries_states, timeseries.registry.dump_dirty())
+
+def _green_loop(client):
+    """Drive paho's network loop cooperatively on the eventlet hub.
+
+    Uses paho's external-loop API (socket / loop_read / loop_write / loop_misc):
+    the greenlet only wakes up when the socket is readable or every second for
+    keepalives, so callbacks and Socket.IO emits run on the hub thread.
+    """
+    from eventlet.hubs import trampoline  # type: ignore
+    while True:
+        sock = client.socket()
+        if sock is None:
+            # Not connected: paho's reconnect is synchronous, retry every 2 s
+            eventlet.sleep(2)
+            try:
+                client.reconnect()
+            except Exception as e:
+                logging.error("Erreur lors de la reconnexion : %s", e)
+            continue
+        try:
+            trampoline(sock, read=True, timeout=1.0, timeout_exc=eventlet.Timeout)
+            client.loop_read()
+        except eventlet.Timeout:
+            pass
+        except Exception as e:
+            logging.error("Erreur boucle MQTT (eventlet) : %s", e)
+        if client.want_write():
+            client.loop_write()
+        client.loop_misc()
+
+_state_restored = False
+
+def restore_state():
+    """Restore the analysis sketches, ring buffers and measurement hot tier (once).
+
+    Called by init_mqtt, or beforehand by app.start_services to time it.
+    """
+    global _state_restored
+    if _state_restored:
+        return
+    _state_restored = True
+    if LIVE:
+        database.load_sketch_states()
+        database.load_timeseries_states()
+        reload_rules()
+    if MQTT_ROLE == 'all':
+        # With separate ingest workers this process never sees the measurement
+        # writes, so history reads must go to the DB
+        database.load_hot_tier()
+
+class _NoEmit:
+    """Socket.IO stand-in for in-process replays: there are no clients to push to."""
+
+    def emit(self, *args, **kwargs):
+        pass
+
+def init_replay():
+    """Feed on_message offline (replay_mqtt.py --mode direct).
+
+    Events are dropped instead of broadcast, and the sketches / ring buffers
+    built from the replay are never checkpointed: they would overwrite the
+    state persisted by the running server.
+    """
+    global _socketio, _checkpoint_state
+    _socketio = _NoEmit()
+    _checkpoint_state = False
+
 def init_mqtt(socketio=None):
-    global _socketio
+    global _socketio, _db_executor
     _socketio = socketio
+
+    # Restored before new traffic arrives
+    restore_state()
+    if LIVE and socketio is not None:
+        # Silent sensors are reported as 'sensor_stale' events (see staleness.py)
+        stale_detector.start(lambda event, data: event_log.publish(socketio, event, data))
+        socketio.start_background_task(_throttled_flush_loop, socketio)
+    if PERSIST:
+        # Writes spooled during a DB outage (this run or a previous one) are replayed in the background
+        spool.start_replayer(database.apply_spooled_batch, breaker)
     
     client = mqtt.Client()
     client.on_connect = on_connect
@@ -228,9 +467,20 @@ def init_mqtt(socketio=None):
     client.on_message = on_message
     # client.username_pw_set('admin', 'admin@icam')
     try:
-        client.connect("global_mqtt", 1883, 60)
-        client.loop_start()
-        logging.info("🚀 Client MQTT démarré et connecté à mqtt.dev.icam.school")
+        if MQTT_LOOP_MODE == 'eventlet' and socketio is not None:
+            _db_executor = ThreadPoolExecutor(max_workers=MQTT_DB_POOL_SIZE, thread_name_prefix='mqtt-db')
+            # Called on the server's hub (app.start_services): connect off the hub, and
+            # run the loop even if the broker is down (it reconnects every 2 s)
+            try:
+                tpool.execute(client.connect, MQTT_BROKER, MQTT_PORT, 60)
+            except Exception as e:
+                logging.error("❌ Erreur lors de la connexion au broker MQTT : %s", e)
+            socketio.start_background_task(_green_loop, client)
+        else:
+            # Connected (and reconnected) by paho's network thread: startup does not wait for the broker
+            client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+            client.loop_start()
+        logging.info("🚀 Client MQTT démarré (%s), broker %s:%s", MQTT_LOOP_MODE, MQTT_BROKER, MQTT_PORT)
     except Exception as e:
         logging.error("❌ Erreur lors de la connexion au broker MQTT : %s", e)
     return client
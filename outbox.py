@@ -0,0 +1,242 @@
+# outbox.py
+"""
+Per-client outbound queues for the Socket.IO push (slow-consumer protection).
+
+A plain socketio.emit() broadcast hands every event to every client's
+engine.io queue, which grows without bound for a browser that cannot keep
+up. Instead, eventlog.EventLog.publish() appends events to one bounded
+outbox per client, and a single dispatcher greenlet on the server's eventlet
+hub forwards them while the client's transport backlog stays under
+SOCKET_TRANSPORT_MAX packets. Producers (paho's thread, the staleness
+thread, request greenlets) wake it through a socket pair, so it sleeps
+while nothing is queued and only polls, every SOCKET_DISPATCH_INTERVAL,
+while a client's transport is backed up.
+
+When an outbox holds more than SOCKET_QUEUE_MAX events, or its oldest
+event waits longer than SOCKET_QUEUE_MAX_AGE seconds, its pending events
+are dropped and replaced by one 'resync_required' marker: the client then
+resyncs (see eventlog.py) instead of replaying every missed update. A
+client collapsed more than SOCKET_MAX_COLLAPSES times within
+SOCKET_COLLAPSE_WINDOW seconds is disconnected.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import eventlet
+from eventlet.hubs import trampoline  # type: ignore
+
+SOCKET_QUEUE_MAX = int(os.environ.get('SOCKET_QUEUE_MAX', 200))
+SOCKET_QUEUE_MAX_AGE = float(os.environ.get('SOCKET_QUEUE_MAX_AGE', 10))
+SOCKET_TRANSPORT_MAX = int(os.environ.get('SOCKET_TRANSPORT_MAX', 16))
+SOCKET_MAX_COLLAPSES = int(os.environ.get('SOCKET_MAX_COLLAPSES', 3))
+SOCKET_COLLAPSE_WINDOW = float(os.environ.get('SOCKET_COLLAPSE_WINDOW', 60))
+SOCKET_DISPATCH_INTERVAL = 0.02
+RESYNC_EVENT = 'resync_required'
+
+
+class ClientOutbox:
+    __slots__ = ('sid', 'pending', 'resync_pending', 'collapse_times', 'kick',
+                 'connected_at', 'sent', 'dropped', 'collapses')
+
+    def __init__(self, sid, now):
+        self.sid = sid
+        self.pending = deque()          # (enqueued monotonic time, event, data)
+        self.resync_pending = False     # a resync marker is queued: later events are redundant
+        self.collapse_times = deque()
+        self.kick = False
+        self.connected_at = now
+        self.sent = 0
+        self.dropped = 0
+        self.collapses = 0
+
+
+class OutboxRegistry:
+    def __init__(self, queue_max=SOCKET_QUEUE_MAX, max_age=SOCKET_QUEUE_MAX_AGE,
+                 transport_max=SOCKET_TRANSPORT_MAX, max_collapses=SOCKET_MAX_COLLAPSES,
+                 collapse_window=SOCKET_COLLAPSE_WINDOW):
+        self.queue_max = queue_max
+        self.max_age = max_age
+        self.transport_max = transport_max
+        self.max_collapses = max_collapses
+        self.collapse_window = collapse_window
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._socketio = None
+        # Wake-up channel: writable from any thread, readable by the hub greenlet
+        self._wake_r = self._wake_w = None
+        self._wake_pending = False
+        self.counters = {"sent": 0, "dropped": 0, "collapses": 0, "disconnected": 0}
+
+    @property
+    def active(self):
+        return self._socketio is not None
+
+    def start(self, socketio):
+        """Route pushed events through the outboxes, forwarded by a greenlet on the hub.
+
+        Must be called from the thread running the server's hub.
+        """
+        if self._socketio is None:
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._wake_w.setblocking(False)
+            self._socketio = socketio
+            socketio.start_background_task(self._dispatch_loop)
+
+    def _wake(self):
+        # Called with self._lock held: one pending byte is enough
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._wake_w.send(b'x')
+            except BlockingIOError:
+                pass   # buffer full of wake-ups already
+
+    def connect(self, sid):
+        with self._lock:
+            self._clients[sid] = ClientOutbox(sid, time.monotonic())
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def broadcast(self, event, data):
+        """Queue `data` (carrying its event-log seq) for every connected client."""
+        now = time.monotonic()
+        with self._lock:
+            for client in self._clients.values():
+                if client.resync_pending:
+                    client.dropped += 1
+                    self.counters["dropped"] += 1
+                elif len(client.pending) >= self.queue_max or (
+                        client.pending and now - client.pending[0][0] > self.max_age):
+                    self._collapse(client, data.get('seq'), now)
+                else:
+                    client.pending.append((now, event, data))
+            if self._clients:
+                self._wake()
+
+    def _collapse(self, client, seq, now):
+        # The event being queued is dropped too: the resync returns it
+        dropped = len(client.pending) + 1
+        client.pending.clear()
+        client.pending.append((now, RESYNC_EVENT, {"seq": seq}))
+        client.resync_pending = True
+        client.dropped += dropped
+        client.collapses += 1
+        self.counters["dropped"] += dropped
+        self.counters["collapses"] += 1
+        client.collapse_times.append(now)
+        while client.collapse_times and client.collapse_times[0] < now - self.collapse_window:
+            client.collapse_times.popleft()
+        if len(client.collapse_times) > self.max_collapses:
+            client.kick = True
+        logging.warning("Client Socket.IO %s trop lent : %d événements remplacés par un resync",
+                        client.sid, dropped)
+
+    def _transport_backlog(self, sid):
+        """Packets waiting in the client's engine.io queue (not yet written to the socket)."""
+        server = self._socketio.server
+        try:
+            eio_sid = server.manager.eio_sid_from_sid(sid, '/')
+            return server.eio.sockets[eio_sid].queue.qsize()
+        except (KeyError, AttributeError):
+            return 0
+
+    def _next_batch(self, client):
+        budget = self.transport_max - self._transport_backlog(client.sid)
+        batch = []
+        with self._lock:
+            while budget > 0 and client.pending:
+                _, event, data = client.pending.popleft()
+                if event == RESYNC_EVENT:
+                    client.resync_pending = False
+                batch.append((event, data))
+                budget -= 1
+            client.sent += len(batch)
+            self.counters["sent"] += len(batch)
+        return batch
+
+    def dispatch_once(self):
+        """Forward what the transports accept; returns (events still waiting, events sent)."""
+        with self._lock:
+            clients = list(self._clients.values())
+        waiting = False
+        sent = 0
+        for client in clients:
+            if client.kick:
+                logging.warning("Client Socket.IO %s déconnecté (trop lent)", client.sid)
+                with self._lock:
+                    self._clients.pop(client.sid, None)
+                    self.counters["disconnected"] += 1
+                self._socketio.server.disconnect(client.sid, namespace='/')
+                continue
+            for event, data in self._next_batch(client):
+                self._socketio.emit(event, data, to=client.sid, namespace='/')
+                sent += 1
+            waiting = waiting or bool(client.pending)
+        return waiting, sent
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        # Cleared after draining: a producer seeing the flag set has queued its
+        # event before this point, so the dispatch that follows forwards it
+        with self._lock:
+            self._wake_pending = False
+
+    def _dispatch_loop(self):
+        waiting, sent = False, 0
+        while True:
+            if waiting and sent:
+                # Let the engine.io writers flush, then forward the rest
+                eventlet.sleep(0)
+            else:
+                try:
+                    # Sleep until something is queued; poll only while every transport
+                    # with waiting events is backed up
+                    trampoline(self._wake_r, read=True,
+                               timeout=SOCKET_DISPATCH_INTERVAL if waiting else None,
+                               timeout_exc=eventlet.Timeout)
+                except eventlet.Timeout:
+                    pass
+            self._drain_wakeups()
+            try:
+                waiting, sent = self.dispatch_once()
+            except Exception as e:
+                logging.error(f"Erreur dispatch Socket.IO: {e}")
+                waiting, sent = True, 0
+
+    def stats(self, limit=50):
+        """Totals and the `limit` most backed-up clients."""
+        now = time.monotonic()
+        with self._lock:
+            clients = sorted(self._clients.values(), key=lambda c: -len(c.pending))
+            rows = [
+                {
+                    "sid": c.sid,
+                    "pending": len(c.pending),
+                    "oldest_seconds": round(now - c.pending[0][0], 2) if c.pending else 0,
+                    "sent": c.sent,
+                    "dropped": c.dropped,
+                    "collapses": c.collapses,
+                    "connected_seconds": round(now - c.connected_at),
+                }
+                for c in clients[:limit]
+            ]
+            result = dict(self.counters, clients=len(self._clients), queue_max=self.queue_max,
+                          max_age_seconds=self.max_age, transport_max=self.transport_max)
+        for row in rows:
+            row["transport_backlog"] = self._transport_backlog(row["sid"]) if self.active else 0
+        result["top_clients"] = rows
+        return result
+
+
+outboxes = OutboxRegistry()
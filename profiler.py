@@ -0,0 +1,201 @@
+# profiler.py
+"""
+On-demand, in-process profiling for the admin area.
+
+StackSampler periodically snapshots the Python stacks of every OS thread
+(sys._current_frames: paho's network thread, the eventlet hub, DB pool
+workers, ...) and of every suspended greenlet (request handlers, the
+eventlet MQTT loop), and aggregates them as collapsed stacks
+("root;outer;inner count" lines) that flamegraph.pl or speedscope read
+directly. It runs in a real OS thread, so it keeps sampling while the hub
+is busy.
+
+RequestTimer records wall-clock durations of chosen routes for a limited
+time (per-request timing mode).
+"""
+import gc
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+PROFILE_DEFAULT_INTERVAL = 0.01   # 100 Hz
+# Suspended greenlets are found with a gc scan, refreshed at most this often
+_GREENLET_REFRESH_SECONDS = 1.0
+
+try:
+    import greenlet  # type: ignore
+except ImportError:  # pragma: no cover - eventlet always brings it
+    greenlet = None
+
+
+def _clamp(value, low, high):
+    # NaN compares false everywhere and would slip through min/max
+    if math.isnan(value):
+        return low
+    return min(max(value, low), high)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(root, frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    def __init__(self, interval=PROFILE_DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._greenlets = []
+        self._greenlets_at = 0.0
+
+    def _suspended_greenlets(self, now):
+        if greenlet is None:
+            return []
+        if now - self._greenlets_at >= _GREENLET_REFRESH_SECONDS:
+            self._greenlets = [o for o in gc.get_objects() if isinstance(o, greenlet.greenlet)]
+            self._greenlets_at = now
+        return [g for g in self._greenlets if g.gr_frame is not None and not g.dead]
+
+    def sample_once(self, skip_ident=None):
+        now = time.monotonic()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip_ident:
+                continue
+            self.stacks[_collapse(f"thread:{names.get(ident, ident)}", frame)] += 1
+        # Running greenlets appear above as their OS thread; suspended ones only here
+        for g in self._suspended_greenlets(now):
+            run = getattr(g, 'run', None)
+            root = f"greenlet:{getattr(run, '__name__', type(g).__name__)}"
+            self.stacks[_collapse(root, g.gr_frame)] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """Sample for `seconds` in the calling thread."""
+        me = threading.get_ident()
+        start = time.monotonic()
+        deadline = start + seconds
+        next_at = start
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            self.sample_once(skip_ident=me)
+            next_at += self.interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+        self.elapsed = time.monotonic() - start
+
+    def collapsed(self):
+        """flamegraph.pl / speedscope 'collapsed stacks' text."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=30):
+        """Functions by self samples (innermost frame) and total samples."""
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+        return [
+            {"function": label, "self": n, "total": total_counts[label],
+             "self_pct": round(100 * n / max(1, self.samples), 1)}
+            for label, n in self_counts.most_common(limit)
+        ]
+
+
+class ProfilerBusy(Exception):
+    """Another profiling session is already running."""
+
+
+class ProfileSession:
+    """One background sampling run, polled by the admin endpoint."""
+
+    _lock = threading.Lock()
+    _running = False
+
+    def __init__(self, seconds, interval=PROFILE_DEFAULT_INTERVAL):
+        self.seconds = _clamp(seconds, 0.1, PROFILE_MAX_SECONDS)
+        self.sampler = StackSampler(_clamp(interval, 0.001, 1.0))
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        with ProfileSession._lock:
+            if ProfileSession._running:
+                raise ProfilerBusy("Un profilage est déjà en cours")
+            ProfileSession._running = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.sampler.run(self.seconds)
+        finally:
+            with ProfileSession._lock:
+                ProfileSession._running = False
+
+    def done(self):
+        return not self._thread.is_alive()
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+class RequestTimer:
+    """Per-request wall-clock timing of selected route prefixes, for a limited time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prefixes = ()
+        self.until = 0.0
+        self.durations = defaultdict(list)
+
+    def enable(self, prefixes, seconds):
+        with self._lock:
+            self.prefixes = tuple(prefixes)
+            self.until = time.monotonic() + _clamp(seconds, 0, 3600)
+            self.durations = defaultdict(list)
+
+    def active(self, path):
+        return time.monotonic() < self.until and path.startswith(self.prefixes)
+
+    def record(self, path, ms):
+        with self._lock:
+            self.durations[path].append(ms)
+
+    def report(self):
+        with self._lock:
+            result = {}
+            for path, values in self.durations.items():
+                values = sorted(values)
+                result[path] = {
+                    "count": len(values),
+                    "p50_ms": round(_percentile(values, 50), 1),
+                    "p95_ms": round(_percentile(values, 95), 1),
+                    "max_ms": round(values[-1], 1),
+                }
+            return {
+                "prefixes": list(self.prefixes),
+                "seconds_left": max(0, round(self.until - time.monotonic())),
+                "routes": result,
+            }
+
+
+request_timer = RequestTimer()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Replay captured MQTT traffic (see capture.py / MQTT_CAPTURE_DIR).
+
+Direct mode feeds mqtt_client.on_message in process, keeping the original
+receive times (backfill after a DB outage); it writes the DB tables only,
+never the analysis checkpoints of the running server. Broker mode republishes the
+messages to a broker, for realistic load tests against a running instance.
+
+Examples:
+    python replay_mqtt.py captures/capture-*.ndjson --mode direct --speed max
+    python replay_mqtt.py captures/*.ndjson --mode broker --broker localhost --speed 10
+"""
+import argparse
+import glob
+import time
+
+
+def parse_speed(value):
+    if value == 'max':
+        return None
+    if value == 'original':
+        return 1.0
+    return float(value)
+
+
+def replay(records, deliver, speed):
+    """Call deliver(received, topic, payload) for each record, paced by `speed`.
+
+    speed None = as fast as possible, 1.0 = original timing, 10 = ten times faster.
+    """
+    count = 0
+    start = time.monotonic()
+    first_ts = None
+    for received, topic, payload in records:
+        if speed is not None:
+            if first_ts is None:
+                first_ts = received
+            delay = (received - first_ts) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        deliver(received, topic, payload)
+        count += 1
+        if count % 10000 == 0:
+            elapsed = time.monotonic() - start
+            print(f"  {count} messages, {count / elapsed:.0f} msg/s", end='\r')
+    return count, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="capture files (.ndjson / .ndjson.gz), globs allowed")
+    parser.add_argument('--mode', choices=['direct', 'broker'], default='direct')
+    parser.add_argument('--speed', default='original', help="'original', 'max' or a scale factor (e.g. 10)")
+    parser.add_argument('--broker', default='global_mqtt')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--throttle', action='store_true',
+                        help="direct mode: keep ingest admission control (disabled by default for backfill)")
+    args = parser.parse_args()
+
+    import capture
+
+    paths = sorted({p for pattern in args.files for p in glob.glob(pattern)})
+    if not paths:
+        parser.error("aucun fichier de capture trouvé")
+    speed = parse_speed(args.speed)
+    records = capture.read_capture(paths)
+
+    if args.mode == 'direct':
+        from datetime import datetime
+        import database
+        import mqtt_client
+        from throttle import throttle
+
+        database.init_db()
+        mqtt_client.init_replay()
+        throttle.enabled = args.throttle
+
+        def deliver(received, topic, payload):
+            msg = capture.ReplayMessage(topic, payload, datetime.fromtimestamp(received))
+            mqtt_client.on_message(None, None, msg)
+    else:
+        import paho.mqtt.client as mqtt  # type: ignore
+
+        client = mqtt.Client()
+        client.connect(args.broker, args.port, 60)
+        client.loop_start()
+
+        def deliver(received, topic, payload):
+            client.publish(topic, payload)
+
+    print(f"Rejeu de {len(paths)} fichier(s) en mode {args.mode}, vitesse {args.speed}")
+    count, elapsed = replay(records, deliver, speed)
+
+    if args.mode == 'broker':
+        client.loop_stop()
+        client.disconnect()
+
+    print(f"\n{count} messages rejoués en {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} msg/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# rules.py
+"""
+Ingest-time alert rules, matched through an MQTT-wildcard topic trie.
+
+A rule pairs an MQTT topic filter ('+' = one level, '#' = the remaining
+levels, possibly none) with a condition on the message:
+    >, >=, <, <=, ==, !=   numeric payload compared with the threshold
+                           (== / != compare strings when either side is
+                           not a number)
+    non_compliant          the topic does not follow the IoT guide
+    any                    every message
+
+Rules are indexed by filter level in a trie, so matching a topic walks at
+most the exact, '+' and '#' branches of each of its levels: the cost
+depends on the topic depth and the number of matching rules, not on the
+total number of rules. A fired rule stays quiet for `cooldown` seconds per
+topic.
+
+Rules live in the alert_rules table; load() swaps in a freshly built trie
+so readers never lock (reload without restart).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+OPERATORS = ('>', '>=', '<', '<=', '==', '!=', 'non_compliant', 'any')
+_NUMERIC = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+# Remembered (rule, topic) cooldowns; beyond this the least recently fired are forgotten
+COOLDOWN_KEYS_MAX = 100_000
+
+
+def parse_number(text):
+    """float(text), or None when it is not a number."""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def validate_filter(topic_filter):
+    """Error message for an invalid MQTT topic filter, or None."""
+    if not topic_filter:
+        return "Filtre de topic vide"
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if '#' in level and (level != '#' or i != len(levels) - 1):
+            return "'#' doit être seul au dernier niveau"
+        if '+' in level and level != '+':
+            return "'+' doit occuper un niveau entier"
+    return None
+
+
+def topic_matches(topic_filter, topic):
+    """Reference MQTT filter matching, rule by rule (used by the benchmark)."""
+    f_levels = topic_filter.split('/')
+    t_levels = topic.split('/')
+    for i, f in enumerate(f_levels):
+        if f == '#':
+            return True
+        if i >= len(t_levels) or (f != '+' and f != t_levels[i]):
+            return False
+    return len(f_levels) == len(t_levels)
+
+
+class Rule:
+    __slots__ = ('id', 'name', 'topic_filter', 'operator', 'threshold', 'number', 'cooldown')
+
+    def __init__(self, id, name, topic_filter, operator, threshold=None, cooldown=60):
+        self.id = id
+        self.name = name
+        self.topic_filter = topic_filter
+        self.operator = operator
+        self.threshold = threshold
+        self.number = parse_number(threshold)
+        self.cooldown = cooldown
+
+    def check(self, payload, is_compliant):
+        op = self.operator
+        if op == 'any':
+            return True
+        if op == 'non_compliant':
+            return not is_compliant
+        value = parse_number(payload)
+        if value is not None and self.number is not None:
+            return _NUMERIC[op](value, self.number)
+        if op in ('==', '!='):
+            return (payload == self.threshold) == (op == '==')
+        return False
+
+    def as_dict(self):
+        return {"id": self.id, "name": self.name, "topic_filter": self.topic_filter,
+                "operator": self.operator, "threshold": self.threshold, "cooldown": self.cooldown}
+
+
+class _Node:
+    __slots__ = ('children', 'rules', 'tail_rules')
+
+    def __init__(self):
+        self.children = {}     # level (or '+') -> _Node
+        self.rules = []        # rules whose filter ends here
+        self.tail_rules = []   # rules whose filter ends with '#' here
+
+
+class TopicTrie:
+    def __init__(self, rules=()):
+        self.root = _Node()
+        self.size = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        node = self.root
+        for level in rule.topic_filter.split('/'):
+            if level == '#':
+                node.tail_rules.append(rule)
+                break
+            node = node.children.setdefault(level, _Node())
+        else:
+            node.rules.append(rule)
+        self.size += 1
+
+    def match(self, topic):
+        """Rules whose filter matches `topic`."""
+        # MQTT: wildcards do not match topics starting with '$' (broker internals)
+        wildcards = not topic.startswith('$')
+        matched = []
+        nodes = [self.root]
+        for level in topic.split('/'):
+            following = []
+            for node in nodes:
+                if wildcards:
+                    matched.extend(node.tail_rules)
+                child = node.children.get(level)
+                if child is not None:
+                    following.append(child)
+                if wildcards:
+                    child = node.children.get('+')
+                    if child is not None:
+                        following.append(child)
+            if not following:
+                return matched
+            nodes = following
+            wildcards = True
+        for node in nodes:
+            matched.extend(node.rules)
+            matched.extend(node.tail_rules)   # 'a/#' also matches 'a'
+        return matched
+
+
+class RuleEngine:
+    def __init__(self):
+        self._trie = TopicTrie()
+        self._lock = threading.Lock()
+        self._last_fired = OrderedDict()   # (rule id, topic) -> monotonic time, oldest first
+        self.loaded_at = None
+        self.counters = {"evaluated": 0, "matched": 0, "fired": 0, "suppressed": 0}
+
+    def load(self, rules):
+        """Replace every rule (atomic swap of the trie)."""
+        trie = TopicTrie(rules)
+        self._trie = trie
+        self.loaded_at = time.time()
+        with self._lock:
+            self._last_fired.clear()
+        logging.info("%d règles d'alerte chargées", trie.size)
+
+    def evaluate(self, topic, payload, is_compliant, now=None):
+        """Rules fired by one message (condition met and out of cooldown for this topic)."""
+        now = time.monotonic() if now is None else now
+        matched = self._trie.match(topic)
+        fired = []
+        with self._lock:
+            self.counters["evaluated"] += 1
+            self.counters["matched"] += len(matched)
+            for rule in matched:
+                if not rule.check(payload, is_compliant):
+                    continue
+                key = (rule.id, topic)
+                last = self._last_fired.get(key)
+                if last is not None and now - last < rule.cooldown:
+                    self.counters["suppressed"] += 1
+                    continue
+                self._last_fired[key] = now
+                self._last_fired.move_to_end(key)
+                if len(self._last_fired) > COOLDOWN_KEYS_MAX:
+                    self._last_fired.popitem(last=False)
+                fired.append(rule)
+            self.counters["fired"] += len(fired)
+        return fired
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, rules=self._trie.size, cooldown_keys=len(self._last_fired),
+                        loaded_at=self.loaded_at)
+
+
+rule_engine = RuleEngine()
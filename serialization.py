@@ -0,0 +1,145 @@
+# serialization.py
+"""Shared JSON serialization and compression layer for the /api/* routes."""
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider  # type: ignore
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Responses smaller than this are sent as-is (compression overhead not worth it)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_PREFIX = '/api/'
+
+
+def _default(obj):
+    """Fallback for types the encoder does not know natively."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        # SUM()/AVG() results from MariaDB come back as Decimal
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    raise TypeError(f"Type {type(obj).__name__} non sérialisable en JSON")
+
+
+def dumps(obj):
+    """Serialize obj to JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (stdlib json as fallback).
+
+    Datetimes are emitted as ISO 8601 strings, so routes no longer need to
+    walk their results calling .isoformat().
+    """
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def _accepted_codings(accept_encoding):
+    """{coding: q} from an Accept-Encoding header ('gzip;q=0.5, br' -> {'gzip': 0.5, 'br': 1.0})."""
+    codings = {}
+    for item in accept_encoding.lower().split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def _choose_encoding(accept_encoding):
+    """Best supported coding with q > 0 ('*' covers unlisted ones), brotli on ties."""
+    codings = _accepted_codings(accept_encoding)
+    wildcard = codings.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in ('br', 'gzip') if brotli is not None else ('gzip',):
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_response(response, accept_encoding):
+    """Compress a response body in place if the client accepts it and it is big enough."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    encoding = _choose_encoding(accept_encoding or '')
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    else:
+        compressed = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = len(compressed)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Install the fast JSON provider and transparent compression for /api/* routes."""
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def _compress_api_response(response):
+        from flask import request  # type: ignore
+        if request.path.startswith(COMPRESS_PREFIX):
+            try:
+                compress_response(response, request.headers.get('Accept-Encoding'))
+            except Exception as e:
+                logging.error(f"Erreur compression réponse {request.path}: {e}")
+        return response
+
+    logging.info("JSON: %s, compression: %s",
+                 'orjson' if orjson is not None else 'json',
+                 'br+gzip' if brotli is not None else 'gzip')
@@ -0,0 +1,224 @@
+# sketches.py
+"""
+Streaming sketches for MQTT topic analytics, maintained at ingest.
+
+- HyperLogLog: approximate count of distinct topics (1 KB per scope)
+- SpaceSaving: approximate top-K heaviest topics (and most non-compliant ones)
+
+One set of sketches is kept per project plus a global one, so the analysis
+panels read a few kilobytes of state instead of scanning mqtt_messages.
+"""
+import base64
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+GLOBAL_SCOPE = '__global__'
+
+HLL_PRECISION = 10      # 2^10 registers -> ~3% standard error
+TOP_K_CAPACITY = 32     # counters kept per SpaceSaving summary (top 10 is served)
+MAX_PROJECTS = 5000     # least recently active projects are evicted beyond this
+
+
+def _hash64(value):
+    """Stable 64-bit hash (Python's hash() is salted per process)."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    __slots__ = ('p', 'm', 'registers')
+
+    def __init__(self, p=HLL_PRECISION, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'p': self.p, 'r': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['p'], bytearray(base64.b64decode(data['r'])))
+
+
+class SpaceSaving:
+    """Metwally et al. top-K summary: counts are over-estimated by at most `error`."""
+
+    __slots__ = ('capacity', 'counters')
+
+    def __init__(self, capacity=TOP_K_CAPACITY, counters=None):
+        self.capacity = capacity
+        # key -> [count, error, last_seen]
+        self.counters = counters if counters is not None else {}
+
+    def add(self, key, count=1, last_seen=None):
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] += count
+            if last_seen is not None and (entry[2] is None or last_seen > entry[2]):
+                entry[2] = last_seen
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0, last_seen]
+            return
+        # Replace the smallest counter, inheriting its count as error bound
+        victim = min(self.counters, key=lambda k: self.counters[k][0])
+        min_count = self.counters.pop(victim)[0]
+        self.counters[key] = [min_count + count, min_count, last_seen]
+
+    def top(self, n=10):
+        items = sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+        return [(key, entry[0], entry[2]) for key, entry in items]
+
+    def to_dict(self):
+        return {
+            'k': self.capacity,
+            'c': {key: [e[0], e[1], e[2].isoformat() if e[2] else None] for key, e in self.counters.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counters = {key: [e[0], e[1], datetime.fromisoformat(e[2]) if e[2] else None]
+                    for key, e in data['c'].items()}
+        return cls(data['k'], counters)
+
+
+class TopicSketches:
+    """Sketches for one scope (a project, or the global traffic)."""
+
+    __slots__ = ('distinct', 'topics', 'errors')
+
+    def __init__(self, distinct=None, topics=None, errors=None):
+        self.distinct = distinct or HyperLogLog()
+        self.topics = topics or SpaceSaving()
+        self.errors = errors or SpaceSaving()
+
+    def add(self, topic, is_compliant, timestamp, count=1):
+        self.distinct.add(topic)
+        self.topics.add(topic, count, timestamp)
+        if not is_compliant:
+            self.errors.add(topic, count)
+
+    def dumps(self):
+        return json.dumps({
+            'distinct': self.distinct.to_dict(),
+            'topics': self.topics.to_dict(),
+            'errors': self.errors.to_dict(),
+        }, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, data):
+        state = json.loads(data)
+        return cls(HyperLogLog.from_dict(state['distinct']),
+                   SpaceSaving.from_dict(state['topics']),
+                   SpaceSaving.from_dict(state['errors']))
+
+
+class SketchRegistry:
+    """Per-project and global sketches, updated by the MQTT thread and read by the web tier."""
+
+    def __init__(self, max_projects=MAX_PROJECTS):
+        self.max_projects = max_projects
+        self._lock = threading.Lock()
+        self._scopes = OrderedDict()
+        self._dirty = set()
+        self._evicted = set()
+
+    def _scope(self, name):
+        sketches = self._scopes.get(name)
+        if sketches is None:
+            sketches = self._scopes[name] = TopicSketches()
+            self._evicted.discard(name)
+            self._evict()
+        else:
+            self._scopes.move_to_end(name)
+        return sketches
+
+    def _evict(self):
+        # The global scope does not count towards the limit and is never evicted
+        while len(self._scopes) - (GLOBAL_SCOPE in self._scopes) > self.max_projects:
+            name = next(iter(self._scopes))
+            if name == GLOBAL_SCOPE:
+                self._scopes.move_to_end(name)
+                continue
+            del self._scopes[name]
+            self._dirty.discard(name)
+            self._evicted.add(name)
+
+    def observe(self, topic, project, is_compliant, timestamp=None, count=1):
+        timestamp = timestamp or datetime.now()
+        with self._lock:
+            self._scope(GLOBAL_SCOPE).add(topic, is_compliant, timestamp, count)
+            self._dirty.add(GLOBAL_SCOPE)
+            if project:
+                self._scope(project).add(topic, is_compliant, timestamp, count)
+                self._dirty.add(project)
+
+    def is_empty(self):
+        return not self._scopes
+
+    def distinct_topics(self, project=GLOBAL_SCOPE):
+        with self._lock:
+            sketches = self._scopes.get(project)
+            return sketches.distinct.count() if sketches else 0
+
+    def top_topics(self, project=GLOBAL_SCOPE, n=10):
+        """[{topic, count, last_seen}] like the former GROUP BY topic query."""
+        with self._lock:
+            sketches = self._scopes.get(project)
+            top = sketches.topics.top(n) if sketches else []
+        return [{"topic": t, "count": c, "last_seen": ts} for t, c, ts in top]
+
+    def top_errors(self, project=GLOBAL_SCOPE, n=10):
+        """[{topic, count}] of the most frequent non-compliant topics."""
+        with self._lock:
+            sketches = self._scopes.get(project)
+            top = sketches.errors.top(n) if sketches else []
+        return [{"topic": t, "count": c} for t, c, _ in top]
+
+    def dump_dirty(self):
+        """Serialized state of the scopes changed since the last call: [(scope, blob)]."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return [(name, self._scopes[name].dumps()) for name in dirty if name in self._scopes]
+
+    def pop_evicted(self):
+        """Scopes evicted since the last call, whose persisted state should be deleted."""
+        with self._lock:
+            evicted, self._evicted = self._evicted, set()
+            return sorted(evicted)
+
+    def load(self, states):
+        """Restore scopes from [(scope, blob)] as returned by dump_dirty(), oldest first."""
+        with self._lock:
+            for name, blob in states:
+                try:
+                    self._scopes[name] = TopicSketches.loads(blob)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                self._scopes.move_to_end(name)
+                self._evict()
+
+
+registry = SketchRegistry()
@@ -0,0 +1,262 @@
+# spool.py
+"""
+Circuit breaker around the database and durable on-disk spool for ingest writes.
+
+While the breaker is open (DB unreachable), ingest writes are appended to
+NDJSON segment files under SPOOL_DIR instead of blocking the MQTT thread on
+connection retries. A background thread replays the spooled records in
+batches, at most SPOOL_REPLAY_RATE records/s, once the DB answers again.
+
+Replay is at-least-once: the read position of the oldest segment is saved
+after each committed batch, so a crash can only replay one batch twice.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 3))
+DB_BREAKER_RESET_SECONDS = float(os.environ.get('DB_BREAKER_RESET_SECONDS', 10))
+SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', 1024 * 1024 * 1024))
+SPOOL_REPLAY_BATCH = int(os.environ.get('SPOOL_REPLAY_BATCH', 500))
+SPOOL_REPLAY_RATE = float(os.environ.get('SPOOL_REPLAY_RATE', 2000))     # records/s
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive errors; lets one probe through every `reset_seconds`."""
+
+    def __init__(self, failures=DB_BREAKER_FAILURES, reset_seconds=DB_BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN   # this caller is the probe
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("Base de données de nouveau joignable, circuit fermé")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.max_failures):
+                if self.state == CLOSED:
+                    logging.warning("Base de données injoignable, circuit ouvert (écritures vers le spool)")
+                    self.opened_count += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        with self._lock:
+            return self.state != CLOSED
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return {"$dt": obj.isoformat()}
+    raise TypeError(f"Type non sérialisable dans le spool: {type(obj).__name__}")
+
+
+def _decode(obj):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+class Spool:
+    """Append-only segment files of {"f": <write name>, "a": [args]} records."""
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._pending_bytes = None   # computed from disk on first use
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.replay_rate = 0.0
+        self._thread = None
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'spool-*.ndjson')))
+
+    def _total_bytes(self):
+        total = 0
+        for path in self._segments():
+            try:
+                total += os.path.getsize(path) - self._position(path)
+            except OSError:
+                pass
+        return total
+
+    def append(self, name, args):
+        """Spool one write; returns False if the spool is full (record dropped)."""
+        line = json.dumps({"f": name, "a": args}, default=_encode, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._pending_bytes is None:
+                self._pending_bytes = self._total_bytes()
+            if self._pending_bytes + len(line) > self.max_bytes:
+                self.dropped += 1
+                return False
+            if self._file is None or self._size + len(line) > self.segment_bytes:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._pending_bytes += len(line)
+            self.spooled += 1
+            return True
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"spool-{time.time_ns()}.ndjson")
+        self._file = open(self._path, 'ab')
+        self._size = 0
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._path = None
+
+    @staticmethod
+    def _position(path):
+        try:
+            with open(path + '.pos') as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def _save_position(path, pos):
+        tmp = path + '.pos.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(pos))
+        os.replace(tmp, path + '.pos')
+
+    def _read_batch(self, path, limit):
+        """(records, end_position) of up to `limit` complete lines after the saved position."""
+        records = []
+        pos = self._position(path)
+        with open(path, 'rb') as f:
+            f.seek(pos)
+            while len(records) < limit:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # end of file or partially written line
+                pos += len(line)
+                try:
+                    rec = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    continue
+                records.append((rec["f"], rec["a"]))
+        return records, pos
+
+    def _finish_segment(self, path):
+        """Remove a fully replayed segment (closing it first if it is being written)."""
+        with self._lock:
+            if path == self._path:
+                if self._position(path) < self._size:
+                    return
+                self._close_segment()
+            for p in (path, path + '.pos'):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def replay_once(self, apply_batch, batch_size=SPOOL_REPLAY_BATCH):
+        """Replay one batch from the oldest segment; returns the number of records applied."""
+        segments = self._segments()
+        if not segments:
+            return 0
+        path = segments[0]
+        start = self._position(path)
+        records, pos = self._read_batch(path, batch_size)
+        if records:
+            apply_batch(records)   # raises if the DB is down: position is not advanced
+            self._save_position(path, pos)
+            with self._lock:
+                self.replayed += len(records)
+                if self._pending_bytes is not None:
+                    self._pending_bytes = max(0, self._pending_bytes - (pos - start))
+        elif path != self._path or pos >= self._size:
+            self._finish_segment(path)
+        return len(records)
+
+    def _replay_loop(self, apply_batch, breaker, rate):
+        while True:
+            if not self._segments():
+                time.sleep(1)
+                continue
+            start = time.monotonic()
+            try:
+                # apply_batch goes through the breaker: it fails fast while the
+                # circuit is open and acts as the probe once it half-opens
+                n = self.replay_once(apply_batch)
+            except Exception as e:
+                if not breaker.is_open():
+                    logging.warning("Rejeu du spool interrompu : %s", e)
+                time.sleep(1)
+                continue
+            if n:
+                elapsed = time.monotonic() - start
+                self.replay_rate = n / max(elapsed, n / rate)
+                time.sleep(max(0.0, n / rate - elapsed))
+
+    def start_replayer(self, apply_batch, breaker, rate=SPOOL_REPLAY_RATE):
+        """Start the background replay thread (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._replay_loop, args=(apply_batch, breaker, rate),
+                                            name='spool-replay', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        segments = self._segments()
+        oldest_age = None
+        if segments:
+            created_ns = int(os.path.basename(segments[0])[len('spool-'):-len('.ndjson')])
+            oldest_age = round(time.time() - created_ns / 1e9, 1)
+        return {
+            "segments": len(segments),
+            "pending_bytes": self._total_bytes() if self._pending_bytes is None else self._pending_bytes,
+            "max_bytes": self.max_bytes,
+            "oldest_segment_age_seconds": oldest_age,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "replay_rate": round(self.replay_rate, 1),
+        }
+
+
+breaker = CircuitBreaker()
+spool = Spool()
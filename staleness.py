@@ -0,0 +1,207 @@
+# staleness.py
+"""
+Server-side detection of silent sensors with a hierarchical timing wheel.
+
+Every live series has one timer, due when the series has been silent for
+its module's expected publish interval times STALE_GRACE_FACTOR. Each
+message reschedules the timer in O(1) (remove from one slot dict, insert
+in another), and a background thread advances the wheel once per tick, so
+the cost does not depend on the number of series the way a periodic scan
+would.
+
+The wheel has STALE_WHEEL_LEVELS levels of 64 slots: level 0 counts
+1 s ticks, level 1 64 s, level 2 ~68 min, level 3 ~3 days. A timer is
+stored at the coarsest level that still distinguishes its deadline, and
+moves down a level each time the wheel above turns ("cascade").
+
+Expected intervals: STALE_DEFAULT_INTERVAL seconds, overridden per module
+with STALE_MODULE_INTERVALS="serre=300,meteo=900". Going silent and
+coming back are published as 'sensor_stale' / 'sensor_recovered' events.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+STALE_DEFAULT_INTERVAL = float(os.environ.get('STALE_DEFAULT_INTERVAL', 60))
+STALE_GRACE_FACTOR = float(os.environ.get('STALE_GRACE_FACTOR', 3))
+STALE_MODULE_INTERVALS = os.environ.get('STALE_MODULE_INTERVALS', '')
+STALE_WHEEL_LEVELS = 4
+STALE_WHEEL_SLOTS = 64
+STALE_TICK_SECONDS = 1.0
+
+
+def parse_intervals(spec):
+    """'module=seconds,...' -> {module: seconds}; malformed entries are ignored."""
+    intervals = {}
+    for item in spec.split(','):
+        module, _, seconds = item.strip().partition('=')
+        try:
+            intervals[module.strip()] = float(seconds)
+        except ValueError:
+            if item.strip():
+                logging.warning("STALE_MODULE_INTERVALS : entrée ignorée %r", item)
+    return intervals
+
+
+class TimingWheel:
+    """Hierarchical timing wheel: O(1) schedule/cancel, expiry in ticks."""
+
+    def __init__(self, now, tick=STALE_TICK_SECONDS, slots=STALE_WHEEL_SLOTS, levels=STALE_WHEEL_LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels)]   # ticks per slot at each level
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]   # key -> deadline tick
+        self._where = {}   # key -> (level, slot)
+        self.current = int(now // tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, deadline):
+        """(Re)arm the timer of `key` for the unix time `deadline`."""
+        self.cancel(key)
+        self._place(key, max(int(math.ceil(deadline / self.tick)), self.current + 1))
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is not None:
+            level, slot = where
+            del self._wheels[level][slot][key]
+
+    def _place(self, key, due):
+        delta = due - self.current
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        slot = (due // self._spans[level]) % self.slots
+        self._wheels[level][slot][key] = due
+        self._where[key] = (level, slot)
+
+    def advance(self, now):
+        """Move the wheel up to `now`; returns the keys whose timer expired."""
+        target = int(now // self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            # Cascade from the top: timers of the bucket just entered move to finer levels
+            for level in range(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if self.current % span:
+                    continue
+                bucket = self._wheels[level][(self.current // span) % self.slots]
+                moved = list(bucket.items())
+                bucket.clear()
+                for key, due in moved:
+                    del self._where[key]
+                    if due <= self.current:
+                        expired.append(key)
+                    else:
+                        self._place(key, due)
+            bucket = self._wheels[0][self.current % self.slots]
+            for key in list(bucket):
+                del self._where[key]
+                expired.append(key)
+            bucket.clear()
+        return expired
+
+
+class StalenessDetector:
+    def __init__(self, default_interval=STALE_DEFAULT_INTERVAL, grace_factor=STALE_GRACE_FACTOR,
+                 module_intervals=None):
+        self.default_interval = default_interval
+        self.grace_factor = grace_factor
+        self.module_intervals = (parse_intervals(STALE_MODULE_INTERVALS)
+                                 if module_intervals is None else module_intervals)
+        self._lock = threading.Lock()
+        self._wheel = TimingWheel(time.time())
+        self._last_seen = {}   # (module, variable) -> unix time of the latest message
+        self._stale = set()
+        self._thread = None
+        self.counters = {"stale_events": 0, "recovered_events": 0}
+
+    def expected_interval(self, module):
+        return self.module_intervals.get(module, self.default_interval)
+
+    def touch(self, module, variable, now):
+        """A message arrived: re-arm the timer. True if the series was stale (recovered)."""
+        key = (module, variable)
+        with self._lock:
+            self._last_seen[key] = now
+            self._wheel.schedule(key, now + self.expected_interval(module) * self.grace_factor)
+            if key in self._stale:
+                self._stale.discard(key)
+                self.counters["recovered_events"] += 1
+                return True
+            return False
+
+    def forget(self, module, variable):
+        """Stop watching a deleted or evicted series."""
+        key = (module, variable)
+        with self._lock:
+            self._wheel.cancel(key)
+            self._last_seen.pop(key, None)
+            self._stale.discard(key)
+
+    def expire(self, now):
+        """Advance to `now`; returns [(module, variable, last_seen)] that just went silent."""
+        with self._lock:
+            newly_stale = []
+            for key in self._wheel.advance(now):
+                self._stale.add(key)
+                newly_stale.append((key[0], key[1], self._last_seen.get(key)))
+            self.counters["stale_events"] += len(newly_stale)
+            return newly_stale
+
+    def stale_keys(self):
+        with self._lock:
+            return set(self._stale)
+
+    def start(self, publish):
+        """Advance the wheel every tick in a background thread; publish(event, data) per change."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(publish,), name='staleness', daemon=True)
+        self._thread.start()
+
+    def _run(self, publish):
+        while True:
+            time.sleep(STALE_TICK_SECONDS)
+            try:
+                for module, variable, last_seen in self.expire(time.time()):
+                    logging.info("Capteur silencieux : %s/%s", module, variable)
+                    publish('sensor_stale', {
+                        'module': module,
+                        'variable': variable,
+                        # Same format as the 'update_data' timestamps
+                        'last_seen': datetime.fromtimestamp(last_seen).isoformat(timespec='seconds') + 'Z'
+                                     if last_seen else None,
+                        'expected_interval': self.expected_interval(module),
+                    })
+            except Exception as e:
+                logging.error(f"Erreur détection capteurs silencieux: {e}")
+
+    def stats(self, limit=100):
+        now = time.time()
+        with self._lock:
+            stale = sorted(((now - self._last_seen.get(k, now), k) for k in self._stale), reverse=True)
+            per_module = {}
+            for _, (module, _) in stale:
+                per_module[module] = per_module.get(module, 0) + 1
+            return dict(
+                self.counters,
+                tracked=len(self._wheel),
+                stale=len(self._stale),
+                default_interval=self.default_interval,
+                grace_factor=self.grace_factor,
+                module_intervals=self.module_intervals,
+                stale_per_module=per_module,
+                stale_series=[{"module": m, "variable": v, "silent_seconds": round(silent)}
+                              for silent, (m, v) in stale[:limit]],
+            )
+
+
+stale_detector = StalenessDetector()
@@ -0,0 +1,140 @@
+# throttle.py
+"""
+Ingest admission control: per-project and per-topic token buckets.
+
+A project (or topic) publishing faster than its budget is not fully
+persisted: over-limit messages are counted, and only one in
+INGEST_SAMPLE_EVERY is still written to the database.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+INGEST_PROJECT_RATE = float(os.environ.get('INGEST_PROJECT_RATE', 20))    # msg/s sustained
+INGEST_PROJECT_BURST = float(os.environ.get('INGEST_PROJECT_BURST', 200))
+INGEST_TOPIC_RATE = float(os.environ.get('INGEST_TOPIC_RATE', 5))
+INGEST_TOPIC_BURST = float(os.environ.get('INGEST_TOPIC_BURST', 50))
+INGEST_SAMPLE_EVERY = int(os.environ.get('INGEST_SAMPLE_EVERY', 100))     # keep 1 in N over-limit msgs
+INGEST_THROTTLE = os.environ.get('INGEST_THROTTLE', '1') != '0'
+
+# A project is reported as throttled this long after its last rejected message
+THROTTLED_WINDOW_SECONDS = 60
+MAX_BUCKETS = 20000
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def consume(self, now, n=1):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+
+class ThrottleStats:
+    __slots__ = ('throttled', 'sampled', 'last_throttled')
+
+    def __init__(self):
+        self.throttled = 0
+        self.sampled = 0
+        self.last_throttled = 0.0
+
+
+class IngestThrottle:
+    def __init__(self, project_rate=INGEST_PROJECT_RATE, project_burst=INGEST_PROJECT_BURST,
+                 topic_rate=INGEST_TOPIC_RATE, topic_burst=INGEST_TOPIC_BURST,
+                 sample_every=INGEST_SAMPLE_EVERY, max_buckets=MAX_BUCKETS):
+        self.project_rate = project_rate
+        self.project_burst = project_burst
+        self.topic_rate = topic_rate
+        self.topic_burst = topic_burst
+        self.sample_every = max(1, sample_every)
+        self.max_buckets = max_buckets
+        self.enabled = INGEST_THROTTLE
+        self._lock = threading.Lock()
+        self._projects = OrderedDict()
+        self._topics = OrderedDict()
+        self._stats = OrderedDict()   # least recently throttled first
+
+    def partition(self, workers):
+        """Split the budgets across `workers` processes sharing the traffic evenly."""
+        workers = max(1, workers)
+        with self._lock:
+            self.project_rate /= workers
+            self.project_burst /= workers
+            self.topic_rate /= workers
+            self.topic_burst /= workers
+            self._projects.clear()
+            self._topics.clear()
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, project, topic, now=None):
+        """True if the message should be fully persisted (within budget, or sampled)."""
+        if not self.enabled:
+            return True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            allowed = self._bucket(self._topics, topic, self.topic_rate, self.topic_burst, now).consume(now)
+            if project:
+                # Always charge the project bucket so a flood spread over many topics is caught too
+                allowed = self._bucket(self._projects, project, self.project_rate,
+                                       self.project_burst, now).consume(now) and allowed
+            if allowed:
+                return True
+
+            key = project or topic
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = ThrottleStats()
+                if len(self._stats) > self.max_buckets:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(key)
+            stats.throttled += 1
+            stats.last_throttled = now
+            if stats.throttled % self.sample_every == 0:
+                stats.sampled += 1
+                return True
+            return False
+
+    def is_throttled(self, project, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            stats = self._stats.get(project)
+            return stats is not None and now - stats.last_throttled < THROTTLED_WINDOW_SECONDS
+
+    def snapshot(self, now=None):
+        """{project_or_topic: {...}} for every source that has been throttled."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return {
+                key: {
+                    "throttled": s.throttled,
+                    "sampled": s.sampled,
+                    "seconds_since_throttled": round(now - s.last_throttled, 1),
+                    "active": now - s.last_throttled < THROTTLED_WINDOW_SECONDS,
+                }
+                for key, s in self._stats.items()
+            }
+
+
+throttle = IngestThrottle()
@@ -0,0 +1,199 @@
+# timeseries.py
+"""
+In-memory ring-buffer counters for the per-project frequency / timeline
+panels and the global message-rate chart.
+
+Each ring is a pair of fixed-size arrays (bucket epoch, count): recording a
+message is O(1) and a slot whose epoch is outdated simply counts as empty,
+so no background expiry is needed and a stale checkpoint restores correctly.
+"""
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+GLOBAL_SCOPE = '__global__'
+
+MINUTE_SLOTS = 60   # per-minute counters over the last hour
+HOUR_SLOTS = 24     # per-hour counters over the last 24 h
+MAX_PROJECTS = 5000  # least recently active projects are evicted beyond this
+
+
+class RingCounter:
+    __slots__ = ('width', 'size', 'epochs', 'counts')
+
+    def __init__(self, width, size):
+        self.width = width          # bucket width in seconds
+        self.size = size
+        self.epochs = array('q', [-1]) * size
+        self.counts = array('L', [0]) * size
+
+    def add(self, ts, n=1):
+        epoch = int(ts // self.width)
+        i = epoch % self.size
+        current = self.epochs[i]
+        if current == epoch:
+            self.counts[i] += n
+        elif epoch > current:
+            self.epochs[i] = epoch
+            self.counts[i] = n
+        # else: older than what the slot holds, outside the window
+
+    def buckets(self, now=None):
+        """[(bucket_start_ts, count)] of non-empty buckets in the window, oldest first."""
+        now = time.time() if now is None else now
+        last = int(now // self.width)
+        result = []
+        for epoch in range(last - self.size + 1, last + 1):
+            i = epoch % self.size
+            if self.epochs[i] == epoch and self.counts[i]:
+                result.append((epoch * self.width, self.counts[i]))
+        return result
+
+    def to_list(self):
+        return [list(self.epochs), list(self.counts)]
+
+    def load_list(self, data):
+        epochs, counts = data
+        if len(epochs) == self.size and len(counts) == self.size:
+            self.epochs = array('q', epochs)
+            self.counts = array('L', counts)
+
+
+class ProjectSeries:
+    __slots__ = ('minutes', 'hours')
+
+    def __init__(self):
+        self.minutes = RingCounter(60, MINUTE_SLOTS)
+        self.hours = RingCounter(3600, HOUR_SLOTS)
+
+    def add(self, ts, n=1):
+        self.minutes.add(ts, n)
+        self.hours.add(ts, n)
+
+    def dumps(self):
+        return json.dumps({'m': self.minutes.to_list(), 'h': self.hours.to_list()}, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, data):
+        state = json.loads(data)
+        series = cls()
+        series.minutes.load_list(state['m'])
+        series.hours.load_list(state['h'])
+        return series
+
+
+def _format(ts, fmt):
+    return datetime.fromtimestamp(ts).strftime(fmt)
+
+
+class TimeSeriesRegistry:
+    """Per-project (and global) ring buffers fed by the ingest path."""
+
+    def __init__(self, max_projects=MAX_PROJECTS):
+        self.max_projects = max_projects
+        self._lock = threading.Lock()
+        self._projects = OrderedDict()
+        self._global = ProjectSeries()
+        self._dirty = set()
+
+    def _series(self, project):
+        series = self._projects.get(project)
+        if series is None:
+            series = self._projects[project] = ProjectSeries()
+            if len(self._projects) > self.max_projects:
+                evicted, _ = self._projects.popitem(last=False)
+                self._dirty.discard(evicted)
+        else:
+            self._projects.move_to_end(project)
+        return series
+
+    def record(self, project=None, ts=None, n=1):
+        """Count n messages of `project` (and globally) at unix time ts."""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._global.add(ts, n)
+            self._dirty.add(GLOBAL_SCOPE)
+            if project:
+                self._series(project).add(ts, n)
+                self._dirty.add(project)
+
+    def record_project(self, project, ts=None, n=1):
+        """Count n messages for `project` only (used to warm up from the DB)."""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._series(project).add(ts, n)
+            self._dirty.add(project)
+
+    def record_global(self, ts=None, n=1):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._global.add(ts, n)
+            self._dirty.add(GLOBAL_SCOPE)
+
+    def frequency(self, project):
+        """Messages per minute over the last hour, newest first (like the former SQL)."""
+        with self._lock:
+            series = self._projects.get(project)
+            buckets = series.minutes.buckets() if series else []
+        return [{"minute": _format(ts, '%Y-%m-%d %H:%M'), "count": n} for ts, n in reversed(buckets)]
+
+    def timeline(self, project):
+        """Messages per hour over the last 24 h, oldest first."""
+        with self._lock:
+            series = self._projects.get(project)
+            buckets = series.hours.buckets() if series else []
+        return [{"hour": _format(ts, '%Y-%m-%d %H:00'), "count": n} for ts, n in buckets]
+
+    def rate(self, project, minutes=5):
+        """Average messages per minute of `project` over the last `minutes` minutes."""
+        now = time.time()
+        with self._lock:
+            series = self._projects.get(project)
+            buckets = series.minutes.buckets(now) if series else []
+        since = (int(now // 60) - minutes + 1) * 60
+        return sum(n for ts, n in buckets if ts >= since) / minutes
+
+    def message_stats(self, limit=MINUTE_SLOTS):
+        """[(minute, count)] for the global message-rate chart, oldest first."""
+        with self._lock:
+            buckets = self._global.minutes.buckets()
+        return [(_format(ts, '%Y-%m-%d %H:%M'), n) for ts, n in buckets[-limit:]]
+
+    def is_empty(self):
+        return not self._projects and not self._global.minutes.buckets()
+
+    def memory_usage(self):
+        """Approximate bytes held by the ring arrays."""
+        per_series = sum(a.itemsize * len(a) for ring in (self._global.minutes, self._global.hours)
+                         for a in (ring.epochs, ring.counts))
+        return per_series * (len(self._projects) + 1)
+
+    def dump_dirty(self):
+        """Serialized state of the scopes changed since the last call: [(scope, blob)]."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            states = []
+            for name in dirty:
+                series = self._global if name == GLOBAL_SCOPE else self._projects.get(name)
+                if series is not None:
+                    states.append((name, series.dumps()))
+            return states
+
+    def load(self, states):
+        """Restore scopes from [(scope, blob)] as returned by dump_dirty()."""
+        with self._lock:
+            for name, blob in states:
+                try:
+                    series = ProjectSeries.loads(blob)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if name == GLOBAL_SCOPE:
+                    self._global = series
+                else:
+                    self._projects[name] = series
+
+
+registry = TimeSeriesRegistry()